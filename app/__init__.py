@@ -1,4 +1,25 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+import time
+import uuid
+import logging
+
+from .utils.structured_logging import setup_logging, bind_log_context, reset_log_context
+from .utils.timing import TimedRoute, start_request_timings, request_timings, format_server_timing, timings_as_log_fields
+from .utils.metrics import observe_request
+from .utils.query_budget import QUERY_BUDGET_MODE, ROUTE_QUERY_BUDGETS, OFF, count_queries, check_query_budget
+from .utils.custom_exceptions import QueryBudgetExceededException
+from .utils.profiling import SamplingProfiler, profiling_allowed, profiled_thread_ids
+from .utils.tracing import tracing_enabled, begin_span, finish_span, parse_traceparent
+from .utils.admission_control import admission_controller
+from .utils.idempotency import idempotency_controller
+from .utils.sharding import sharding_enabled
+
+# Done before anything else is imported, so that loggers created at import time pick up the configuration
+setup_logging()
+
+logger = logging.getLogger(__name__)
 
 # Can also just be done in the top of the routes file
 app = FastAPI(
@@ -8,7 +29,191 @@ app = FastAPI(
     # contact=,
 )
 
-# TODO -> Setup and configure the base logger here
+# Needs to be set before the routes are registered. Records endpoint and serialization timings.
+app.router.route_class = TimedRoute
+
+# Note: Middleware registered last runs first.
+
+@app.middleware("http")
+async def query_budget_middleware(request: Request, call_next):
+    """
+    Counts the SQL statements executed by each request, and checks them against the route's budget and for N+1
+    patterns (see app/utils/query_budget.py). Skipped entirely when QUERY_BUDGET_MODE is off.
+    """
+
+    if QUERY_BUDGET_MODE == OFF:
+        return await call_next(request)
+
+    with count_queries(name=f"{request.method} {request.url.path}") as counter:
+        response = await call_next(request)
+
+    route = request.scope.get("route")
+    max_queries = ROUTE_QUERY_BUDGETS.get(route.path) if route is not None else None
+    # The lookup of the user's shard, see app/utils/sharding.py
+    if max_queries is not None and sharding_enabled():
+        max_queries += 1
+
+    try:
+        check_query_budget(counter, max_queries=max_queries)
+    except QueryBudgetExceededException as e:
+        return JSONResponse(status_code=500, content={"message": str(e)})
+
+    response.headers["X-Query-Count"] = str(counter.count)
+
+    return response
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """
+    Records request counts and latencies by route template, for /metrics.
+    """
+
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        observe_request(request, status_code, time.perf_counter() - start)
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """
+    Collects the phase timings recorded while handling the request (see app/utils/timing.py), and returns them in
+    a Server-Timing header.
+    """
+
+    timings, token = start_request_timings()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+
+    total_duration = time.perf_counter() - start
+
+    response.headers["Server-Timing"] = format_server_timing(timings, total_duration=total_duration)
+
+    # Routes are logged by their template, so that requests to the same endpoint can be grouped
+    route = request.scope.get("route")
+    logger.info(
+        "Request handled",
+        extra={
+            "method": request.method,
+            "route": route.path if route is not None else request.url.path,
+            "status_code": response.status_code,
+            "duration_ms": round(total_duration * 1000, 2),
+            **timings_as_log_fields(timings),
+        },
+    )
+
+    return response
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """
+    Starts the root span of the request, continuing the caller's trace if a traceparent header was sent. The trace
+    ID is returned in the X-Trace-Id header.
+    """
+
+    if not tracing_enabled():
+        return await call_next(request)
+
+    trace_id, parent_span_id = parse_traceparent(request.headers.get("traceparent"))
+
+    span, token = begin_span(
+        f"{request.method} {request.url.path}",
+        trace_id=trace_id,
+        parent_span_id=parent_span_id,
+        **{
+            "http.method": request.method,
+            "http.target": request.url.path,
+        },
+    )
+
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        finish_span(span, token, exception=e)
+        raise
+
+    # Named by the route template once routed, so spans for the same endpoint can be grouped
+    route = request.scope.get("route")
+    if route is not None:
+        span.name = f"{request.method} {route.path}"
+        span.set_attribute("http.route", route.path)
+    span.set_attribute("http.status_code", response.status_code)
+
+    finish_span(span, token)
+
+    response.headers["X-Trace-Id"] = span.trace_id
+
+    return response
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """
+    Runs the request under the sampling profiler if it has an 'X-Profile: 1' header or a 'profile=1' query
+    parameter, and the environment allows it. The profile's ID is returned in the X-Profile-Id header, and the
+    profile can be fetched from /debug/profiles/{profile_id}. Only the threads running the request's endpoint are
+    sampled, so requests handled at the same time aren't included.
+    """
+
+    profile_requested = (
+        request.headers.get("X-Profile", "").lower() in ["1", "true"]
+        or request.query_params.get("profile", "").lower() in ["1", "true"]
+    )
+
+    if not (profile_requested and profiling_allowed()):
+        return await call_next(request)
+
+    thread_ids = set()
+    thread_ids_token = profiled_thread_ids.set(thread_ids)
+    profiler = SamplingProfiler(thread_ids=thread_ids).start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+        profiled_thread_ids.reset(thread_ids_token)
+
+    response.headers["X-Profile-Id"] = profiler.save(f"{request.method}_{request.url.path}")
+
+    return response
+
+@app.middleware("http")
+async def idempotency_middleware(request: Request, call_next):
+    """
+    Replays the stored response for retried writes with an Idempotency-Key header, rather than handling them again,
+    see app/utils/idempotency.py. Runs after admission control, so waiting retries don't take slots from new requests.
+    """
+
+    return await idempotency_controller(request, call_next)
+
+@app.middleware("http")
+async def admission_control_middleware(request: Request, call_next):
+    """
+    Limits how many requests each route (or tag of routes) can have running and queued at once, and sheds the rest
+    with a 503, see app/utils/admission_control.py. Runs before everything but the log context, so shed requests cost
+    as little as possible.
+    """
+
+    return await admission_controller(request, call_next)
+
+@app.middleware("http")
+async def log_context_middleware(request: Request, call_next):
+    """
+    Binds a request ID to every log record made while handling the request.
+    """
+
+    # Cloud Run provides a trace ID, which lets our logs be grouped with the platform's request logs
+    request_id = request.headers.get("X-Cloud-Trace-Context", "").split("/")[0] or uuid.uuid4().hex
+
+    tokens = bind_log_context(request_id=request_id)
+    try:
+        return await call_next(request)
+    finally:
+        reset_log_context(tokens)
 
 # Registers all the routes to the app object, as that code is now executed
 from app import routes
\ No newline at end of file
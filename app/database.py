@@ -9,6 +9,10 @@ from sqlalchemy.orm import sessionmaker
 from os import getenv
 
 from .utils.database_connection import generate_db_url
+from .utils.timing import instrument_engine_timings
+from .utils.metrics import instrument_engine_metrics
+from .utils.query_budget import instrument_engine_query_counting
+from .utils.tracing import instrument_engine_tracing
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
@@ -25,11 +29,51 @@ SQLALCHEMY_BINDS = {
     "core_db": db_url
 }
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    # TODO -> Pass more parameters here, or in session
-)
+# A read replica, for reads that shouldn't compete with the API's traffic, such as analytics exports. Optional.
+replica_db_url = getenv('REPLICA_DB_URL')
+if replica_db_url:
+    SQLALCHEMY_BINDS["replica_db"] = replica_db_url
+
+# Further databases that users' data is sharded across, as comma separated name=url pairs, see app/utils/sharding.py.
+# Optional, core_db is always a shard, and holds the shard directory and the users' logins.
+shard_db_urls = {}
+for shard_entry in filter(None, getenv('SHARD_DB_URLS', '').split(',')):
+    shard_name, shard_url = shard_entry.split('=', 1)
+    shard_db_urls[shard_name.strip()] = shard_url.strip()
+SQLALCHEMY_BINDS.update(shard_db_urls)
+
+def _create_instrumented_engine(url, bind_name):
+
+    new_engine = create_engine(
+        url,
+        # TODO -> Pass more parameters here, or in session
+    )
+
+    # Records time spent in SQL against the current request, see app/utils/timing.py
+    instrument_engine_timings(new_engine)
+    # Query counts/durations and pool usage for /metrics, see app/utils/metrics.py
+    instrument_engine_metrics(new_engine, database=bind_name)
+    # Statement counts per request and N+1 detection, see app/utils/query_budget.py
+    instrument_engine_query_counting(new_engine)
+    # A span per statement, when tracing is enabled, see app/utils/tracing.py
+    instrument_engine_tracing(new_engine)
+
+    return new_engine
+
+engine = _create_instrumented_engine(SQLALCHEMY_DATABASE_URL, "core_db")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Bind name -> engine and session factory, for every shard including core_db
+shard_engines = {"core_db": engine}
+shard_sessions = {"core_db": SessionLocal}
+for shard_name, shard_url in shard_db_urls.items():
+    shard_engines[shard_name] = _create_instrumented_engine(shard_url, shard_name)
+    shard_sessions[shard_name] = sessionmaker(autocommit=False, autoflush=False, bind=shard_engines[shard_name])
+
+# None if no replica is configured, in which case callers decide whether to fall back to the primary
+replica_engine = None
+if replica_db_url:
+    replica_engine = create_engine(replica_db_url)
+
 Base = declarative_base()
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+Versioned schema migrations, for changes to databases that already exist. New databases get the full schema from
+app/models.py via /create_tables, which then runs the migrations too. So statements must be safe to run against a
+schema that already has their changes (eg IF NOT EXISTS), and models must be kept in step with migrations.
+
+Each migration is a module in this package, listed in MIGRATIONS, with:
+
+VERSION: int. Migrations are applied in order of version, and each is only ever applied once.
+DESCRIPTION: str. Stored alongside the version in the schema_migrations table.
+TRANSACTIONAL: bool. Whether the statements run in one transaction. Must be False for statements such as
+    CREATE INDEX CONCURRENTLY, which can't.
+STATEMENTS: List[str]. The SQL to run.
+
+Run with: python -m app.migrations [status|upgrade]
+"""
+
+import logging
+
+from sqlalchemy import text
+
+from . import (
+    v0001_per_user_indexes, v0002_user_data_versions, v0003_finished_workouts_user_id, v0004_finished_workout_sessions,
+    v0005_idempotency_keys, v0006_export_time_range_indexes, v0007_user_stats,
+    v0008_personal_records, v0009_user_daily_activity, v0010_user_shards,
+    v0011_personal_records_finished_workout_index, v0012_finished_component_values,
+)
+from ..models import SchemaMigrations
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = sorted(
+    [
+        v0001_per_user_indexes,
+        v0002_user_data_versions,
+        v0003_finished_workouts_user_id,
+        v0004_finished_workout_sessions,
+        v0005_idempotency_keys,
+        v0006_export_time_range_indexes,
+        v0007_user_stats,
+        v0008_personal_records,
+        v0009_user_daily_activity,
+        v0010_user_shards,
+        v0011_personal_records_finished_workout_index,
+        v0012_finished_component_values,
+    ],
+    key=lambda migration: migration.VERSION,
+)
+
+# Held while migrating, so that two instances starting a deploy at once don't both apply the same migration
+MIGRATION_LOCK_ID = 72_160_001
+
+def applied_versions(connection):
+    """
+    :return: Set[int]. Versions already applied to the database.
+    """
+
+    SchemaMigrations.__table__.create(bind=connection, checkfirst=True)
+    return {
+        row.version
+        for row in connection.execute(text("SELECT version FROM schema_migrations"))
+    }
+
+def _record_applied(connection, migration):
+    connection.execute(
+        text(
+            "INSERT INTO schema_migrations (version, description) VALUES (:version, :description) "
+            "ON CONFLICT (version) DO NOTHING"
+        ),
+        {"version": migration.VERSION, "description": migration.DESCRIPTION},
+    )
+
+def _apply(engine, autocommit_connection, migration):
+
+    if migration.TRANSACTIONAL:
+        # A connection of its own, since the autocommit connection can't hold a transaction open
+        with engine.begin() as connection:
+            for statement in migration.STATEMENTS:
+                connection.execute(text(statement))
+            _record_applied(connection, migration)
+    else:
+        for statement in migration.STATEMENTS:
+            autocommit_connection.execute(text(statement))
+        _record_applied(autocommit_connection, migration)
+
+def run_migrations(engine):
+    """
+    Applies any migrations the database doesn't have yet, in order.
+    :param engine: Engine. The database to migrate.
+    :return: List[int]. Versions that were applied.
+    """
+
+    applied = []
+
+    # Autocommit, since some statements can't run in a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+
+        connection.execute(text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+        try:
+            already_applied = applied_versions(connection)
+            for migration in MIGRATIONS:
+                if migration.VERSION in already_applied:
+                    continue
+                logger.info("Applying migration", extra={"version": migration.VERSION, "description": migration.DESCRIPTION})
+                _apply(engine, connection, migration)
+                applied.append(migration.VERSION)
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+
+    return applied
+
+def migration_status(engine):
+    """
+    :return: List[Tuple(int, str, bool)]. Each migration's version, description and whether it has been applied.
+    """
+
+    with engine.begin() as connection:
+        already_applied = applied_versions(connection)
+
+    return [
+        (migration.VERSION, migration.DESCRIPTION, migration.VERSION in already_applied)
+        for migration in MIGRATIONS
+    ]
@@ -0,0 +1,25 @@
+import argparse
+
+from ..database import shard_engines
+from . import run_migrations, migration_status
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Apply schema migrations to the configured databases, every shard included")
+    parser.add_argument("command", choices=["status", "upgrade"], nargs="?", default="status")
+    args = parser.parse_args()
+
+    for shard_name, engine in shard_engines.items():
+
+        if len(shard_engines) > 1:
+            print(f"[{shard_name}]")
+
+        if args.command == "upgrade":
+            applied = run_migrations(engine)
+            print(f"Applied: {applied}" if applied else "Already up to date")
+
+        for version, description, is_applied in migration_status(engine):
+            print(f"{version:>4} {'applied' if is_applied else 'pending':<8} {description}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Indexes for the per-user access paths: a user's workouts, their components, the latest version of each component, the
+components of finished workouts, and a user's action log. Matches the Index definitions in app/models.py.
+
+Built CONCURRENTLY, so writes to these tables aren't blocked while the indexes are built on a live database.
+"""
+
+VERSION = 1
+DESCRIPTION = "Indexes for per-user access paths"
+
+# CREATE INDEX CONCURRENTLY can't run inside a transaction
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_workouts_user_id_datetime_created
+    ON user_workouts (user_id, datetime_created)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_workout_components_workout_id_position
+    ON workout_components (workout_id, position)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_workout_component_history_component_id_datetime_added
+    ON workout_component_history (workout_component_id, datetime_added)
+    INCLUDE (reps, weight, units)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_finished_workout_components_finished_workout_id
+    ON finished_workout_components (finished_workout_id)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_finished_workout_components_workout_component_id
+    ON finished_workout_components (workout_component_id)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_action_log_user_id_action_datetime
+    ON action_log (user_id, action_datetime)
+    """,
+]
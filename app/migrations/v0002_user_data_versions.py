@@ -0,0 +1,18 @@
+"""
+Adds user_data_versions, the per-user counter that response caching for /workouts/saved is keyed on. Matches
+UserDataVersions in app/models.py. Users without a row are at version 0.
+"""
+
+VERSION = 2
+DESCRIPTION = "Per-user data versions, for response caching"
+
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS user_data_versions (
+        user_id UUID PRIMARY KEY REFERENCES users (user_id),
+        version BIGINT NOT NULL
+    )
+    """,
+]
@@ -0,0 +1,39 @@
+"""
+Adds the user to finished_workouts, so a user's finished workouts in a time range can be found with an index, rather
+than through every component they have ever finished. Matches FinishedWorkouts in app/models.py.
+
+Existing rows are filled in from their components. Each statement is safe to run again, so the migration runs outside a
+transaction and the index is built CONCURRENTLY, without blocking writes on a live database. Finished workouts with no
+components have no user to fill in, and are left without one.
+"""
+
+VERSION = 3
+DESCRIPTION = "User of each finished workout"
+
+# CREATE INDEX CONCURRENTLY can't run inside a transaction
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    """
+    ALTER TABLE finished_workouts
+    ADD COLUMN IF NOT EXISTS user_id UUID REFERENCES users (user_id)
+    """,
+    """
+    UPDATE finished_workouts
+    SET user_id = owners.user_id
+    FROM (
+        SELECT DISTINCT ON (finished_workout_components.finished_workout_id)
+            finished_workout_components.finished_workout_id,
+            user_workouts.user_id
+        FROM finished_workout_components
+        JOIN workout_components ON workout_components.workout_component_id = finished_workout_components.workout_component_id
+        JOIN user_workouts ON user_workouts.workout_id = workout_components.workout_id
+    ) AS owners
+    WHERE finished_workouts.finished_workout_id = owners.finished_workout_id
+    AND finished_workouts.user_id IS NULL
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_finished_workouts_user_id_completed_datetime
+    ON finished_workouts (user_id, completed_datetime)
+    """,
+]
@@ -0,0 +1,42 @@
+"""
+Finished workouts uploaded from the app's offline queue: the app's ID for each session, unique per user so uploads can
+be retried safely, and when each finished workout was recorded by the API. completed_datetime is now when the workout
+was completed, which for uploaded sessions is the app's time, so syncing uses datetime_recorded instead. Matches
+FinishedWorkouts in app/models.py.
+
+Existing finished workouts were all recorded when they were completed. Adding the column gives them the time of the
+migration, so they're given their completion time instead. Each statement is safe to run again, and the indexes are
+built CONCURRENTLY, so the migration runs outside a transaction.
+"""
+
+VERSION = 4
+DESCRIPTION = "Client session IDs and recording times of finished workouts"
+
+# CREATE INDEX CONCURRENTLY can't run inside a transaction
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    """
+    ALTER TABLE finished_workouts
+    ADD COLUMN IF NOT EXISTS client_session_id VARCHAR(64)
+    """,
+    """
+    ALTER TABLE finished_workouts
+    ADD COLUMN IF NOT EXISTS datetime_recorded TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    """,
+    # Uploaded sessions have a client_session_id, and are recorded after they're completed, so are left alone
+    """
+    UPDATE finished_workouts
+    SET datetime_recorded = completed_datetime
+    WHERE client_session_id IS NULL
+    AND datetime_recorded <> completed_datetime
+    """,
+    """
+    CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_finished_workouts_user_id_client_session_id
+    ON finished_workouts (user_id, client_session_id)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_finished_workouts_user_id_datetime_recorded
+    ON finished_workouts (user_id, datetime_recorded)
+    """,
+]
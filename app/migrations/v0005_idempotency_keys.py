@@ -0,0 +1,27 @@
+"""
+Adds idempotency_keys, the stored responses of write requests sent with an Idempotency-Key header, see
+app/utils/idempotency.py. Matches IdempotencyKeys in app/models.py.
+"""
+
+VERSION = 5
+DESCRIPTION = "Stored responses for Idempotency-Key requests"
+
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        idempotency_key_id VARCHAR(64) PRIMARY KEY,
+        request_hash VARCHAR(64) NOT NULL,
+        status_code INTEGER,
+        content_type VARCHAR(100),
+        response_body BYTEA,
+        claimed_datetime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        expires_datetime TIMESTAMP NOT NULL
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_datetime
+    ON idempotency_keys (expires_datetime)
+    """,
+]
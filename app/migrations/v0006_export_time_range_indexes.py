@@ -0,0 +1,29 @@
+"""
+Adds BRIN indexes on the time columns analytics exports read by (see app/utils/bulk_export.py), so each incremental
+export only reads the blocks holding rows added since the last one. Matches the indexes in app/models.py.
+
+Rows are added in time order, so each block of these tables covers a narrow time range, which is what BRIN indexes
+summarise. They're a tiny fraction of the size of B-tree indexes, and add almost nothing to the cost of inserts.
+Built CONCURRENTLY, without blocking writes on a live database.
+"""
+
+VERSION = 6
+DESCRIPTION = "BRIN indexes for time range exports"
+
+# CREATE INDEX CONCURRENTLY can't run inside a transaction
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_workout_component_history_datetime_added_brin
+    ON workout_component_history USING brin (datetime_added)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_finished_workouts_datetime_recorded_brin
+    ON finished_workouts USING brin (datetime_recorded)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_action_log_action_datetime_brin
+    ON action_log USING brin (action_datetime)
+    """,
+]
@@ -0,0 +1,47 @@
+"""
+Adds the tables holding each user's training stats (see app/utils/stats.py): user_stats, user_workout_periods and
+user_exercise_stats. Matches UserStats, UserWorkoutPeriods and UserExerciseStats in app/models.py.
+
+The tables start empty, and finished workouts are added to them from then on. Stats for workouts finished before then
+are filled in by running, after deploying:
+
+    python -m app.utils.stats rebuild
+"""
+
+VERSION = 7
+DESCRIPTION = "Per-user training stats"
+
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id UUID PRIMARY KEY REFERENCES users (user_id),
+        workout_count INTEGER NOT NULL,
+        current_streak_weeks INTEGER NOT NULL,
+        longest_streak_weeks INTEGER NOT NULL,
+        last_workout_week DATE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_workout_periods (
+        user_id UUID REFERENCES users (user_id),
+        period_type VARCHAR(5),
+        period_start DATE,
+        workout_count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, period_type, period_start)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_exercise_stats (
+        user_id UUID REFERENCES users (user_id),
+        exercise_id UUID REFERENCES exercises (exercise_id),
+        completed_count INTEGER NOT NULL,
+        total_reps BIGINT NOT NULL,
+        total_volume_kg DOUBLE PRECISION NOT NULL,
+        best_one_rep_max_kg DOUBLE PRECISION,
+        best_one_rep_max_datetime TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (user_id, exercise_id)
+    )
+    """,
+]
@@ -0,0 +1,42 @@
+"""
+Adds the parsed reps of each component version (reps_min and reps_max), and personal_records, each user's heaviest
+weight per exercise and number of reps. Matches WorkoutComponentHistory and PersonalRecords in app/models.py.
+
+Existing versions have their reps parsed here, with the same rules as parse_reps in shared/general.py. Records of
+workouts finished before then are filled in by python -m app.utils.stats rebuild.
+"""
+
+VERSION = 8
+DESCRIPTION = "Parsed reps, and personal records"
+
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    ALTER TABLE workout_component_history
+    ADD COLUMN IF NOT EXISTS reps_min INTEGER,
+    ADD COLUMN IF NOT EXISTS reps_max INTEGER
+    """,
+    """
+    UPDATE workout_component_history
+    SET
+        reps_min = CAST(substring(reps FROM '[0-9]{1,9}') AS INTEGER),
+        reps_max = GREATEST(
+            CAST(substring(reps FROM '[0-9]{1,9}') AS INTEGER),
+            CAST((regexp_match(reps, '[0-9]{1,9}[^0-9]+([0-9]{1,9})'))[1] AS INTEGER)
+        )
+    WHERE reps_min IS NULL
+    AND reps ~ '[0-9]'
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS personal_records (
+        user_id UUID REFERENCES users (user_id),
+        exercise_id UUID REFERENCES exercises (exercise_id),
+        reps INTEGER,
+        weight_kg DOUBLE PRECISION NOT NULL,
+        finished_workout_id UUID NOT NULL REFERENCES finished_workouts (finished_workout_id),
+        achieved_datetime TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (user_id, exercise_id, reps)
+    )
+    """,
+]
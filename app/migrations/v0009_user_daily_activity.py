@@ -0,0 +1,28 @@
+"""
+Adds user_daily_activity, each user's workouts, components, reps and volume per day, for the activity calendar (see
+app/utils/activity.py). Matches UserDailyActivity in app/models.py.
+
+The table starts empty, and finished workouts are added to it from then on. Days before then are filled in by running,
+after deploying:
+
+    python -m app.utils.stats rebuild
+"""
+
+VERSION = 9
+DESCRIPTION = "Per-user daily activity"
+
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS user_daily_activity (
+        user_id UUID REFERENCES users (user_id),
+        activity_date DATE,
+        workout_count INTEGER NOT NULL,
+        component_count INTEGER NOT NULL,
+        total_reps BIGINT NOT NULL,
+        total_volume_kg DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (user_id, activity_date)
+    )
+    """,
+]
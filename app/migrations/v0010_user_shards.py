@@ -0,0 +1,19 @@
+"""
+Adds user_shards, the directory of which database each user's data is stored on (see app/utils/sharding.py). Matches
+UserShards in app/models.py. Users without a row are stored in core_db, so existing data stays where it is.
+"""
+
+VERSION = 10
+DESCRIPTION = "Shard directory"
+
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS user_shards (
+        user_id UUID PRIMARY KEY REFERENCES users (user_id),
+        shard_name VARCHAR(63) NOT NULL,
+        assigned_datetime TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
@@ -0,0 +1,20 @@
+"""
+Indexes personal_records by the finished workout each record was set in. Matches the index in app/models.py.
+
+Deleting finished workouts has to check that no personal record still refers to them, which without this index is a
+scan of personal_records per finished workout deleted, eg when a user is moved to another shard (see
+app/utils/sharding.py). Built CONCURRENTLY, without blocking writes on a live database.
+"""
+
+VERSION = 11
+DESCRIPTION = "Index personal records by finished workout"
+
+# CREATE INDEX CONCURRENTLY can't run inside a transaction
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_personal_records_finished_workout_id
+    ON personal_records (finished_workout_id)
+    """,
+]
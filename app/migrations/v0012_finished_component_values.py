@@ -0,0 +1,25 @@
+"""
+Adds the reps, weight and units each component was completed with to finished_workout_components. Matches
+FinishedWorkoutComponents in app/models.py.
+
+Only sessions uploaded from the app's offline queue fill them in, as a batch can hold several sessions with different
+values for the same component, and a session completed before the component's latest version mustn't replace it.
+Finished workouts recorded as they're completed leave them null, and their values are the component's version at the
+time. Existing rows are left null.
+"""
+
+VERSION = 12
+DESCRIPTION = "Values of finished workout components"
+
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    ALTER TABLE finished_workout_components
+    ADD COLUMN IF NOT EXISTS reps VARCHAR(30),
+    ADD COLUMN IF NOT EXISTS reps_min INTEGER,
+    ADD COLUMN IF NOT EXISTS reps_max INTEGER,
+    ADD COLUMN IF NOT EXISTS weight DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS units VARCHAR(30)
+    """,
+]
@@ -1,7 +1,7 @@
 from .database import Base
+from shared.general import uuid7, parse_reps
 
-import uuid
-from sqlalchemy import ForeignKey, func, Column, String, Integer, DateTime, Boolean, Float
+from sqlalchemy import ForeignKey, func, Column, String, Integer, BigInteger, Date, DateTime, Boolean, Float, Index, LargeBinary
 
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -11,7 +11,7 @@ class Users(Base):
 
     __tablename__ = "users"
 
-    user_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True) # Auto filled
+    user_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True) # Auto filled
     username = Column(String(30), unique=True, nullable=False)
 
     def __init__(self,
@@ -44,7 +44,7 @@ class Actions(Base):
 
     __tablename__ = "actions"
 
-    action_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True) # Auto filled
+    action_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True) # Auto filled
     action_name = Column(String(30), unique=True, nullable=False)
 
     def __init__(self,
@@ -63,7 +63,7 @@ class ActionLog(Base):
     can result in the user being logged out in the app. But does track loggin attempts.
     """
 
-    log_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True) # Auto filled
+    log_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True) # Auto filled
 
     user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id))
     # Other useful fields could be added here as needed.
@@ -71,6 +71,13 @@ class ActionLog(Base):
     action_id = Column(UUID(as_uuid=True), ForeignKey(Actions.action_id))
     action_datetime = Column(DateTime(timezone=False), server_default=func.current_timestamp(), nullable=False) # Auto filled
 
+    __table_args__ = (
+        # A user's actions, most recent first
+        Index("ix_action_log_user_id_action_datetime", "user_id", "action_datetime"),
+        # Every user's actions in a time range, for analytics exports. BRIN, as rows are added in time order.
+        Index("ix_action_log_action_datetime_brin", "action_datetime", postgresql_using="brin"),
+    )
+
     def __init__(self,
                  user_id,
                  action_id,
@@ -84,7 +91,7 @@ class Exercises(Base):
 
     __tablename__ = "exercises"
 
-    exercise_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True) # Auto filled
+    exercise_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True) # Auto filled
     exercise_name = Column(String(30), unique=True, nullable=False)
 
     # TODO - Other info like image/icon, desc, tips, instructions
@@ -100,7 +107,7 @@ class UserWorkouts(Base):
 
     __tablename__ = "user_workouts"
 
-    workout_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True) # Auto filled
+    workout_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True) # Auto filled
     # TODO -> Link to workout metadata table?
     user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id))
     workout_name = Column(String(100), unique=False, nullable=False)
@@ -108,6 +115,11 @@ class UserWorkouts(Base):
 
     datetime_created = Column(DateTime(timezone=False), server_default=func.current_timestamp(), nullable=False) # Auto filled
 
+    __table_args__ = (
+        # A user's workouts, in the order they were created
+        Index("ix_user_workouts_user_id_datetime_created", "user_id", "datetime_created"),
+    )
+
     def __init__(self,
                  user_id,
                  workout_name,
@@ -124,12 +136,16 @@ class WorkoutComponents(Base):
 
     __tablename__ = "workout_components"
 
-    workout_component_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True) # Auto filled
+    workout_component_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True) # Auto filled
     workout_id = Column(UUID(as_uuid=True), ForeignKey(UserWorkouts.workout_id))
     exercise_id = Column(UUID(as_uuid=True), ForeignKey(Exercises.exercise_id))
 
     position = Column(Integer, nullable=False)
 
+    __table_args__ = (
+        Index("ix_workout_components_workout_id_position", "workout_id", "position"),
+    )
+
     def __init__(self,
                  workout_id,
                  exercise_id,
@@ -151,15 +167,30 @@ class WorkoutComponentHistory(Base):
 
     __tablename__ = "workout_component_history"
 
-    workout_component_history_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True) # Auto filled
+    workout_component_history_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True) # Auto filled
     workout_component_id = Column(UUID(as_uuid=True), ForeignKey(WorkoutComponents.workout_component_id), nullable=False)
 
     datetime_added = Column(DateTime(timezone=False), server_default=func.current_timestamp(), nullable=False) # Auto filled
 
     reps = Column(String(30), nullable=False) # Not an Int since could be a range
+    # Parsed from reps when the version is saved, so stats and records don't parse the text. Null if reps has no numbers.
+    reps_min = Column(Integer)
+    reps_max = Column(Integer)
     weight = Column(Float, nullable=False)
     units = Column(String(30), nullable=False)
 
+    __table_args__ = (
+        # Latest version of each component. Includes the version's values, so they can be read from the index alone.
+        Index(
+            "ix_workout_component_history_component_id_datetime_added",
+            "workout_component_id",
+            "datetime_added",
+            postgresql_include=["reps", "weight", "units"],
+        ),
+        # Every version added in a time range, for analytics exports. BRIN, as rows are added in time order.
+        Index("ix_workout_component_history_datetime_added_brin", "datetime_added", postgresql_using="brin"),
+    )
+
     def __init__(self,
                  workout_component_id,
                  reps,
@@ -170,6 +201,7 @@ class WorkoutComponentHistory(Base):
         
         self.workout_component_id = workout_component_id
         self.reps = reps
+        self.reps_min, self.reps_max = parse_reps(reps)
         self.weight = weight
         self.units = units
 
@@ -181,11 +213,38 @@ class FinishedWorkouts(Base):
     __tablename__ = "finished_workouts"
 
     # Essentially indicates which completed components are related (can't use workout ID, needs to be an ID for this specific completion instance)
-    finished_workout_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True)
+    finished_workout_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True)
+    # Nullable, as finished workouts from before this was added that had no components have no known user
+    user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id))
+    # The app's ID for sessions uploaded from its offline queue, so that retried uploads aren't recorded twice
+    client_session_id = Column(String(64))
+    # When the workout was completed. For uploaded sessions, this is the app's time rather than the API's.
     completed_datetime = Column(DateTime(timezone=False), server_default=func.current_timestamp(), nullable=False)
+    # When the API recorded the finished workout
+    datetime_recorded = Column(DateTime(timezone=False), server_default=func.current_timestamp(), nullable=False) # Auto filled
+
+    __table_args__ = (
+        # A user's finished workouts, in the order they were completed
+        Index("ix_finished_workouts_user_id_completed_datetime", "user_id", "completed_datetime"),
+        # A user's finished workouts, in the order they were recorded, for syncing
+        Index("ix_finished_workouts_user_id_datetime_recorded", "user_id", "datetime_recorded"),
+        Index("ux_finished_workouts_user_id_client_session_id", "user_id", "client_session_id", unique=True),
+        # Every finished workout recorded in a time range, for analytics exports. BRIN, as rows are added in time order.
+        Index("ix_finished_workouts_datetime_recorded_brin", "datetime_recorded", postgresql_using="brin"),
+    )
+
+    def __init__(self,
+                 user_id=None,
+                 client_session_id=None,
+                 completed_datetime=None,
+                 **kwargs,
+                 ):
 
-    def __init__(self):
-        pass
+        self.user_id = user_id
+        self.client_session_id = client_session_id
+        # Left unset so the server default applies
+        if completed_datetime is not None:
+            self.completed_datetime = completed_datetime
 
 class FinishedWorkoutComponents(Base):
     """
@@ -194,14 +253,295 @@ class FinishedWorkoutComponents(Base):
 
     __tablename__ = "finished_workout_components"
 
-    finished_workout_component_id = Column(UUID(as_uuid=True), default=uuid.uuid4, primary_key=True)
+    finished_workout_component_id = Column(UUID(as_uuid=True), default=uuid7, primary_key=True)
     finished_workout_id = Column(UUID(as_uuid=True), ForeignKey(FinishedWorkouts.finished_workout_id), nullable=False)
     workout_component_id = Column(UUID(as_uuid=True), ForeignKey(WorkoutComponents.workout_component_id), nullable=False)
 
+    # What the component was completed with, for sessions uploaded from the app's offline queue. Null otherwise, in
+    # which case the values are those of the component's version when the workout was recorded.
+    reps = Column(String(30))
+    reps_min = Column(Integer)
+    reps_max = Column(Integer)
+    weight = Column(Float)
+    units = Column(String(30))
+
+    __table_args__ = (
+        Index("ix_finished_workout_components_finished_workout_id", "finished_workout_id"),
+        Index("ix_finished_workout_components_workout_component_id", "workout_component_id"),
+    )
+
     def __init__(self,
                  finished_workout_id,
                  workout_component_id,
+                 reps=None,
+                 weight=None,
+                 units=None,
                  ):
         
         self.workout_component_id = workout_component_id
-        self.finished_workout_id = finished_workout_id
\ No newline at end of file
+        self.finished_workout_id = finished_workout_id
+        self.reps = reps
+        self.reps_min, self.reps_max = parse_reps(reps) if reps is not None else (None, None)
+        self.weight = weight
+        self.units = units
+
+class SchemaMigrations(Base):
+    """
+    Versions of app/migrations that have been applied to this database
+    """
+
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String(200), nullable=False)
+    applied_datetime = Column(DateTime(timezone=False), server_default=func.current_timestamp(), nullable=False) # Auto filled
+
+    def __init__(self,
+                 version,
+                 description,
+                 **kwargs,
+                 ):
+
+        self.version = version
+        self.description = description
+
+class UserDataVersions(Base):
+    """
+    A counter per user, increased by every write to the user's workouts. Cached responses and ETags are tied to
+    the version they were made from, so they're invalidated by any write, from any worker.
+    """
+
+    __tablename__ = "user_data_versions"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id), primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+    def __init__(self,
+                 user_id,
+                 version=0,
+                 **kwargs,
+                 ):
+
+        self.user_id = user_id
+        self.version = version
+
+class IdempotencyKeys(Base):
+    """
+    Responses to write requests sent with an Idempotency-Key header, replayed to retries of them. See
+    app/utils/idempotency.py.
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    # Hash of the key, and the user and endpoint it was used for
+    idempotency_key_id = Column(String(64), primary_key=True)
+    # Hash of the request body, so a key reused for a different request can be rejected
+    request_hash = Column(String(64), nullable=False)
+
+    # Null while the request is still being handled
+    status_code = Column(Integer)
+    content_type = Column(String(100))
+    response_body = Column(LargeBinary)
+
+    claimed_datetime = Column(DateTime(timezone=False), server_default=func.current_timestamp(), nullable=False) # Auto filled
+    expires_datetime = Column(DateTime(timezone=False), nullable=False)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires_datetime", "expires_datetime"),
+    )
+
+    def __init__(self,
+                 idempotency_key_id,
+                 request_hash,
+                 expires_datetime,
+                 **kwargs,
+                 ):
+
+        self.idempotency_key_id = idempotency_key_id
+        self.request_hash = request_hash
+        self.expires_datetime = expires_datetime
+
+class UserStats(Base):
+    """
+    Each user's workout totals and weekly streaks, kept up to date as workouts are finished. See app/utils/stats.py.
+    """
+
+    __tablename__ = "user_stats"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id), primary_key=True)
+    workout_count = Column(Integer, nullable=False)
+    # The streak ending in last_workout_week, whether or not it has since been broken
+    current_streak_weeks = Column(Integer, nullable=False)
+    longest_streak_weeks = Column(Integer, nullable=False)
+    # Start (Monday) of the latest week with a workout
+    last_workout_week = Column(Date)
+
+    def __init__(self,
+                 user_id,
+                 workout_count=0,
+                 current_streak_weeks=0,
+                 longest_streak_weeks=0,
+                 last_workout_week=None,
+                 **kwargs,
+                 ):
+
+        self.user_id = user_id
+        self.workout_count = workout_count
+        self.current_streak_weeks = current_streak_weeks
+        self.longest_streak_weeks = longest_streak_weeks
+        self.last_workout_week = last_workout_week
+
+class UserWorkoutPeriods(Base):
+    """
+    Workouts each user completed in each week and month they completed any in
+    """
+
+    __tablename__ = "user_workout_periods"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id), primary_key=True)
+    # week or month
+    period_type = Column(String(5), primary_key=True)
+    # First day of the period
+    period_start = Column(Date, primary_key=True)
+    workout_count = Column(Integer, nullable=False)
+
+    def __init__(self,
+                 user_id,
+                 period_type,
+                 period_start,
+                 workout_count,
+                 **kwargs,
+                 ):
+
+        self.user_id = user_id
+        self.period_type = period_type
+        self.period_start = period_start
+        self.workout_count = workout_count
+
+class UserExerciseStats(Base):
+    """
+    Each user's totals for each exercise they have completed. Weights are in kg, whatever units they were saved in.
+    """
+
+    __tablename__ = "user_exercise_stats"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id), primary_key=True)
+    exercise_id = Column(UUID(as_uuid=True), ForeignKey(Exercises.exercise_id), primary_key=True)
+
+    completed_count = Column(Integer, nullable=False)
+    total_reps = Column(BigInteger, nullable=False)
+    total_volume_kg = Column(Float, nullable=False)
+    # Null until the exercise is completed with a known number of reps
+    best_one_rep_max_kg = Column(Float)
+    best_one_rep_max_datetime = Column(DateTime(timezone=False))
+
+    def __init__(self,
+                 user_id,
+                 exercise_id,
+                 completed_count=0,
+                 total_reps=0,
+                 total_volume_kg=0.0,
+                 **kwargs,
+                 ):
+
+        self.user_id = user_id
+        self.exercise_id = exercise_id
+        self.completed_count = completed_count
+        self.total_reps = total_reps
+        self.total_volume_kg = total_volume_kg
+
+class PersonalRecords(Base):
+    """
+    The heaviest weight each user has completed each exercise with, for each number of reps. Kept up to date as workouts
+    are finished, so new records are found with a lookup per exercise. See app/utils/stats.py.
+    """
+
+    __tablename__ = "personal_records"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id), primary_key=True)
+    exercise_id = Column(UUID(as_uuid=True), ForeignKey(Exercises.exercise_id), primary_key=True)
+    # The lowest of the component's reps, when it's a range
+    reps = Column(Integer, primary_key=True)
+
+    weight_kg = Column(Float, nullable=False)
+    finished_workout_id = Column(UUID(as_uuid=True), ForeignKey(FinishedWorkouts.finished_workout_id), nullable=False)
+    achieved_datetime = Column(DateTime(timezone=False), nullable=False)
+
+    __table_args__ = (
+        # Checked by the foreign key when finished workouts are deleted
+        Index("ix_personal_records_finished_workout_id", "finished_workout_id"),
+    )
+
+    def __init__(self,
+                 user_id,
+                 exercise_id,
+                 reps,
+                 weight_kg,
+                 finished_workout_id,
+                 achieved_datetime,
+                 **kwargs,
+                 ):
+
+        self.user_id = user_id
+        self.exercise_id = exercise_id
+        self.reps = reps
+        self.weight_kg = weight_kg
+        self.finished_workout_id = finished_workout_id
+        self.achieved_datetime = achieved_datetime
+
+class UserDailyActivity(Base):
+    """
+    What each user completed on each day they finished a workout, for the activity calendar. Keyed by user, so a range
+    of a user's days is read from the primary key without going through finished_workouts. Kept up to date as workouts
+    are finished, see app/utils/stats.py.
+    """
+
+    __tablename__ = "user_daily_activity"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id), primary_key=True)
+    # In the database's time zone, as the weeks and months of the stats are
+    activity_date = Column(Date, primary_key=True)
+
+    workout_count = Column(Integer, nullable=False)
+    component_count = Column(Integer, nullable=False)
+    total_reps = Column(BigInteger, nullable=False)
+    total_volume_kg = Column(Float, nullable=False)
+
+    def __init__(self,
+                 user_id,
+                 activity_date,
+                 workout_count=0,
+                 component_count=0,
+                 total_reps=0,
+                 total_volume_kg=0.0,
+                 **kwargs,
+                 ):
+
+        self.user_id = user_id
+        self.activity_date = activity_date
+        self.workout_count = workout_count
+        self.component_count = component_count
+        self.total_reps = total_reps
+        self.total_volume_kg = total_volume_kg
+
+class UserShards(Base):
+    """
+    The shard directory: which database each user's workouts and stats are stored on, see app/utils/sharding.py.
+    Only used in core_db. Users without a row are stored in core_db, as every user was before sharding.
+    """
+
+    __tablename__ = "user_shards"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(Users.user_id), primary_key=True)
+    # A bind name, from SHARD_DB_URLS, or core_db
+    shard_name = Column(String(63), nullable=False)
+    assigned_datetime = Column(DateTime(timezone=False), server_default=func.current_timestamp(), nullable=False) # Auto filled
+
+    def __init__(self,
+                 user_id,
+                 shard_name,
+                 **kwargs,
+                 ):
+
+        self.user_id = user_id
+        self.shard_name = shard_name
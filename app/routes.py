@@ -1,13 +1,13 @@
-from fastapi import Depends, HTTPException, Request, Query
-from fastapi.responses import JSONResponse 
+from fastapi import Depends, HTTPException, Request, Query, Header
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from sqlalchemy.orm import Session
-from typing import Annotated
+from typing import Annotated, Literal
 
 from app import app
 
-from .database import SessionLocal, engine
+from .database import SessionLocal, shard_engines
 from . import models
 
 from sqlalchemy import exc
@@ -15,7 +15,9 @@ from sqlalchemy import exc
 import jwt
 import json
 import os
-from datetime import timedelta
+import logging
+import asyncio
+from datetime import date, timedelta
 
 from .schemas import (
     BasePOSTResponse, BaseErrorResponse,
@@ -26,15 +28,20 @@ from .schemas import (
     CreateWorkoutSchema,
     WorkoutRecommendationRequestSchema, WorkoutRecommendationResponseSchema,
     SavedWorkoutsResponseSchema,
+    SyncResponseSchema,
     UpdateComponentsSchema, RetrievedWorkoutComponentSchema,
-    FinishWorkoutSchema,
+    FinishWorkoutSchema, FinishWorkoutResponseSchema,
+    UserStatsResponseSchema, UserActivityResponseSchema,
+    NextSessionResponseSchema,
+    FinishedSessionsUploadSchema, FinishedSessionsUploadResponseSchema,
 )
 # These need to be imported in order to be visible to functions like db.create_all
-from .models import Users, UserPasswordHashes, WorkoutComponentHistory, FinishedWorkouts, FinishedWorkoutComponents
+from .models import FinishedWorkouts
 from .utils.database import (
     create_new_workout, handle_integrity_errors, generic_add_to_table,
     attempt_insert_new_user,login_user, populate_base_tables,
-    get_workouts_for_user,
+    get_workouts_for_user, insert_changed_component_versions, insert_finished_workout_components,
+    insert_finished_sessions,
 )
 from .utils.jwt import (
     generate_jwt, verify_jwt, verify_jwt_throws,
@@ -44,9 +51,27 @@ from .utils.logging import (
     log_action,
     SUCCESSFUL_LOG_IN, UNSUCCESSFUL_LOG_IN, LOGGED_OUT,
 )
-from .utils.custom_exceptions import ExerciseDoesNotExistException, UsernameAlreadyExistsException, UsernameDoesNotExistException
+from .utils.custom_exceptions import (
+    ExerciseDoesNotExistException, UsernameAlreadyExistsException, UsernameDoesNotExistException,
+    WorkoutComponentNotOwnedException, WorkoutNotOwnedException, InvalidSyncCursorException,
+    InvalidDateRangeException,
+)
 from .route_functions import create_workout_raw
 from .utils.langchain import simple_prompt
+from .utils.metrics import generate_metrics, metrics_allowed, route_label, http_exception_responses_total, response_cache_lookups_total
+from .utils.profiling import SamplingProfiler, profiling_allowed, load_profile, PROFILING_ENVS
+from .migrations import run_migrations
+from .utils.user_cache import get_user_credentials
+from .utils.admission_control import llm_user_quota, export_user_quota
+from .utils.response_cache import get_user_data_version, make_etag, etag_matches, get_cached_response, cache_response
+from .utils.sync import get_changes_for_user
+from .utils.export import stream_export, EXPORT_MEDIA_TYPES
+from .utils.stats import record_finished_workouts, get_user_stats
+from .utils.progression import suggest_next_session
+from .utils.activity import resolve_date_range, get_user_activity, DAY
+from .utils.sharding import open_user_session, get_user_sessionmaker, assign_new_user_shard, replicate_catalogs
+
+logger = logging.getLogger(__name__)
 
 class EnvironmentPermissionError(Exception):
     pass
@@ -69,20 +94,33 @@ def get_db():
     finally:
         db_session.close()
 
+# Dependancy. Used to get a connection to the database the authorized user's data is on, see app/utils/sharding.py
+def get_user_db(
+    request: Request,
+    decoded_access_token: str = Depends(requires_authorization),
+):
+    with open_user_session(decoded_access_token["user_id"], for_write=request.method != "GET") as db_session:
+        yield db_session
+
 # # Modifies how these exceptions are handled, using 'message' instead of 'detail'.
 # https://fastapi.tiangolo.com/tutorial/handling-errors/
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request, exc):
+    if exc.status_code >= 500:
+        logger.error("Request failed", extra={"path": request.url.path, "status_code": exc.status_code, "detail": exc.detail})
+    http_exception_responses_total.labels(route_label(request), str(exc.status_code)).inc()
     return JSONResponse(
         status_code=exc.status_code, 
         content={
             "message" : exc.detail,
         },
+        # Such as Retry-After
+        headers=getattr(exc, "headers", None),
     )
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    print("[RequestValidationError]", exc.errors())
+    logger.info("Request failed validation", extra={"path": request.url.path, "errors": exc.errors()})
     return JSONResponse(
         status_code=422,
         content={
@@ -90,6 +128,95 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         },
     )
 
+# Scraped by Prometheus. Not part of the public API, so hidden from the docs, and a 404 unless allowed.
+@app.get('/metrics', include_in_schema=False)
+def metrics(
+    authorization: Annotated[str | None, Header()] = None,
+):
+
+    if not metrics_allowed(authorization):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    metrics_text, content_type = generate_metrics()
+
+    return Response(content=metrics_text, media_type=content_type)
+
+@app.post(
+    '/debug/profile',
+    response_class=PlainTextResponse,
+    responses={
+        403: {"model": BaseErrorResponse, "description" : "Profiling is not allowed in this environment"},
+    },
+    tags=["debug"],
+)
+async def profile_worker(
+    seconds: Annotated[
+        float,
+        Query(
+            gt=0,
+            le=300,
+            description="How long to profile the worker for",
+        ),
+    ] = 10,
+    interval_ms: Annotated[
+        float,
+        Query(
+            ge=1,
+            le=1000,
+            description="Milliseconds between samples",
+        ),
+    ] = 5,
+    all_threads: Annotated[
+        bool,
+        Query(
+            description="Keep samples from every thread, not just those running the API's own code",
+        ),
+    ] = False,
+):
+    """
+    Profiles every request handled by this worker for the given number of seconds. Returns the profile in the
+    folded stack format, which flame graph tools such as speedscope can open.
+    """
+
+    if not profiling_allowed():
+        raise HTTPException(status_code=403, detail=f"Cannot profile outside of the following environments: {PROFILING_ENVS}")
+
+    profiler = SamplingProfiler(interval=interval_ms / 1000, app_frames_only=not all_threads).start()
+    try:
+        # Async, so that this worker keeps handling the requests being profiled
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+
+    profile_id = profiler.save("worker")
+
+    return PlainTextResponse(profiler.folded(), headers={"X-Profile-Id": profile_id})
+
+@app.get(
+    '/debug/profiles/{profile_id}',
+    response_class=PlainTextResponse,
+    responses={
+        403: {"model": BaseErrorResponse, "description" : "Profiling is not allowed in this environment"},
+        404: {"model": BaseErrorResponse, "description" : "No profile with this ID exists on this worker"},
+    },
+    tags=["debug"],
+)
+def get_profile(
+    profile_id: str,
+):
+    """
+    Returns a profile saved by a profiled request (see the X-Profile-Id response header) or by /debug/profile.
+    """
+
+    if not profiling_allowed():
+        raise HTTPException(status_code=403, detail=f"Cannot profile outside of the following environments: {PROFILING_ENVS}")
+
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile doesn't exist")
+
+    return PlainTextResponse(profile)
+
 # TODO
 # @app.route('/')
 # def home():
@@ -103,9 +230,15 @@ def create_tables(db_session: Session = Depends(get_db)):
 
     try:
 
-        models.Base.metadata.create_all(bind=engine)
+        # Every shard has the full schema, see app/utils/sharding.py
+        for shard_engine in shard_engines.values():
+            models.Base.metadata.create_all(bind=shard_engine)
+            # Brings tables that already existed up to date, see app/migrations
+            run_migrations(shard_engine)
 
         populate_base_tables(db_session=db_session)
+        # The other shards' catalogs are copies of core_db's, so the IDs match on every shard
+        replicate_catalogs()
 
     except (Exception) as e:
         return {'message': str(e)}, 500
@@ -120,7 +253,8 @@ def drop_tables(db_session: Session = Depends(get_db)):
         # Only allow the API to drop tables if being run in certain environments
         envs_allowed = ["dev", "debug"]
         if os.environ["ENV"] in envs_allowed:
-            models.Base.metadata.drop_all(bind=engine)
+            for shard_engine in shard_engines.values():
+                models.Base.metadata.drop_all(bind=shard_engine)
             db_session.commit()
         else:
             raise EnvironmentPermissionError(f"Cannot drop tables outside of the following environments: {envs_allowed}")
@@ -148,6 +282,7 @@ def signup(
     try:
         
         user_id = attempt_insert_new_user(payload, db_session=db_session)
+        assign_new_user_shard(db_session=db_session, user_id=user_id, username=payload.username)
     except exc.IntegrityError as e:
         raise handle_integrity_errors(e)
     except UsernameAlreadyExistsException as e:
@@ -186,20 +321,12 @@ def get_salt(
     db_session: Session = Depends(get_db),
 ):
 
-    # TODO -> Refactor this
     try:
-        requestedUsername = username
-        results = (
-            db_session
-            .query(Users, UserPasswordHashes)
-            .filter(Users.user_id == UserPasswordHashes.user_id)
-            .filter(Users.username == requestedUsername)
-            .first()
-        )
-        if results is None:
+        # Cached, so that the login which follows doesn't repeat the lookup
+        credentials = get_user_credentials(db_session, username)
+        if credentials is None:
             raise HTTPException(status_code=404, detail="Username doesn't exist")
-        # Make this [1] access safer
-        found_salt = results[1]
+        found_salt = SaltResponseSchema(salt=credentials.salt)
 
     # Catching this in the generic block will result in the HTTPException being wrapped in an extra layer of HTTPException
     except HTTPException as http_exc:
@@ -207,7 +334,6 @@ def get_salt(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    # FastAPI is able to work with ORM results, so this just works
     return {
         "payload" : found_salt,
     }
@@ -285,7 +411,7 @@ def get_access_token(
         try:
             decoded_refresh_token = verify_jwt_throws(refresh_token)
         except jwt.ExpiredSignatureError:
-            print("[DEBUG] Refresh Token expired")
+            logger.debug("Refresh token expired")
             raise HTTPException(status_code=403, detail=f'Refresh token was expired')
         except jwt.InvalidTokenError:
             raise HTTPException(status_code=403, detail=f'Refresh token was invalid')
@@ -320,7 +446,7 @@ def get_access_token(
 )
 def create_workout(
     payload: CreateWorkoutSchema,
-    db_session: Session = Depends(get_db),
+    db_session: Session = Depends(get_user_db),
     decoded_access_token: str = Depends(requires_authorization),
 ):
 
@@ -333,20 +459,21 @@ def create_workout(
     responses={
         401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
         404: {"model": BaseErrorResponse, "description" : "Exercise requested doesn't exist"},
+        429: {"model": BaseErrorResponse, "description" : "The user has too many recommendations in progress, or requested too many recently"},
+        503: {"model": BaseErrorResponse, "description" : "The server is too busy, retry after the Retry-After header's seconds"},
     },
     tags=["workouts"],
 )
 def create_workout_recommendation(
     payload: WorkoutRecommendationRequestSchema,
-    db_session: Session = Depends(get_db),
     decoded_access_token: str = Depends(requires_authorization),
+    # Each recommendation is several LLM calls, so users are limited in how many they can make
+    llm_quota: None = Depends(llm_user_quota),
 ):
 
     try:
 
-        print("Running the route...")
-
-        # Use real user ID
+        # Use real user ID. The tools open their own sessions, on the user's shard.
         ai_message = simple_prompt(
             user_query=payload.recommendation_request,
             user_id=decoded_access_token["user_id"],
@@ -369,36 +496,178 @@ def create_workout_recommendation(
     '/workouts/saved',
     response_model=BasePOSTResponse[SavedWorkoutsResponseSchema],
     responses={
+        304: {"description" : "The workouts haven't changed since the If-None-Match ETag was returned"},
         401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
     },
     status_code=200,
     tags=["workouts"],
 )
 def get_workouts(
-    db_session: Session = Depends(get_db),
+    db_session: Session = Depends(get_user_db),
     decoded_access_token: str = Depends(requires_authorization),
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
+    """
+    Returns an ETag with the workouts. Sending it back as If-None-Match returns an empty 304 if nothing has changed.
+    """
 
     try:
 
-        print("Running the route...")
-
         user_id = decoded_access_token["user_id"]
-        print("[I] UserID:", user_id)
+        logger.debug("Retrieving saved workouts", extra={"user_id": user_id})
+
+        # Increased by every write to the user's workouts, see app/utils/response_cache.py
+        version = get_user_data_version(db_session=db_session, user_id=user_id)
+        headers = {
+            "ETag": make_etag("saved", user_id, version),
+            # The app may keep its copy, but has to revalidate it before use
+            "Cache-Control": "private, no-cache",
+        }
+
+        if etag_matches(if_none_match, headers["ETag"]):
+            response_cache_lookups_total.labels("saved", "not_modified").inc()
+            return Response(status_code=304, headers=headers)
+
+        body = get_cached_response("saved", user_id, version)
+
+        if body is None:
+
+            workouts = get_workouts_for_user(
+                db_session=db_session,
+                user_id=user_id,
+            )
+
+            # TODO -> Response schema isn't the final response schema at the moment
+            payload = {
+                "workouts" : workouts,
+            }
+
+            # Serialized here rather than by FastAPI, so the bytes can be cached
+            body = BasePOSTResponse[SavedWorkoutsResponseSchema](payload=payload).model_dump_json().encode()
+            cache_response("saved", user_id, version, body)
 
-        workouts = get_workouts_for_user(
+    except exc.IntegrityError as e:
+        raise handle_integrity_errors(e)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get(
+    '/sync',
+    response_model=BasePOSTResponse[SyncResponseSchema],
+    responses={
+        400: {"model": BaseErrorResponse, "description" : "The sync cursor isn't valid"},
+        401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
+    },
+    status_code=200,
+    tags=["workouts"],
+)
+def sync(
+    since: Annotated[str | None, Query(description="The cursor returned by the last sync. Leave out to get everything")] = None,
+    db_session: Session = Depends(get_user_db),
+    decoded_access_token: str = Depends(requires_authorization),
+):
+    """
+    Returns the workouts, components and finished workouts created or changed since the last sync, and a cursor to
+    send with the next one. Items already received may be returned again, so they should be upserted by ID.
+    """
+
+    try:
+
+        changes = get_changes_for_user(
             db_session=db_session,
-            user_id=user_id,
+            user_id=decoded_access_token["user_id"],
+            cursor=since,
         )
-        # print(json.dumps(workouts, indent=4))
-        # Sort of pointless call, but at reminds that this schema is followed.
 
-        # TODO -> Response schema isn't the final response schema at the moment
-        payload = workouts
+        logger.debug(
+            "Synced workouts",
+            extra={
+                "full": changes["full"],
+                "workout_count": len(changes["workouts"]),
+                "component_count": len(changes["workout_components"]),
+                "finished_workout_count": len(changes["finished_workouts"]),
+            },
+        )
 
-        payload = {
-            "workouts" : payload,
-        }
+    except InvalidSyncCursorException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except exc.IntegrityError as e:
+        raise handle_integrity_errors(e)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {'payload': changes}
+
+@app.get(
+    '/users/export',
+    response_class=StreamingResponse,
+    responses={
+        200: {"description" : "The user's workouts, every version of their components, and their finished workouts, one record per line"},
+        401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
+        429: {"model": BaseErrorResponse, "description" : "The user has requested too many exports recently"},
+    },
+    tags=["users"],
+)
+def export_user_history(
+    export_format: Annotated[Literal["ndjson", "csv"], Query(alias="format", description="ndjson or csv")] = "ndjson",
+    accept_encoding: Annotated[str | None, Header()] = None,
+    decoded_access_token: str = Depends(requires_authorization),
+    export_quota: None = Depends(export_user_quota),
+):
+    """
+    Streams the user's full training history, see app/utils/export.py. Gzipped if the client accepts it.
+    """
+
+    compress = "gzip" in (accept_encoding or "").lower()
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="workout_history.{export_format}"',
+        "Cache-Control": "private, no-store",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(
+        stream_export(
+            get_user_sessionmaker(decoded_access_token["user_id"]),
+            decoded_access_token["user_id"],
+            export_format,
+            compress=compress,
+        ),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers=headers,
+    )
+
+@app.get(
+    '/users/stats',
+    response_model=BasePOSTResponse[UserStatsResponseSchema],
+    responses={
+        401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
+    },
+    status_code=200,
+    tags=["users"],
+)
+def user_stats(
+    db_session: Session = Depends(get_user_db),
+    decoded_access_token: str = Depends(requires_authorization),
+):
+    """
+    Returns the user's workout totals, weekly streaks, recent workouts per week and month, and per exercise totals and
+    best estimated one rep maxes. Kept up to date as workouts are finished, see app/utils/stats.py.
+    """
+
+    try:
+
+        stats = get_user_stats(
+            db_session=db_session,
+            user_id=decoded_access_token["user_id"],
+        )
 
     except exc.IntegrityError as e:
         raise handle_integrity_errors(e)
@@ -407,7 +676,120 @@ def get_workouts(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    return {'payload': payload}
+    return {'payload': stats}
+
+@app.get(
+    '/users/activity',
+    response_model=BasePOSTResponse[UserActivityResponseSchema],
+    responses={
+        304: {"description" : "Weeks and months only. The activity hasn't changed since the ETag sent in If-None-Match"},
+        400: {"model": BaseErrorResponse, "description" : "The range is not valid, or too long"},
+        401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
+    },
+    status_code=200,
+    tags=["users"],
+)
+def user_activity(
+    start_date: Annotated[date | None, Query(alias="from", description="First day of the range. Defaults to 364 days before the last")] = None,
+    end_date: Annotated[date | None, Query(alias="to", description="Last day of the range. Defaults to today")] = None,
+    resolution: Annotated[Literal["day", "week", "month"], Query(description="day, week or month")] = "day",
+    db_session: Session = Depends(get_user_db),
+    decoded_access_token: str = Depends(requires_authorization),
+    if_none_match: Annotated[str | None, Header()] = None,
+):
+    """
+    Returns the user's workouts, components, reps and volume per day, week or month, for up to a year, for the activity
+    calendar. See app/utils/activity.py. Weeks and months are cached, and returned with an ETag, as /workouts/saved is.
+    """
+
+    try:
+
+        user_id = decoded_access_token["user_id"]
+        start_date, end_date = resolve_date_range(start_date=start_date, end_date=end_date)
+
+        headers = {}
+        body = None
+
+        # Days are a short read of the daily rollup, but weeks and months are totalled from up to a year of it
+        cached = resolution != DAY
+        if cached:
+
+            version = get_user_data_version(db_session=db_session, user_id=user_id)
+            variant = f"{resolution}:{start_date}:{end_date}"
+            headers = {
+                "ETag": make_etag(f"activity-{resolution}-{start_date}-{end_date}", user_id, version),
+                "Cache-Control": "private, no-cache",
+            }
+
+            if etag_matches(if_none_match, headers["ETag"]):
+                response_cache_lookups_total.labels("activity", "not_modified").inc()
+                return Response(status_code=304, headers=headers)
+
+            body = get_cached_response("activity", user_id, version, variant=variant)
+
+        if body is None:
+
+            activity = get_user_activity(
+                db_session=db_session,
+                user_id=user_id,
+                start_date=start_date,
+                end_date=end_date,
+                resolution=resolution,
+            )
+
+            body = BasePOSTResponse[UserActivityResponseSchema](payload=activity).model_dump_json().encode()
+            if cached:
+                cache_response("activity", user_id, version, body, variant=variant)
+
+    except InvalidDateRangeException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except exc.IntegrityError as e:
+        raise handle_integrity_errors(e)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get(
+    '/workouts/{workout_id}/next',
+    response_model=BasePOSTResponse[NextSessionResponseSchema],
+    responses={
+        401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
+        404: {"model": BaseErrorResponse, "description" : "The workout doesn't exist or belongs to another user"},
+    },
+    status_code=200,
+    tags=["workouts"],
+)
+def next_workout_session(
+    workout_id: str,
+    db_session: Session = Depends(get_user_db),
+    decoded_access_token: str = Depends(requires_authorization),
+):
+    """
+    Suggests the reps and weight for the next session of each of the workout's components, from the trend of their
+    recent sessions, see app/utils/progression.py.
+    """
+
+    try:
+
+        workout_components = suggest_next_session(
+            db_session=db_session,
+            user_id=decoded_access_token["user_id"],
+            workout_id=workout_id,
+        )
+
+    except WorkoutNotOwnedException as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except exc.IntegrityError as e:
+        raise handle_integrity_errors(e)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {'payload': {"workout_id": workout_id, "workout_components": workout_components}}
 
 @app.post(
     '/workouts/update/components',
@@ -416,37 +798,34 @@ def get_workouts(
     status_code=200,
     responses={
         401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
+        403: {"model": BaseErrorResponse, "description" : "Some of the workout components don't belong to the user, these are listed"},
     },
     tags=["workouts"],
 )
 def update_workout(
     # TODO -> Use UpdateComponentsSchema
     payload: list[RetrievedWorkoutComponentSchema],
-    db_session: Session = Depends(get_db),
+    db_session: Session = Depends(get_user_db),
     decoded_access_token: str = Depends(requires_authorization),
 ):
 
-    # TODO -> Validate the user is the user these components are associated with
+    # DONE -> Validate the user is the user these components are associated with
 
-    # DONE -> Add a new version of all the components in the history table
+    # DONE -> Add a new version of the changed components in the history table
 
     try:
 
-        print("payload:", payload)
-
-        db_session.add_all(
-            map(
-                lambda w_c: WorkoutComponentHistory(
-                    workout_component_id=w_c.workout_component_id,
-                    reps=w_c.reps,
-                    weight=w_c.weight,
-                    units=w_c.units,
-                ),
-                payload,
-            ),
+        changed_count = insert_changed_component_versions(
+            db_session=db_session,
+            user_id=decoded_access_token["user_id"],
+            workout_components=payload,
         )
         db_session.commit()
 
+        logger.debug("Updated workout components", extra={"component_count": len(payload), "changed_count": changed_count})
+
+    except WorkoutComponentNotOwnedException as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except exc.IntegrityError as e:
         raise handle_integrity_errors(e)
     except HTTPException as http_exc:
@@ -458,27 +837,28 @@ def update_workout(
 
 @app.post(
     '/workouts/finish',
-    response_model=BaseErrorResponse,
+    response_model=FinishWorkoutResponseSchema,
     status_code=201,
     responses={
         401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
+        403: {"model": BaseErrorResponse, "description" : "Some of the workout components don't belong to the user, these are listed"},
     },
     tags=["workouts"],
 )
 def finish_workout(
     # TODO -> Use FinishWorkoutSchema
     payload: list[RetrievedWorkoutComponentSchema],
-    db_session: Session = Depends(get_db),
+    db_session: Session = Depends(get_user_db),
     decoded_access_token: str = Depends(requires_authorization),
 ):
 
-    # TODO -> Validate the user is the user these components are associated with
+    # DONE -> Validate the user is the user these components are associated with
 
     # TODO -> Sanity check that the workout components are from the same workout? Might be fine/better to decouple this though
 
     try:
 
-        new_finished_workout_row = FinishedWorkouts()
+        new_finished_workout_row = FinishedWorkouts(user_id=decoded_access_token["user_id"])
         (
             db_session
             .add(
@@ -491,17 +871,76 @@ def finish_workout(
 
         finished_workout_id = new_finished_workout_row.finished_workout_id
 
-        db_session.add_all(
-            map(
-                lambda w_c: FinishedWorkoutComponents(
-                    finished_workout_id=finished_workout_id,
-                    workout_component_id=w_c.workout_component_id,
-                ),
-                payload,
-            ),
+        insert_finished_workout_components(
+            db_session=db_session,
+            user_id=decoded_access_token["user_id"],
+            finished_workout_id=finished_workout_id,
+            workout_component_ids=[w_c.workout_component_id for w_c in payload],
         )
+
+        # Updated in the same transaction, so they always match the finished workouts
+        stats = record_finished_workouts(
+            db_session=db_session,
+            user_id=decoded_access_token["user_id"],
+            finished_workout_ids=[finished_workout_id],
+        )
+        db_session.commit()
+
+    except WorkoutComponentNotOwnedException as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except exc.IntegrityError as e:
+        raise handle_integrity_errors(e)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        db_session.rollback()
+
+    # TODO -> Could in future also return how long the workout took
+    return {"message": "Workout Finished", "stats": stats}
+
+@app.post(
+    '/workouts/sessions',
+    response_model=BasePOSTResponse[FinishedSessionsUploadResponseSchema],
+    status_code=200,
+    responses={
+        401: {"model": BaseErrorResponse, "description" : "There were authorization issues"},
+        403: {"model": BaseErrorResponse, "description" : "Some of the workout components don't belong to the user, these are listed. Nothing was recorded"},
+    },
+    tags=["workouts"],
+)
+def upload_finished_sessions(
+    payload: FinishedSessionsUploadSchema,
+    db_session: Session = Depends(get_user_db),
+    decoded_access_token: str = Depends(requires_authorization),
+):
+    """
+    Records sessions finished while offline, each with its component changes, in one request and one transaction,
+    rather than an update and a finish per session. Safe to retry: sessions already uploaded are reported as duplicates.
+    """
+
+    try:
+
+        results = insert_finished_sessions(
+            db_session=db_session,
+            user_id=decoded_access_token["user_id"],
+            sessions=payload.sessions,
+        )
+
+        created_ids = [result["finished_workout_id"] for result in results if result["status"] == "created"]
+        if created_ids:
+            # So the stats see the sessions' components
+            db_session.flush()
+            record_finished_workouts(
+                db_session=db_session,
+                user_id=decoded_access_token["user_id"],
+                finished_workout_ids=created_ids,
+            )
         db_session.commit()
 
+    except WorkoutComponentNotOwnedException as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except exc.IntegrityError as e:
         raise handle_integrity_errors(e)
     except HTTPException as http_exc:
@@ -511,5 +950,4 @@ def finish_workout(
     finally:
         db_session.rollback()
 
-    # TODO -> Could in future return some stats for the app to show, like number of workouts completed this month, how long the workout took, ect.
-    return {"message": "Workout Finished"}
\ No newline at end of file
+    return {'payload': {'sessions': results}}
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field, validator
-from typing import Generic, TypeVar
+from typing import Generic, TypeVar, Literal
+from datetime import date, datetime
 
 # TODO -> Make base model with extra = "forbid"
 
@@ -195,6 +196,44 @@ class SavedWorkoutsResponseSchema(BaseModel):
     class Config:
         extra = "forbid"
 
+class SyncedWorkoutSchema(BaseModel):
+
+    workout_id : str = Field(description="The workout's UUID")
+    name : str = Field(description="Name of the workout")
+    ai_generated : bool = Field(description="Whether the workout was generated by AI or not")
+    datetime_created : datetime = Field(description="When the workout was created")
+
+    class Config:
+        extra = "forbid"
+
+class SyncedWorkoutComponentSchema(RetrievedWorkoutComponentSchema):
+
+    workout_id : str = Field(description="UUID of the workout the component is in")
+    datetime_updated : datetime = Field(description="When the component's current values were saved")
+
+    class Config:
+        extra = "forbid"
+
+class SyncedFinishedWorkoutSchema(BaseModel):
+
+    finished_workout_id : str = Field(description="The finished workout's UUID")
+    completed_datetime : datetime = Field(description="When the workout was finished")
+    workout_component_ids : list[str] = Field(description="UUIDs of the workout components completed")
+
+    class Config:
+        extra = "forbid"
+
+class SyncResponseSchema(BaseModel):
+
+    cursor : str = Field(description="Send as 'since' with the next sync, to get changes made after this one")
+    full : bool = Field(description="Whether everything was returned, rather than only changes, in which case what the app has should be replaced")
+    workouts : list[SyncedWorkoutSchema] = Field(description="Workouts created since the last sync")
+    workout_components : list[SyncedWorkoutComponentSchema] = Field(description="Workout components created or changed since the last sync, with their current values")
+    finished_workouts : list[SyncedFinishedWorkoutSchema] = Field(description="Workouts finished since the last sync")
+
+    class Config:
+        extra = "forbid"
+
 # Currently unused
 class UpdateComponentsSchema(BaseModel):
 
@@ -208,4 +247,164 @@ class FinishWorkoutSchema(BaseModel):
     workout_components : list[RetrievedWorkoutComponentSchema] = Field(description="List of completed workout components")
 
     class Config:
-        extra = "forbid"
\ No newline at end of file
+        extra = "forbid"
+
+class ExerciseStatsSchema(BaseModel):
+
+    exercise_name : str = Field(description="Name of the exercise")
+    completed_count : int = Field(description="Times the exercise has been completed")
+    total_reps : int = Field(description="Reps completed in total. Rep ranges count as their lowest number")
+    total_volume_kg : float = Field(description="Total of reps x weight, in kg")
+    best_one_rep_max_kg : float | None = Field(description="Best estimated one rep max (Epley), in kg")
+    best_one_rep_max_datetime : datetime | None = Field(description="When the best estimated one rep max was completed")
+
+    class Config:
+        extra = "forbid"
+
+class BeatenPersonalRecordSchema(BaseModel):
+
+    exercise_name : str = Field(description="Name of the exercise")
+    record_type : Literal["estimated_one_rep_max", "rep_max"] = Field(description="Best estimated one rep max, or heaviest weight for a number of reps")
+    reps : int | None = Field(description="Number of reps, for rep_max records")
+    weight_kg : float = Field(description="The new record, in kg")
+    previous_weight_kg : float = Field(description="The record beaten, in kg")
+
+    class Config:
+        extra = "forbid"
+
+class PersonalRecordSchema(BaseModel):
+
+    exercise_name : str = Field(description="Name of the exercise")
+    reps : int = Field(description="Number of reps. Rep ranges count as their lowest number")
+    weight_kg : float = Field(description="Heaviest weight completed for this number of reps, in kg")
+    achieved_datetime : datetime = Field(description="When the record was set")
+
+    class Config:
+        extra = "forbid"
+
+class FinishedWorkoutStatsSchema(BaseModel):
+
+    workout_count : int = Field(description="Workouts completed in total")
+    workouts_this_week : int = Field(description="Workouts completed this week (from Monday)")
+    workouts_this_month : int = Field(description="Workouts completed this month")
+    current_streak_weeks : int = Field(description="Consecutive weeks with a workout, up to this week or last week")
+    longest_streak_weeks : int = Field(description="Most consecutive weeks with a workout")
+    exercises : list[ExerciseStatsSchema] = Field(description="Updated stats of the exercises in the finished workout")
+    personal_records : list[BeatenPersonalRecordSchema] = Field(description="Personal records beaten in the finished workout")
+
+    class Config:
+        extra = "forbid"
+
+class FinishWorkoutResponseSchema(BaseModel):
+
+    message : str = Field(description="Associated message")
+    stats : FinishedWorkoutStatsSchema = Field(description="The user's stats, including this workout")
+
+    class Config:
+        extra = "forbid"
+
+class WorkoutPeriodSchema(BaseModel):
+
+    period_start : date = Field(description="First day of the week or month")
+    workout_count : int = Field(description="Workouts completed in the week or month")
+
+    class Config:
+        extra = "forbid"
+
+class UserStatsResponseSchema(BaseModel):
+
+    workout_count : int = Field(description="Workouts completed in total")
+    workouts_this_week : int = Field(description="Workouts completed this week (from Monday)")
+    workouts_this_month : int = Field(description="Workouts completed this month")
+    current_streak_weeks : int = Field(description="Consecutive weeks with a workout, up to this week or last week")
+    longest_streak_weeks : int = Field(description="Most consecutive weeks with a workout")
+    last_workout_week : date | None = Field(description="First day of the latest week with a workout")
+    weeks : list[WorkoutPeriodSchema] = Field(description="Workouts completed in each of the last 12 weeks, oldest first")
+    months : list[WorkoutPeriodSchema] = Field(description="Workouts completed in each of the last 12 months, oldest first")
+    exercises : list[ExerciseStatsSchema] = Field(description="Stats of every exercise completed, by name")
+    personal_records : list[PersonalRecordSchema] = Field(description="Heaviest weight for each exercise and number of reps completed")
+
+    class Config:
+        extra = "forbid"
+
+class ActivityPeriodSchema(BaseModel):
+
+    period_start : date = Field(description="The day, or first day of the week or month")
+    workout_count : int = Field(description="Workouts completed")
+    component_count : int = Field(description="Workout components completed")
+    total_reps : int = Field(description="Reps completed. Rep ranges count as their lowest number")
+    total_volume_kg : float = Field(description="Total of reps x weight, in kg")
+
+    class Config:
+        extra = "forbid"
+
+class UserActivityResponseSchema(BaseModel):
+
+    resolution : Literal["day", "week", "month"] = Field(description="What the activity is totalled by")
+    start_date : date = Field(description="First day of the range")
+    end_date : date = Field(description="Last day of the range")
+    periods : list[ActivityPeriodSchema] = Field(description="Days, weeks or months in the range with any activity, oldest first. Weeks and months at the ends only include the days in the range")
+
+    class Config:
+        extra = "forbid"
+
+class NextSessionComponentSchema(BaseModel):
+
+    workout_component_id : str = Field(description="The workout component's UUID")
+    exercise_name : str = Field(description="Name of the exercise")
+    position : int = Field(description="Position of the component in the workout")
+    reps : str = Field(description="The component's current reps")
+    weight : float = Field(description="The component's current weight")
+    units : str = Field(description="Units of the weights")
+    suggested_reps : str = Field(description="Reps suggested for the next session")
+    suggested_weight : float = Field(description="Weight suggested for the next session, in the component's units")
+    action : Literal["progress", "repeat", "deload", "start"] = Field(description="How the suggestion compares to the current values. start if there are no recent sessions")
+    sessions_considered : int = Field(description="Recent sessions of the component the suggestion is based on")
+    estimated_one_rep_max_kg : float | None = Field(description="Estimated one rep max (Epley) at the latest session, from the trend, in kg")
+    trend_kg_per_week : float | None = Field(description="Change in estimated one rep max per week over the recent sessions, in kg")
+
+    class Config:
+        extra = "forbid"
+
+class NextSessionResponseSchema(BaseModel):
+
+    workout_id : str = Field(description="The workout's UUID")
+    workout_components : list[NextSessionComponentSchema] = Field(description="Suggestions for each component, in position order")
+
+    class Config:
+        extra = "forbid"
+
+# Sessions per upload. The app uploads its offline queue in chunks of at most this many.
+MAX_SESSIONS_PER_UPLOAD = 50
+
+class FinishedSessionSchema(BaseModel):
+
+    client_session_id : str = Field(min_length=1, max_length=64, description="The app's ID for the session. Sessions already uploaded with this ID aren't recorded again")
+    completed_datetime : datetime = Field(description="When the session was completed, on the device. Taken to be UTC if it has no time zone")
+    workout_components : list[RetrievedWorkoutComponentSchema] = Field(description="Workout components completed, with their values at the end of the session")
+
+    class Config:
+        extra = "forbid"
+
+class FinishedSessionsUploadSchema(BaseModel):
+
+    sessions : list[FinishedSessionSchema] = Field(min_length=1, max_length=MAX_SESSIONS_PER_UPLOAD, description="Finished sessions, from the app's offline queue")
+
+    class Config:
+        extra = "forbid"
+
+class FinishedSessionResultSchema(BaseModel):
+
+    client_session_id : str = Field(description="The app's ID for the session")
+    finished_workout_id : str = Field(description="The finished workout's UUID")
+    status : Literal["created", "duplicate"] = Field(description="Whether the session was recorded now, or had already been uploaded (including earlier in the same upload)")
+
+    class Config:
+        extra = "forbid"
+
+class FinishedSessionsUploadResponseSchema(BaseModel):
+
+    sessions : list[FinishedSessionResultSchema] = Field(description="What happened to each session, in the order sent")
+
+    class Config:
+        extra = "forbid"
@@ -0,0 +1,111 @@
+"""
+Each user's activity over a range of days, for the app's activity calendar: workouts and components completed, reps and
+volume (reps x weight, in kg), per day, or totalled per week or month.
+
+Read only from user_daily_activity, which is kept up to date as workouts are finished (see app/utils/stats.py), so a
+year of days is a range scan of at most 366 primary key entries, whatever the size of the user's history. Only days
+with activity are returned, the app fills in the rest. Days are those the workouts were completed on in the database's
+time zone, as for the stats, and weeks start on Monday. Weeks and months at the ends of the range only include the days
+within it.
+"""
+
+import logging
+from datetime import date, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .custom_exceptions import InvalidDateRangeException
+
+logger = logging.getLogger(__name__)
+
+DAY = "day"
+WEEK = "week"
+MONTH = "month"
+
+# Days returned when no start is given, up to and including the end
+ACTIVITY_DEFAULT_DAYS = 365
+# Longest range that can be requested, so a request reads at most this many rows
+ACTIVITY_MAX_DAYS = 366
+
+_GET_ACTIVITY = text(
+    """
+    SELECT
+        CAST(date_trunc(:resolution, CAST(activity_date AS TIMESTAMP)) AS DATE) AS period_start,
+        SUM(workout_count) AS workout_count,
+        SUM(component_count) AS component_count,
+        SUM(total_reps) AS total_reps,
+        SUM(total_volume_kg) AS total_volume_kg
+    FROM user_daily_activity
+    WHERE user_id = CAST(:user_id AS UUID)
+    AND activity_date BETWEEN :start_date AND :end_date
+    GROUP BY 1
+    ORDER BY 1
+    """
+)
+
+# Throws InvalidDateRangeException
+def resolve_date_range(start_date=None, end_date=None):
+    """
+    :param start_date: date. First day of the range. Defaults to ACTIVITY_DEFAULT_DAYS before the end.
+    :param end_date: date. Last day of the range. Defaults to today.
+    :return: Tuple(date, date). The first and last days of the range.
+    """
+
+    if end_date is None:
+        end_date = date.today()
+    if start_date is None:
+        start_date = end_date - timedelta(days=ACTIVITY_DEFAULT_DAYS - 1)
+
+    if start_date > end_date:
+        raise InvalidDateRangeException(message="Start of range is after its end", start_date=start_date, end_date=end_date)
+
+    if end_date - start_date >= timedelta(days=ACTIVITY_MAX_DAYS):
+        raise InvalidDateRangeException(
+            message=f"Range is longer than {ACTIVITY_MAX_DAYS} days",
+            start_date=start_date,
+            end_date=end_date,
+        )
+
+    return start_date, end_date
+
+def get_user_activity(
+    db_session: Session,
+    user_id,
+    start_date,
+    end_date,
+    resolution=DAY,
+):
+    """
+    :param user_id: str. The user whose activity to get.
+    :param start_date: date. First day of the range, from resolve_date_range.
+    :param end_date: date. Last day of the range, from resolve_date_range.
+    :param resolution: str. DAY, WEEK or MONTH. What the activity is totalled by.
+    :return: Dict. Follows UserActivityResponseSchema.
+    """
+
+    rows = db_session.execute(
+        _GET_ACTIVITY,
+        {
+            "user_id": str(user_id),
+            "start_date": start_date,
+            "end_date": end_date,
+            "resolution": resolution,
+        },
+    ).all()
+
+    return {
+        "resolution": resolution,
+        "start_date": start_date,
+        "end_date": end_date,
+        "periods": [
+            {
+                "period_start": row.period_start,
+                "workout_count": row.workout_count,
+                "component_count": row.component_count,
+                "total_reps": row.total_reps,
+                "total_volume_kg": row.total_volume_kg,
+            }
+            for row in rows
+        ],
+    }
@@ -0,0 +1,283 @@
+"""
+Admission control, so that a spike of slow requests (such as workout recommendations, which wait on the LLM) can't take
+every worker thread and database connection, leaving cheap requests like logins queued behind them.
+
+Each route gets a limiter, chosen by the route's path or else its first tag. A limiter lets a fixed number of requests
+run at once, and queues a bounded number more, each for a bounded time. Requests beyond that are shed straight away
+with a 503 and a Retry-After header, which is far cheaper than letting them time out.
+
+Limits are per worker, and are set by the ADMISSION_LIMITS environment variable, as comma separated
+'<route path or tag>=<max concurrent>:<max queued>:<max queue wait seconds>' entries, eg:
+
+    ADMISSION_LIMITS="auth=32:64:2,/workouts/recommendation=4:4:1"
+
+These replace the matching entries of DEFAULT_ADMISSION_LIMITS. Routes with no limiter aren't limited.
+
+Per-user quotas (UserQuota) are also available for routes that are expensive per call, as a dependency.
+"""
+
+import asyncio
+import math
+import time
+import logging
+import threading
+from collections import deque
+from os import getenv
+
+from fastapi import Depends, HTTPException
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+
+from .jwt import requires_authorization
+from .metrics import admission_in_flight, admission_shed_total, user_quota_rejections_total
+
+logger = logging.getLogger(__name__)
+
+# Route path or tag -> (max concurrent, max queued, max queue wait seconds)
+DEFAULT_ADMISSION_LIMITS = {
+    # Logins and tokens are cheap and latency sensitive. Generous, but bounded so a login flood can't take everything.
+    "auth": (32, 64, 2.0),
+    "workouts": (16, 32, 5.0),
+    # Each waits on the LLM for seconds, so only a few at once, and little queueing
+    "/workouts/recommendation": (4, 4, 1.0),
+    "temp": (1, 0, 0.0),
+}
+
+class AdmissionLimiter:
+    """
+    Lets max_concurrent requests run at once, and queues up to max_queued more, first come first served. Only used from
+    the event loop, so needs no locking.
+    """
+
+    def __init__(self, name, max_concurrent, max_queued, max_queue_wait):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def retry_after(self):
+        # A hint only, the queue's wait time is about how long it takes for the current requests to clear
+        return max(1, math.ceil(self.max_queue_wait))
+
+    async def acquire(self):
+        """
+        :return: str. None if admitted, otherwise why the request was shed ('queue_full' or 'queue_timeout').
+        """
+
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            return None
+
+        if len(self._waiters) >= self.max_queued:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted just as the wait ran out, so take the slot that was handed over
+                return None
+            waiter.cancel()
+            return "queue_timeout"
+        except asyncio.CancelledError:
+            # The client went away. If a slot had already been handed over, pass it on rather than leak it.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+        # The slot was handed over by release(), in_flight already includes this request
+        return None
+
+    def release(self):
+
+        # Hands the slot straight to the next waiter, so a newly arriving request can't take it first
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
+
+def parse_admission_limits(value):
+    """
+    :param value: str. Limits, eg 'auth=32:64:2,/workouts/recommendation=4:4:1'.
+    :return: Dict[str, Tuple(int, int, float)]. Route path or tag -> limits.
+    """
+
+    limits = {}
+
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        key, _, settings = entry.partition("=")
+        max_concurrent, max_queued, max_queue_wait = settings.split(":")
+        limits[key.strip()] = (int(max_concurrent), int(max_queued), float(max_queue_wait))
+
+    return limits
+
+class AdmissionController:
+    """
+    Finds the limiter for each request, and admits or sheds it.
+    """
+
+    def __init__(self, limits):
+        self.limiters = {
+            key: AdmissionLimiter(key, *settings)
+            for key, settings in limits.items()
+        }
+        # id(route) -> its limiter, or None. Filled in on first use, as routes are registered after the middleware.
+        self._route_limiters = {}
+
+    def limiter_for(self, request):
+        """
+        :return: AdmissionLimiter. The limiter for the route the request will be routed to, or None if not limited.
+        """
+
+        for route in request.app.router.routes:
+            match, _ = route.matches(request.scope)
+            if match != Match.FULL:
+                continue
+
+            # By id, as routes aren't hashable. They live as long as the app, so ids aren't reused.
+            if id(route) not in self._route_limiters:
+                tags = getattr(route, "tags", None) or []
+                limiter = self.limiters.get(route.path)
+                if limiter is None and tags:
+                    limiter = self.limiters.get(tags[0])
+                self._route_limiters[id(route)] = limiter
+
+            return self._route_limiters[id(route)]
+
+        return None
+
+    async def __call__(self, request, call_next):
+
+        limiter = self.limiter_for(request)
+        if limiter is None:
+            return await call_next(request)
+
+        wait_start = time.perf_counter()
+        shed_reason = await limiter.acquire()
+
+        if shed_reason is not None:
+            admission_shed_total.labels(limiter.name, shed_reason).inc()
+            logger.warning(
+                "Request shed",
+                extra={
+                    "limiter": limiter.name,
+                    "reason": shed_reason,
+                    "path": request.url.path,
+                    "waited_ms": round((time.perf_counter() - wait_start) * 1000, 2),
+                },
+            )
+            return JSONResponse(
+                status_code=503,
+                content={"message": "Server is busy, please try again shortly"},
+                headers={"Retry-After": str(limiter.retry_after)},
+            )
+
+        admission_in_flight.labels(limiter.name).inc()
+        try:
+            return await call_next(request)
+        finally:
+            admission_in_flight.labels(limiter.name).dec()
+            limiter.release()
+
+admission_controller = AdmissionController({
+    **DEFAULT_ADMISSION_LIMITS,
+    **parse_admission_limits(getenv("ADMISSION_LIMITS")),
+})
+
+# Users tracked by a UserQuota before those who have gone quiet are forgotten
+MAX_TRACKED_USERS = 10000
+
+class UserQuota:
+    """
+    Limits how many requests each user can have running at once, and how many they can start per minute. Used as a
+    dependency of the routes it applies to, after authorization, eg:
+
+        llm_user_quota = UserQuota("llm", max_concurrent=1, per_minute=6)
+
+        def create_workout_recommendation(..., _quota: None = Depends(llm_user_quota)):
+
+    Requests over the quota get a 429 with a Retry-After header. Counted per worker.
+    """
+
+    def __init__(self, name, max_concurrent, per_minute):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.per_minute = per_minute
+        # User ID -> requests running now
+        self._in_flight = {}
+        # User ID -> start times of their requests in the last minute, oldest first
+        self._recent_starts = {}
+        self._lock = threading.Lock()
+
+    def _reject(self, reason, retry_after):
+        user_quota_rejections_total.labels(self.name, reason).inc()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many requests, please wait before trying again [{reason}]",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def __call__(self, decoded_access_token=Depends(requires_authorization)):
+
+        user_id = decoded_access_token["user_id"]
+        now = time.monotonic()
+
+        with self._lock:
+
+            recent_starts = self._recent_starts.setdefault(user_id, deque())
+            while recent_starts and recent_starts[0] <= now - 60:
+                recent_starts.popleft()
+
+            if self._in_flight.get(user_id, 0) >= self.max_concurrent:
+                self._reject("concurrent", retry_after=1)
+            if len(recent_starts) >= self.per_minute:
+                self._reject("rate", retry_after=recent_starts[0] + 60 - now)
+
+            recent_starts.append(now)
+            self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[user_id] -= 1
+                if self._in_flight[user_id] <= 0:
+                    del self._in_flight[user_id]
+                if len(self._recent_starts) > MAX_TRACKED_USERS:
+                    self._forget_quiet_users(time.monotonic())
+
+    def _forget_quiet_users(self, now):
+        # Users with nothing running and no requests in the last minute don't need to be remembered
+        for user_id, recent_starts in list(self._recent_starts.items()):
+            if user_id not in self._in_flight and (not recent_starts or recent_starts[-1] <= now - 60):
+                del self._recent_starts[user_id]
+
+# For routes that call the LLM
+llm_user_quota = UserQuota(
+    "llm",
+    max_concurrent=int(getenv("LLM_USER_MAX_CONCURRENT", "1")),
+    per_minute=int(getenv("LLM_USER_REQUESTS_PER_MINUTE", "6")),
+)
+
+# For exports, which read the user's whole history. Only the rate is limited in practice, as exports are streamed after
+# the dependency has finished.
+export_user_quota = UserQuota(
+    "export",
+    max_concurrent=1,
+    per_minute=int(getenv("EXPORT_USER_REQUESTS_PER_MINUTE", "2")),
+)
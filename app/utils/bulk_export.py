@@ -0,0 +1,395 @@
+"""
+Exports the tables analysts need (component history, finished workout components and the action log) to Parquet files,
+so analytics can run on the files rather than on ad-hoc joins against the production database.
+
+    python -m app.utils.bulk_export --output-dir exports/
+
+Each table is written under the output directory partitioned by day, as <table>/date=YYYY-MM-DD/part-<run>.parquet,
+which Spark, DuckDB, BigQuery and pandas all read as one dataset. Rows are streamed out of Postgres with
+COPY ... TO STDOUT, parsed into Arrow record batches as they arrive, and written a batch at a time, so memory use
+doesn't depend on how much is exported.
+
+Runs are incremental. Each table's watermark (the time up to which it has been exported) is kept in _watermarks.json in
+the output directory, and each run exports from there up to EXPORT_SETTLE_SECONDS ago. The gap leaves time for
+transactions in progress to commit, as rows are stamped with the time their transaction started. Rows stamped with a
+time before the watermark when written, such as by seeding or backfills, aren't picked up: use --full to re-export.
+
+Reads from the replica (REPLICA_DB_URL) if one is configured, otherwise from the primary. On a replica, exports also stop
+short of the replica's replication lag.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pa_compute
+import pyarrow.parquet as pa_parquet
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+EXPORT_SETTLE_SECONDS = float(os.getenv("EXPORT_SETTLE_SECONDS", "300"))
+
+WATERMARKS_FILE = "_watermarks.json"
+# Watermark of tables that have never been exported
+START_OF_TIME = datetime(1970, 1, 1)
+
+# Bytes of CSV parsed into each record batch
+READ_BLOCK_BYTES = 8 * 2**20
+
+class ExportedTable:
+    """
+    A table to export: the query for its rows in a time range, the column holding the time, and the Arrow type of
+    each column, so every file has the same schema whatever values it happens to contain.
+    """
+
+    def __init__(self, name, time_column, schema, query):
+        self.name = name
+        self.time_column = time_column
+        self.schema = schema
+        # Selects the schema's columns, in order, for rows with :start <= time_column < :end
+        self.query = query
+
+EXPORTED_TABLES = {
+    table.name: table
+    for table in [
+        ExportedTable(
+            name="workout_component_history",
+            time_column="datetime_added",
+            schema=pa.schema([
+                ("workout_component_history_id", pa.string()),
+                ("workout_component_id", pa.string()),
+                ("workout_id", pa.string()),
+                ("user_id", pa.string()),
+                ("exercise_name", pa.string()),
+                ("reps", pa.string()),
+                ("weight", pa.float64()),
+                ("units", pa.string()),
+                ("datetime_added", pa.timestamp("us")),
+            ]),
+            query="""
+                SELECT
+                    workout_component_history.workout_component_history_id,
+                    workout_component_history.workout_component_id,
+                    workout_components.workout_id,
+                    user_workouts.user_id,
+                    exercises.exercise_name,
+                    workout_component_history.reps,
+                    workout_component_history.weight,
+                    workout_component_history.units,
+                    workout_component_history.datetime_added
+                FROM workout_component_history
+                JOIN workout_components ON workout_components.workout_component_id = workout_component_history.workout_component_id
+                JOIN user_workouts ON user_workouts.workout_id = workout_components.workout_id
+                JOIN exercises ON exercises.exercise_id = workout_components.exercise_id
+                WHERE workout_component_history.datetime_added >= {start}
+                AND workout_component_history.datetime_added < {end}
+                ORDER BY workout_component_history.datetime_added
+            """,
+        ),
+        ExportedTable(
+            name="finished_workout_components",
+            # Recorded rather than completed, as uploaded sessions are completed before they're recorded
+            time_column="datetime_recorded",
+            schema=pa.schema([
+                ("finished_workout_component_id", pa.string()),
+                ("finished_workout_id", pa.string()),
+                ("workout_component_id", pa.string()),
+                ("reps", pa.string()),
+                ("weight", pa.float64()),
+                ("units", pa.string()),
+                ("user_id", pa.string()),
+                ("client_session_id", pa.string()),
+                ("completed_datetime", pa.timestamp("us")),
+                ("datetime_recorded", pa.timestamp("us")),
+            ]),
+            query="""
+                SELECT
+                    finished_workout_components.finished_workout_component_id,
+                    finished_workout_components.finished_workout_id,
+                    finished_workout_components.workout_component_id,
+                    finished_workout_components.reps,
+                    finished_workout_components.weight,
+                    finished_workout_components.units,
+                    finished_workouts.user_id,
+                    finished_workouts.client_session_id,
+                    finished_workouts.completed_datetime,
+                    finished_workouts.datetime_recorded
+                FROM finished_workouts
+                JOIN finished_workout_components ON finished_workout_components.finished_workout_id = finished_workouts.finished_workout_id
+                WHERE finished_workouts.datetime_recorded >= {start}
+                AND finished_workouts.datetime_recorded < {end}
+                ORDER BY finished_workouts.datetime_recorded
+            """,
+        ),
+        ExportedTable(
+            name="action_log",
+            time_column="action_datetime",
+            schema=pa.schema([
+                ("log_id", pa.string()),
+                ("user_id", pa.string()),
+                ("action_name", pa.string()),
+                ("action_datetime", pa.timestamp("us")),
+            ]),
+            query="""
+                SELECT
+                    action_log.log_id,
+                    action_log.user_id,
+                    actions.action_name,
+                    action_log.action_datetime
+                FROM action_log
+                JOIN actions ON actions.action_id = action_log.action_id
+                WHERE action_log.action_datetime >= {start}
+                AND action_log.action_datetime < {end}
+                ORDER BY action_log.action_datetime
+            """,
+        ),
+    ]
+}
+
+# The end of the range that's safe to export: EXPORT_SETTLE_SECONDS ago, and on a replica, before its replication lag
+_EXPORT_UNTIL = text(
+    """
+    SELECT LEAST(
+        LOCALTIMESTAMP,
+        CASE WHEN pg_is_in_recovery()
+            THEN COALESCE(CAST(pg_last_xact_replay_timestamp() AS TIMESTAMP), LOCALTIMESTAMP)
+            ELSE LOCALTIMESTAMP
+        END
+    ) - make_interval(secs => :settle_seconds)
+    """
+)
+
+def load_watermarks(output_dir):
+    """
+    :return: Dict[str, datetime]. Table name -> the time up to which it has been exported.
+    """
+
+    path = os.path.join(output_dir, WATERMARKS_FILE)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as watermarks_file:
+        return {
+            table_name: datetime.fromisoformat(watermark)
+            for table_name, watermark in json.load(watermarks_file).items()
+        }
+
+def save_watermarks(output_dir, watermarks):
+
+    path = os.path.join(output_dir, WATERMARKS_FILE)
+    # Written alongside then renamed, so a crash can't leave a half written file
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as watermarks_file:
+        json.dump({table_name: watermark.isoformat() for table_name, watermark in watermarks.items()}, watermarks_file, indent=4)
+    os.replace(temporary_path, path)
+
+def _copy_to_pipe(raw_connection, copy_statement, write_fd, errors):
+    """
+    Runs COPY ... TO STDOUT into the write end of a pipe. Runs in its own thread, while the read end is parsed.
+    """
+
+    try:
+        with os.fdopen(write_fd, "wb") as pipe_writer:
+            cursor = raw_connection.cursor()
+            cursor.copy_expert(copy_statement, pipe_writer)
+            cursor.close()
+    except Exception as e:
+        errors.append(e)
+
+class _DailyParquetWriters:
+    """
+    Writes record batches to one Parquet file per day of the time column. Files are written under temporary names, and
+    only renamed into place by commit(), so a failed export leaves no partial files to be read as data.
+    """
+
+    def __init__(self, table_dir, time_column, schema, run_id):
+        self.table_dir = table_dir
+        self.time_column = time_column
+        self.schema = schema
+        self.run_id = run_id
+        # Day -> (writer, temporary path, final path)
+        self._writers = {}
+        # (temporary path, final path) of closed files, waiting to be committed
+        self._closed = []
+        self.row_count = 0
+
+    def _writer_for(self, day):
+
+        if day not in self._writers:
+            partition_dir = os.path.join(self.table_dir, f"date={day.isoformat()}")
+            os.makedirs(partition_dir, exist_ok=True)
+            final_path = os.path.join(partition_dir, f"part-{self.run_id}.parquet")
+            temporary_path = f"{final_path}.tmp"
+            self._writers[day] = (pa_parquet.ParquetWriter(temporary_path, self.schema), temporary_path, final_path)
+
+        return self._writers[day][0]
+
+    def write(self, batch):
+
+        days = pa_compute.cast(batch.column(self.time_column), pa.date32())
+        batch_days = pa_compute.unique(days).to_pylist()
+
+        # Rows arrive in time order, so days before this batch's are complete and their files can be closed
+        first_day = min(batch_days, default=None)
+        for day in [day for day in self._writers if first_day is not None and day < first_day]:
+            writer, temporary_path, final_path = self._writers.pop(day)
+            writer.close()
+            self._closed.append((temporary_path, final_path))
+
+        for day in batch_days:
+            day_batch = batch.filter(pa_compute.equal(days, pa.scalar(day, pa.date32())))
+            self._writer_for(day).write_batch(day_batch)
+            self.row_count += day_batch.num_rows
+
+    def _close_all(self):
+        for writer, temporary_path, final_path in self._writers.values():
+            writer.close()
+            self._closed.append((temporary_path, final_path))
+        self._writers = {}
+
+    def commit(self):
+        self._close_all()
+        for temporary_path, final_path in self._closed:
+            os.replace(temporary_path, final_path)
+        self._closed = []
+
+    def abort(self):
+        self._close_all()
+        for temporary_path, _ in self._closed:
+            os.remove(temporary_path)
+        self._closed = []
+
+def export_table(engine, table, output_dir, start, end, run_id):
+    """
+    Exports the table's rows with start <= time < end.
+    :param engine: Engine. The database to read from.
+    :param table: ExportedTable. The table to export.
+    :param output_dir: str. The dataset's directory.
+    :param run_id: str. Names this run's files, so they don't overwrite earlier runs'.
+    :return: int. Number of rows exported.
+    """
+
+    # Timestamps are written as literals, as COPY can't take parameters. They're only ever datetimes, never user input.
+    query = table.query.format(start=f"TIMESTAMP '{start.isoformat()}'", end=f"TIMESTAMP '{end.isoformat()}'")
+    copy_statement = f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+    writers = _DailyParquetWriters(os.path.join(output_dir, table.name), table.time_column, table.schema, run_id)
+    raw_connection = engine.raw_connection()
+    read_fd, write_fd = os.pipe()
+    copy_errors = []
+    copy_thread = threading.Thread(target=_copy_to_pipe, args=(raw_connection, copy_statement, write_fd, copy_errors), daemon=True)
+
+    try:
+        copy_thread.start()
+
+        with os.fdopen(read_fd, "rb") as pipe_reader:
+            try:
+                reader = pa_csv.open_csv(
+                    pipe_reader,
+                    read_options=pa_csv.ReadOptions(block_size=READ_BLOCK_BYTES),
+                    convert_options=pa_csv.ConvertOptions(
+                        column_types={field.name: field.type for field in table.schema},
+                        # COPY writes NULL as an empty field, and empty strings quoted
+                        strings_can_be_null=True,
+                        quoted_strings_can_be_null=False,
+                    ),
+                )
+                for batch in reader:
+                    writers.write(batch)
+            except pa.ArrowInvalid:
+                # No rows. COPY still writes the header, but a CSV with no rows has no batches to read.
+                if copy_thread.is_alive() or copy_errors:
+                    raise
+
+        copy_thread.join()
+        if copy_errors:
+            raise copy_errors[0]
+
+        writers.commit()
+        raw_connection.commit()
+
+    except Exception:
+        writers.abort()
+        raise
+    finally:
+        raw_connection.close()
+
+    return writers.row_count
+
+def run_export(engine, output_dir, table_names, full=False, settle_seconds=EXPORT_SETTLE_SECONDS):
+    """
+    Exports each table from its watermark up to settle_seconds ago, advancing its watermark once its files are written.
+    :param full: bool. Export everything, ignoring the watermarks.
+    :return: Dict[str, int]. Table name -> rows exported.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    watermarks = {} if full else load_watermarks(output_dir)
+    run_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+    with engine.connect() as connection:
+        end = connection.execute(_EXPORT_UNTIL, {"settle_seconds": settle_seconds}).scalar()
+
+    row_counts = {}
+
+    for table_name in table_names:
+
+        table = EXPORTED_TABLES[table_name]
+        start = watermarks.get(table_name, START_OF_TIME)
+        if start >= end:
+            row_counts[table_name] = 0
+            continue
+
+        export_start = time.perf_counter()
+        row_counts[table_name] = export_table(engine, table, output_dir, start, end, run_id)
+
+        # Saved after each table, so a failure part way through a run keeps the tables already exported
+        watermarks[table_name] = end
+        save_watermarks(output_dir, watermarks)
+
+        logger.info(
+            "Table exported",
+            extra={
+                "table": table_name,
+                "row_count": row_counts[table_name],
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "duration_ms": round((time.perf_counter() - export_start) * 1000),
+            },
+        )
+
+    return row_counts
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Export analytics tables to day partitioned Parquet files")
+    parser.add_argument("--output-dir", required=True, help="The dataset's directory. Also holds the watermarks")
+    parser.add_argument("--tables", nargs="+", choices=list(EXPORTED_TABLES), default=list(EXPORTED_TABLES))
+    parser.add_argument("--full", action="store_true", help="Export everything, ignoring the watermarks. Use a new output directory")
+    parser.add_argument("--settle-seconds", type=float, default=EXPORT_SETTLE_SECONDS, help="Only export rows older than this")
+    parser.add_argument("--db-url", default=None, help="Defaults to the replica if configured, otherwise the primary")
+    args = parser.parse_args()
+
+    if args.db_url is not None:
+        engine = create_engine(args.db_url)
+    else:
+        from ..database import engine as primary_engine, replica_engine
+        engine = replica_engine
+        if engine is None:
+            logger.warning("No replica configured (REPLICA_DB_URL), exporting from the primary")
+            engine = primary_engine
+
+    row_counts = run_export(engine, args.output_dir, args.tables, full=args.full, settle_seconds=args.settle_seconds)
+    for table_name, row_count in row_counts.items():
+        print(f"{table_name:<30} {row_count:>10} rows")
+
+if __name__ == "__main__":
+    main()
@@ -13,4 +13,47 @@ class ExerciseDoesNotExistException(Exception):
         self.message = message
         if name is not None:
             self.message += f" [{name}]"
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class QueryBudgetExceededException(Exception):
+    def __init__(self, message="Query budget exceeded", name=None):
+        self.message = message
+        if name is not None:
+            self.message += f" [{name}]"
+        super().__init__(self.message)
+
+class WorkoutNotOwnedException(Exception):
+    def __init__(self, message="Workout does not exist or belongs to another user", workout_id=None):
+        self.message = message
+        if workout_id is not None:
+            self.message += f" [{workout_id}]"
+        super().__init__(self.message)
+
+class WorkoutComponentNotOwnedException(Exception):
+    def __init__(self, message="Workout components do not exist or belong to another user", workout_component_ids=None):
+        self.message = message
+        self.workout_component_ids = list(workout_component_ids or [])
+        if self.workout_component_ids:
+            self.message += f" [{', '.join(self.workout_component_ids)}]"
+        super().__init__(self.message)
+
+class InvalidSyncCursorException(Exception):
+    def __init__(self, message="Sync cursor is not valid", cursor=None):
+        self.message = message
+        if cursor is not None:
+            self.message += f" [{cursor}]"
+        super().__init__(self.message)
+
+class InvalidDateRangeException(Exception):
+    def __init__(self, message="Date range is not valid", start_date=None, end_date=None):
+        self.message = message
+        if start_date is not None and end_date is not None:
+            self.message += f" [{start_date} to {end_date}]"
+        super().__init__(self.message)
+
+class UnknownShardException(Exception):
+    def __init__(self, message="Shard is not configured, see SHARD_DB_URLS", shard_name=None):
+        self.message = message
+        if shard_name is not None:
+            self.message += f" [{shard_name}]"
+        super().__init__(self.message)
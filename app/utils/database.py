@@ -1,11 +1,19 @@
-from sqlalchemy import cast, Text, select
+from sqlalchemy import cast, Text, select, text
 from sqlalchemy.sql.expression import func
 from sqlalchemy.orm import aliased, Session
 
 from fastapi import HTTPException
 
-from .custom_exceptions import ExerciseDoesNotExistException, UsernameAlreadyExistsException, UsernameDoesNotExistException
+from shared.general import uuid7
+
+from .custom_exceptions import (
+    ExerciseDoesNotExistException, UsernameAlreadyExistsException, UsernameDoesNotExistException,
+    WorkoutComponentNotOwnedException,
+)
 from .logging import generate_actions_table
+from .timing import record_phase
+from .user_cache import get_user_credentials, invalidate_user_credentials
+from .response_cache import bump_user_data_version
 
 from ..models import (
     Users, UserPasswordHashes, Actions, ActionLog,
@@ -14,11 +22,17 @@ from ..models import (
 )
 
 import re
+import time
+import uuid
+from datetime import timezone
+import logging
 import pandas as pd
 import json
 
 from typing import List
 
+logger = logging.getLogger(__name__)
+
 # https://docs.sqlalchemy.org/en/14/orm/query.html
 
 # TODO: Make into a generic DB error handling function
@@ -60,7 +74,7 @@ def generic_add_to_table(table_class, json_payload, return_attribute=None):
 
     returned_attribute = getattr(new_row, return_attribute, None)
     if returned_attribute is None:
-        print("[W] generic_add_to_table: Unable to find specified return_attribute")
+        logger.warning("generic_add_to_table: Unable to find specified return_attribute", extra={"return_attribute": return_attribute})
         db.session.delete(new_row)
         db.session.commit()
 
@@ -96,6 +110,9 @@ def attempt_insert_new_user(
     db_session.add(new_row)
     db_session.commit()
 
+    # The username may have been cached as unknown, eg by an earlier attempt to log in with it
+    invalidate_user_credentials(json_payload.username)
+
     return assigned_user_id
 
 def login_user(
@@ -106,23 +123,14 @@ def login_user(
 ):
     
     username_to_login = json_payload.username
-    # Use joins, to avoid a cartesian join
-    query = (
-        db_session
-        .query(user_table_class, password_table_class)
-        .filter(user_table_class.user_id == password_table_class.user_id)
-        .filter(user_table_class.username == username_to_login)
-    )
-    results = query.all()
+    # Usually cached by the app's call to /users/salt just before
+    credentials = get_user_credentials(db_session, username_to_login)
 
-    if len(results) == 0:
+    if credentials is None:
         raise UsernameDoesNotExistException()
-    elif len(results) > 1:
-        raise Exception(f"Multiple users in database with this username (shouldn't happen): [{username_to_login}]")
-    
-    # TODO -> Make this access more safe
-    stored_hash = results[0][1].hash
-    user_id = results[0][1].user_id
+
+    stored_hash = credentials.hash
+    user_id = credentials.user_id
 
     useful_user_info = {
         "user_id": str(user_id), # Needs str() as json decoder does not handle this itself
@@ -277,8 +285,6 @@ def insert_workout_component_from_name(
     units,
 ):
     
-    print(f"[DEBUG] Looking for exercise ID...")
-    
     query = (
         db_session
         .query(Exercises.exercise_id)
@@ -290,7 +296,7 @@ def insert_workout_component_from_name(
     
     exercise_id = query.first().exercise_id
 
-    print(f"[DEBUG] Ready to insert named exercise using ID {exercise_id}")
+    logger.debug("Inserting named exercise", extra={"exercise_name": exercise_name, "exercise_id": exercise_id})
 
     return insert_workout_component(
         db_session=db_session,
@@ -313,36 +319,54 @@ def create_new_workout(
     ai_generated=False,
 ):
 
-    print("[DEBUG] Creating Workout Identifier")
+    workout_id = None
 
-    workout_id = insert_user_workout_identifier(
-        db_session=db_session,
-        user_id=user_id,
-        workout_name=workout_name,
-        ai_generated=ai_generated,
-    )
+    try:
 
-    print("[DEBUG] Created Workout Identifier")
-    
-    for workout_component in workout_components:
-        insert_workout_component_from_name(
+        workout_id = insert_user_workout_identifier(
             db_session=db_session,
-            workout_id=workout_id,
-            exercise_name=workout_component.exercise_name,
-            position=workout_component.position,
-            reps=workout_component.reps,
-            weight=workout_component.weight,
-            units=workout_component.units,
+            user_id=user_id,
+            workout_name=workout_name,
+            ai_generated=ai_generated,
         )
 
+        logger.debug("Created workout identifier", extra={"workout_id": workout_id})
+        
+        for workout_component in workout_components:
+            insert_workout_component_from_name(
+                db_session=db_session,
+                workout_id=workout_id,
+                exercise_name=workout_component.exercise_name,
+                position=workout_component.position,
+                reps=workout_component.reps,
+                weight=workout_component.weight,
+                units=workout_component.units,
+            )
+
+    except Exception:
+        # Each insert above commits, so even if one failed, the ones before it are saved and cached responses are out of
+        # date. Failing to mark them so mustn't hide why the insert failed.
+        if workout_id is not None:
+            try:
+                db_session.rollback()
+                bump_user_data_version(db_session=db_session, user_id=user_id)
+                db_session.commit()
+            except Exception:
+                logger.warning("Failed to bump the data version after a partial workout insert", exc_info=True)
+        raise
+
+    # The inserts have already committed, so this is a transaction of its own, after them
+    bump_user_data_version(db_session=db_session, user_id=user_id)
+    db_session.commit()
+
     return workout_id
 
 def populate_base_tables(db_session: Session):
 
     generate_actions_table(db_session=db_session)
-    print("[DEBUG] Actions table populated")
+    logger.info("Actions table populated")
     generate_exercises_table(db_session=db_session)
-    print("[DEBUG] Exercise table populated")
+    logger.info("Exercise table populated")
 
 def get_known_workout_names(
     db_session: Session,
@@ -386,6 +410,10 @@ def get_workouts_for_user(
             WorkoutComponentHistory.workout_component_id,
             func.max(WorkoutComponentHistory.datetime_added).label('max_datetime_added'),
         )
+        # Only this user's components, so this reads their history via indexes rather than scanning every user's
+        .join(WorkoutComponents, WorkoutComponents.workout_component_id == WorkoutComponentHistory.workout_component_id)
+        .join(UserWorkouts, UserWorkouts.workout_id == WorkoutComponents.workout_id)
+        .filter(UserWorkouts.user_id == user_id)
         .group_by(WorkoutComponentHistory.workout_component_id)
         .subquery()
     )
@@ -434,6 +462,9 @@ def get_workouts_for_user(
     # print(query.statement)
 
     query_result = query.all()
+
+    shaping_start = time.perf_counter()
+
     query_result_df = pd.DataFrame(query_result)
 
     workouts = []
@@ -468,6 +499,8 @@ def get_workouts_for_user(
 
     # print(json.dumps(workouts, indent=4))
 
+    record_phase("shaping", time.perf_counter() - shaping_start)
+
     return workouts
 
 def get_latest_finished_workouts_for_user(
@@ -492,6 +525,10 @@ def get_latest_finished_workouts_for_user(
             WorkoutComponentHistory.workout_component_id,
             func.max(WorkoutComponentHistory.datetime_added).label('max_datetime_added'),
         )
+        # Only this user's components, so this reads their history via indexes rather than scanning every user's
+        .join(WorkoutComponents, WorkoutComponents.workout_component_id == WorkoutComponentHistory.workout_component_id)
+        .join(UserWorkouts, UserWorkouts.workout_id == WorkoutComponents.workout_id)
+        .filter(UserWorkouts.user_id == user_id)
         .group_by(WorkoutComponentHistory.workout_component_id)
         .subquery()
     )
@@ -543,6 +580,9 @@ def get_latest_finished_workouts_for_user(
     # print(query.statement)
 
     query_result = query.all()
+
+    shaping_start = time.perf_counter()
+
     query_result_df = pd.DataFrame(query_result)
 
     workouts = []
@@ -576,4 +616,361 @@ def get_latest_finished_workouts_for_user(
 
     # print(json.dumps(workouts, indent=4))
 
+    record_phase("shaping", time.perf_counter() - shaping_start)
+
     return workouts
+
+def _parse_workout_component_ids(workout_component_ids):
+    """
+    :param workout_component_ids: List[str]. IDs as the app sent them.
+    :return: Tuple(Dict[str, str], List[str]). Each valid ID as sent -> its canonical form, and the IDs that aren't UUIDs.
+    """
+
+    canonical_ids = {}
+    invalid_ids = []
+
+    for workout_component_id in workout_component_ids:
+        try:
+            canonical_ids[workout_component_id] = str(uuid.UUID(workout_component_id))
+        except ValueError:
+            invalid_ids.append(workout_component_id)
+
+    return canonical_ids, invalid_ids
+
+def get_latest_component_versions(
+    db_session: Session,
+    user_id,
+    workout_component_ids,
+):
+    """
+    :param user_id: str. Only components in this user's workouts are returned.
+    :param workout_component_ids: List[str]. Workout components to look up.
+    :return: Dict[str, WorkoutComponentHistory]. Component ID -> its latest version, for the components that exist and
+        belong to the user. Every component has at least one version, from when its workout was created.
+    """
+
+    # DISTINCT ON keeps the first row per component, which the ordering makes the latest version. One index range scan
+    # per component, rather than aggregating the history first.
+    latest_versions = (
+        db_session
+        .query(WorkoutComponentHistory)
+        .join(WorkoutComponents, WorkoutComponents.workout_component_id == WorkoutComponentHistory.workout_component_id)
+        .join(UserWorkouts, UserWorkouts.workout_id == WorkoutComponents.workout_id)
+        .filter(UserWorkouts.user_id == user_id)
+        .filter(WorkoutComponentHistory.workout_component_id.in_(workout_component_ids))
+        .distinct(WorkoutComponentHistory.workout_component_id)
+        .order_by(WorkoutComponentHistory.workout_component_id, WorkoutComponentHistory.datetime_added.desc())
+        .all()
+    )
+
+    return {
+        str(version.workout_component_id): version
+        for version in latest_versions
+    }
+
+def _is_changed(latest_version, workout_component):
+    """
+    :return: bool. Whether the component's reps, weight or units differ from its latest version.
+    """
+
+    return (
+        latest_version.reps != workout_component.reps
+        or latest_version.weight != workout_component.weight
+        or latest_version.units != workout_component.units
+    )
+
+# Throws WorkoutComponentNotOwnedException
+def insert_changed_component_versions(
+    db_session: Session,
+    user_id,
+    workout_components,
+):
+    """
+    Adds a new version to the history of each component whose reps, weight or units differ from its latest version.
+    The app sends the whole workout on every save, so most components are usually unchanged, and adding a version for
+    each of them would only grow the history. Increases the user's data version if anything changed. Does not commit.
+
+    Checking that the components belong to the user is part of looking up their latest versions, so costs no extra
+    queries. Nothing is added if any of them don't.
+    :param user_id: str. The user saving the components.
+    :param workout_components: List[RetrievedWorkoutComponentSchema]. Components as the app sent them.
+    :return: int. How many new versions were added.
+    """
+
+    canonical_ids, invalid_ids = _parse_workout_component_ids(
+        [workout_component.workout_component_id for workout_component in workout_components]
+    )
+
+    # If a component is sent more than once, the last one wins
+    components_by_id = {
+        canonical_ids[workout_component.workout_component_id]: workout_component
+        for workout_component in workout_components
+        if workout_component.workout_component_id in canonical_ids
+    }
+
+    latest_versions = {}
+    if len(components_by_id) > 0:
+        latest_versions = get_latest_component_versions(db_session, user_id, list(components_by_id))
+
+    unowned_ids = invalid_ids + [
+        workout_component_id
+        for workout_component_id in components_by_id
+        if workout_component_id not in latest_versions
+    ]
+    if unowned_ids:
+        raise WorkoutComponentNotOwnedException(workout_component_ids=unowned_ids)
+
+    new_versions = [
+        WorkoutComponentHistory(
+            workout_component_id=workout_component_id,
+            reps=workout_component.reps,
+            weight=workout_component.weight,
+            units=workout_component.units,
+        )
+        for workout_component_id, workout_component in components_by_id.items()
+        if _is_changed(latest_versions[workout_component_id], workout_component)
+    ]
+
+    db_session.add_all(new_versions)
+    if new_versions:
+        bump_user_data_version(db_session=db_session, user_id=user_id)
+
+    return len(new_versions)
+
+_INSERT_OWNED_FINISHED_COMPONENTS = text(
+    """
+    INSERT INTO finished_workout_components (finished_workout_component_id, finished_workout_id, workout_component_id)
+    SELECT requested.finished_workout_component_id, CAST(:finished_workout_id AS UUID), workout_components.workout_component_id
+    FROM unnest(
+        CAST(:finished_workout_component_ids AS UUID[]),
+        CAST(:workout_component_ids AS UUID[])
+    ) AS requested (finished_workout_component_id, workout_component_id)
+    JOIN workout_components ON workout_components.workout_component_id = requested.workout_component_id
+    JOIN user_workouts ON user_workouts.workout_id = workout_components.workout_id
+    WHERE user_workouts.user_id = CAST(:user_id AS UUID)
+    RETURNING finished_workout_components.workout_component_id
+    """
+)
+
+# Throws WorkoutComponentNotOwnedException
+def insert_finished_workout_components(
+    db_session: Session,
+    user_id,
+    finished_workout_id,
+    workout_component_ids,
+):
+    """
+    Records the components as completed in the finished workout, and increases the user's data version. Does not commit.
+
+    The components are inserted with INSERT ... SELECT from the user's own components, so the ownership check and the
+    write are one statement. Any component that doesn't belong to the user simply isn't inserted, and is reported.
+    :param user_id: str. The user finishing the workout.
+    :param finished_workout_id: UUID. The finished workout.
+    :param workout_component_ids: List[str]. Components completed, as the app sent them.
+    :throws: WorkoutComponentNotOwnedException if any components don't exist or belong to another user. Components
+        that did belong to the user will have been inserted, so the transaction should be rolled back.
+    """
+
+    canonical_ids, invalid_ids = _parse_workout_component_ids(workout_component_ids)
+    # Each component is only recorded once, even if sent more than once
+    requested_ids = sorted(set(canonical_ids.values()))
+
+    inserted_ids = set()
+    if len(requested_ids) > 0:
+        inserted_rows = db_session.execute(
+            _INSERT_OWNED_FINISHED_COMPONENTS,
+            {
+                # Generated here, like the models' defaults, so they're time ordered
+                "finished_workout_component_ids": [str(uuid7()) for _ in requested_ids],
+                "workout_component_ids": requested_ids,
+                "finished_workout_id": str(finished_workout_id),
+                "user_id": str(user_id),
+            },
+        )
+        inserted_ids = {str(row.workout_component_id) for row in inserted_rows}
+
+    unowned_ids = invalid_ids + [
+        workout_component_id
+        for workout_component_id in requested_ids
+        if workout_component_id not in inserted_ids
+    ]
+    if unowned_ids:
+        raise WorkoutComponentNotOwnedException(workout_component_ids=unowned_ids)
+
+    bump_user_data_version(db_session=db_session, user_id=user_id)
+
+_INSERT_FINISHED_SESSIONS = text(
+    """
+    INSERT INTO finished_workouts (finished_workout_id, user_id, client_session_id, completed_datetime)
+    SELECT
+        requested.finished_workout_id,
+        CAST(:user_id AS UUID),
+        requested.client_session_id,
+        -- In the database's time zone, as server recorded times are. Sessions can't be completed in the future.
+        LEAST(CAST(requested.completed_datetime AS TIMESTAMP), LOCALTIMESTAMP)
+    FROM unnest(
+        CAST(:finished_workout_ids AS UUID[]),
+        CAST(:client_session_ids AS VARCHAR[]),
+        CAST(:completed_datetimes AS TIMESTAMPTZ[])
+    ) AS requested (finished_workout_id, client_session_id, completed_datetime)
+    ON CONFLICT (user_id, client_session_id) DO NOTHING
+    RETURNING client_session_id, finished_workout_id, completed_datetime
+    """
+)
+
+_EXISTING_FINISHED_SESSIONS = text(
+    """
+    SELECT client_session_id, finished_workout_id
+    FROM finished_workouts
+    WHERE user_id = CAST(:user_id AS UUID)
+    AND client_session_id = ANY(CAST(:client_session_ids AS VARCHAR[]))
+    """
+)
+
+# Throws WorkoutComponentNotOwnedException
+def insert_finished_sessions(
+    db_session: Session,
+    user_id,
+    sessions,
+):
+    """
+    Records finished sessions uploaded from the app's offline queue, along with the changes to their components made
+    during them, in bulk. Does not commit, so the caller commits the whole batch at once.
+
+    Every component in the batch is checked for ownership in one query, before anything is written, and the whole
+    batch is rejected if any don't belong to the user. Sessions are idempotent by client_session_id: sessions already
+    recorded, including by a concurrent upload of the same batch, are reported as duplicates and not written again.
+
+    Each session's components are recorded with the values they were completed with, so stats and records count each
+    session as it was done. A changed component gets one new version, with its values from the last session it was in,
+    but only if that session was completed after the component's latest version was saved. Otherwise the session was
+    queued offline while newer values were saved online, and those are kept. Versions are timed by when they're saved,
+    and several from one batch would all have the same time, with no way to tell which is latest.
+    :param user_id: str. The user uploading the sessions.
+    :param sessions: List[FinishedSessionSchema]. Sessions as the app sent them.
+    :return: List[Dict]. For each session, in the order sent: its client_session_id, finished_workout_id, and whether it
+        was 'created' or a 'duplicate'. A session sent more than once in the batch is a duplicate after the first.
+    """
+
+    # If a session is sent more than once in the batch, the first is used
+    sessions_by_id = {}
+    for session in sessions:
+        sessions_by_id.setdefault(session.client_session_id, session)
+
+    canonical_ids, invalid_ids = _parse_workout_component_ids(
+        [
+            workout_component.workout_component_id
+            for session in sessions_by_id.values()
+            for workout_component in session.workout_components
+        ]
+    )
+
+    latest_versions = {}
+    if len(canonical_ids) > 0:
+        latest_versions = get_latest_component_versions(db_session, user_id, sorted(set(canonical_ids.values())))
+
+    unowned_ids = invalid_ids + sorted(
+        workout_component_id
+        for workout_component_id in set(canonical_ids.values())
+        if workout_component_id not in latest_versions
+    )
+    if unowned_ids:
+        raise WorkoutComponentNotOwnedException(workout_component_ids=unowned_ids)
+
+    # Sessions without a time zone are taken to be in UTC
+    completed_datetimes = {
+        client_session_id: (
+            session.completed_datetime
+            if session.completed_datetime.tzinfo is not None
+            else session.completed_datetime.replace(tzinfo=timezone.utc)
+        )
+        for client_session_id, session in sessions_by_id.items()
+    }
+
+    inserted_rows = db_session.execute(
+        _INSERT_FINISHED_SESSIONS,
+        {
+            "finished_workout_ids": [str(uuid7()) for _ in sessions_by_id],
+            "client_session_ids": list(sessions_by_id),
+            "completed_datetimes": list(completed_datetimes.values()),
+            "user_id": str(user_id),
+        },
+    )
+    finished_workout_ids = {}
+    # As recorded, in the database's time zone like the versions' times
+    recorded_completed_datetimes = {}
+    for row in inserted_rows:
+        finished_workout_ids[row.client_session_id] = row.finished_workout_id
+        recorded_completed_datetimes[row.client_session_id] = row.completed_datetime
+    created_session_ids = set(finished_workout_ids)
+
+    duplicate_session_ids = [client_session_id for client_session_id in sessions_by_id if client_session_id not in created_session_ids]
+    if duplicate_session_ids:
+        existing_rows = db_session.execute(
+            _EXISTING_FINISHED_SESSIONS,
+            {"user_id": str(user_id), "client_session_ids": duplicate_session_ids},
+        )
+        finished_workout_ids.update({row.client_session_id: row.finished_workout_id for row in existing_rows})
+
+    # Each component's values from the last session it was in that was completed after its latest version, in order of
+    # completion
+    final_components = {}
+    finished_components = []
+    for client_session_id in sorted(created_session_ids, key=lambda client_session_id: recorded_completed_datetimes[client_session_id]):
+        # If a component is in a session more than once, the last one wins
+        completed_components = {}
+        for workout_component in sessions_by_id[client_session_id].workout_components:
+            workout_component_id = canonical_ids[workout_component.workout_component_id]
+            completed_components[workout_component_id] = workout_component
+            if recorded_completed_datetimes[client_session_id] > latest_versions[workout_component_id].datetime_added:
+                final_components[workout_component_id] = workout_component
+        finished_components.extend(
+            FinishedWorkoutComponents(
+                finished_workout_id=finished_workout_ids[client_session_id],
+                workout_component_id=workout_component_id,
+                reps=workout_component.reps,
+                weight=workout_component.weight,
+                units=workout_component.units,
+            )
+            for workout_component_id, workout_component in sorted(completed_components.items())
+        )
+
+    new_versions = [
+        WorkoutComponentHistory(
+            workout_component_id=workout_component_id,
+            reps=workout_component.reps,
+            weight=workout_component.weight,
+            units=workout_component.units,
+        )
+        for workout_component_id, workout_component in final_components.items()
+        if _is_changed(latest_versions[workout_component_id], workout_component)
+    ]
+
+    db_session.add_all(finished_components)
+    db_session.add_all(new_versions)
+
+    if created_session_ids:
+        bump_user_data_version(db_session=db_session, user_id=user_id)
+
+    logger.debug(
+        "Inserted finished sessions",
+        extra={
+            "session_count": len(sessions_by_id),
+            "created_count": len(created_session_ids),
+            "changed_count": len(new_versions),
+        },
+    )
+
+    results = []
+    reported_session_ids = set()
+    for session in sessions:
+        client_session_id = session.client_session_id
+        created = client_session_id in created_session_ids and client_session_id not in reported_session_ids
+        reported_session_ids.add(client_session_id)
+        results.append({
+            "client_session_id": client_session_id,
+            "finished_workout_id": str(finished_workout_ids[client_session_id]),
+            "status": "created" if created else "duplicate",
+        })
+
+    return results
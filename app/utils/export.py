@@ -0,0 +1,227 @@
+"""
+Streams a user's full training history, as NDJSON or CSV, for users and analytics to download.
+
+Rows are read through server side cursors (stream_results), a batch at a time, and written out as they're read, so
+memory use doesn't grow with the size of the history. Everything is read in one repeatable read transaction, so the
+export is a consistent snapshot even if the user is writing while it streams.
+
+Each line is one record, with a record_type of:
+
+- workout: A workout the user has created.
+- history_version: A version of a workout component's reps, weight and units. Every version is included, oldest first.
+- finished_workout_component: A component completed in a finished workout. Has the reps, weight and units it was
+  completed with if they were recorded (sessions uploaded from the app's offline queue), otherwise they're those of its
+  version in effect at the time.
+
+In CSV, every record has the same columns (EXPORT_COLUMNS), with those that don't apply to the record type left empty.
+"""
+
+import csv
+import io
+import json
+import zlib
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+NDJSON = "ndjson"
+CSV = "csv"
+
+EXPORT_MEDIA_TYPES = {
+    NDJSON: "application/x-ndjson",
+    CSV: "text/csv",
+}
+
+# Rows fetched from the database at a time
+EXPORT_FETCH_SIZE = 1000
+# Bytes of output collected before being sent, so the response isn't lots of tiny chunks
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+EXPORT_COLUMNS = [
+    "record_type",
+    "workout_id",
+    "workout_name",
+    "ai_generated",
+    "workout_component_id",
+    "exercise_name",
+    "position",
+    "workout_component_history_id",
+    "reps",
+    "weight",
+    "units",
+    "finished_workout_id",
+    "client_session_id",
+    "datetime",
+]
+
+_EXPORT_WORKOUTS = text(
+    """
+    SELECT
+        'workout' AS record_type,
+        workout_id,
+        workout_name,
+        ai_generated,
+        datetime_created AS datetime
+    FROM user_workouts
+    WHERE user_id = CAST(:user_id AS UUID)
+    ORDER BY datetime_created, workout_id
+    """
+)
+
+_EXPORT_HISTORY_VERSIONS = text(
+    """
+    SELECT
+        'history_version' AS record_type,
+        workout_components.workout_id,
+        workout_components.workout_component_id,
+        exercises.exercise_name,
+        workout_components.position,
+        workout_component_history.workout_component_history_id,
+        workout_component_history.reps,
+        workout_component_history.weight,
+        workout_component_history.units,
+        workout_component_history.datetime_added AS datetime
+    FROM user_workouts
+    JOIN workout_components ON workout_components.workout_id = user_workouts.workout_id
+    JOIN workout_component_history ON workout_component_history.workout_component_id = workout_components.workout_component_id
+    JOIN exercises ON exercises.exercise_id = workout_components.exercise_id
+    WHERE user_workouts.user_id = CAST(:user_id AS UUID)
+    ORDER BY
+        user_workouts.datetime_created,
+        workout_components.workout_id,
+        workout_components.position,
+        workout_component_history.datetime_added,
+        workout_component_history.workout_component_history_id
+    """
+)
+
+_EXPORT_FINISHED_WORKOUT_COMPONENTS = text(
+    """
+    SELECT
+        'finished_workout_component' AS record_type,
+        workout_components.workout_id,
+        finished_workout_components.workout_component_id,
+        finished_workout_components.reps,
+        finished_workout_components.weight,
+        finished_workout_components.units,
+        finished_workouts.finished_workout_id,
+        finished_workouts.client_session_id,
+        finished_workouts.completed_datetime AS datetime
+    FROM finished_workouts
+    JOIN finished_workout_components ON finished_workout_components.finished_workout_id = finished_workouts.finished_workout_id
+    JOIN workout_components ON workout_components.workout_component_id = finished_workout_components.workout_component_id
+    WHERE finished_workouts.user_id = CAST(:user_id AS UUID)
+    ORDER BY
+        finished_workouts.completed_datetime,
+        finished_workouts.finished_workout_id,
+        finished_workout_components.workout_component_id
+    """
+)
+
+EXPORT_QUERIES = [
+    _EXPORT_WORKOUTS,
+    _EXPORT_HISTORY_VERSIONS,
+    _EXPORT_FINISHED_WORKOUT_COMPONENTS,
+]
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    # UUIDs
+    return str(value)
+
+def _export_records(db_session, user_id):
+    """
+    :return: Generator[Dict]. The user's records, read a batch at a time.
+    """
+
+    # Repeatable read, so every query sees the same snapshot
+    connection = db_session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+    for query in EXPORT_QUERIES:
+        result = (
+            connection
+            .execution_options(stream_results=True)
+            .execute(query, {"user_id": str(user_id)})
+            .yield_per(EXPORT_FETCH_SIZE)
+        )
+        for row in result.mappings():
+            yield row
+
+def _format_ndjson(records):
+    for record in records:
+        yield json.dumps(dict(record), default=_json_value) + "\n"
+
+def _format_csv(records):
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+
+    writer.writeheader()
+    for record in records:
+        writer.writerow({
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in record.items()
+        })
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+_FORMATTERS = {
+    NDJSON: _format_ndjson,
+    CSV: _format_csv,
+}
+
+def stream_export(session_factory, user_id, export_format, compress=False):
+    """
+    Opens its own session, as the request's session is closed before a streamed response is sent.
+    :param session_factory: Callable. Creates a database session, eg SessionLocal.
+    :param user_id: str. The user to export.
+    :param export_format: str. NDJSON or CSV.
+    :param compress: bool. Whether to gzip the output as it's streamed.
+    :return: Generator[bytes]. The export, in chunks of around EXPORT_CHUNK_BYTES.
+    """
+
+    # wbits 31 writes a gzip header and trailer, rather than raw deflate
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    db_session = session_factory()
+    line_count = 0
+    byte_count = 0
+
+    try:
+
+        pending = []
+        pending_bytes = 0
+
+        for line in _FORMATTERS[export_format](_export_records(db_session, user_id)):
+            encoded = line.encode()
+            pending.append(encoded)
+            pending_bytes += len(encoded)
+            line_count += 1
+
+            if pending_bytes >= EXPORT_CHUNK_BYTES:
+                chunk = b"".join(pending)
+                pending = []
+                pending_bytes = 0
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    byte_count += len(chunk)
+                    yield chunk
+
+        chunk = b"".join(pending)
+        if compressor is not None:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        byte_count += len(chunk)
+        yield chunk
+
+    finally:
+        db_session.rollback()
+        db_session.close()
+        logger.info(
+            "Export streamed",
+            extra={"format": export_format, "compressed": compress, "line_count": line_count, "byte_count": byte_count},
+        )
@@ -0,0 +1,123 @@
+"""
+A stand-in for Gemini, used when LLM_BACKEND is 'fake'. For load tests and local runs without GCP access.
+
+It follows the same steps the system prompt asks the real model to follow, by asking the agent to call the tools in
+order, so the agent executor, the tools and their SQL all still run. Only the model calls themselves are faked.
+"""
+
+import re
+import ast
+import json
+import time
+import uuid
+from os import getenv
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Simulated time taken by each model call, so that load tests see realistic request durations
+FAKE_LLM_LATENCY_MS = float(getenv("FAKE_LLM_LATENCY_MS", "0"))
+
+# How many exercises the fake recommendation uses
+RECOMMENDED_EXERCISE_COUNT = 5
+
+_USER_ID_PATTERN = re.compile(r'user_id = "([^"]+)"')
+
+class FakeToolCallingChatModel(BaseChatModel):
+    """
+    Calls get_past_5_workouts_tool, get_known_workout_names_tool and create_workout_recommendation_tool in turn,
+    then replies with a fixed message. Which step it is on is worked out from the number of tool results so far.
+    """
+
+    @property
+    def _llm_type(self):
+        return "fake-tool-calling"
+
+    def bind_tools(self, tools, **kwargs):
+        # The tools are known in advance, so there's nothing to bind
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+
+        if FAKE_LLM_LATENCY_MS > 0:
+            time.sleep(FAKE_LLM_LATENCY_MS / 1000)
+
+        tool_results = [message for message in messages if isinstance(message, ToolMessage)]
+        user_id = _find_user_id(messages)
+
+        if len(tool_results) == 0:
+            ai_message = _tool_call("get_past_5_workouts_tool", {"user_id": user_id})
+        elif len(tool_results) == 1:
+            ai_message = _tool_call("get_known_workout_names_tool", {})
+        elif len(tool_results) == 2:
+            ai_message = _tool_call(
+                "create_workout_recommendation_tool",
+                {
+                    "user_id": user_id,
+                    "workout_name": "Fake Recommended Workout",
+                    "workout_components": _recommended_components(tool_results[1].content, tool_results[0].content),
+                },
+            )
+        else:
+            ai_message = AIMessage(content="I've created a workout for you, it's now in your saved workouts.")
+
+        return ChatResult(generations=[ChatGeneration(message=ai_message)])
+
+def _tool_call(tool_name, tool_args):
+    return AIMessage(
+        content="",
+        tool_calls=[
+            {
+                "name": tool_name,
+                "args": tool_args,
+                "id": uuid.uuid4().hex,
+            },
+        ],
+    )
+
+def _find_user_id(messages):
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            match = _USER_ID_PATTERN.search(message.content)
+            if match is not None:
+                return match.group(1)
+    return None
+
+def _recommended_components(known_names_content, past_workouts_content):
+    """
+    :param known_names_content: str. Output of get_known_workout_names_tool, as the agent passed it back.
+    :param past_workouts_content: str. Output of get_past_5_workouts_tool, as the agent passed it back.
+    :return: List[Dict]. Workout components using the first few known exercises, with the suggested reps and weight
+        of those the user has done recently.
+    """
+
+    try:
+        known_names = json.loads(known_names_content)
+    except (TypeError, ValueError):
+        # Tool output is sometimes passed back as the str() of a list
+        known_names = re.findall(r"'([^']+)'", str(known_names_content))
+
+    try:
+        past_workouts = json.loads(past_workouts_content)
+    except (TypeError, ValueError):
+        # Or the str() of a dict
+        past_workouts = ast.literal_eval(str(past_workouts_content))
+
+    suggestions = {
+        suggestion["exercise_name"]: suggestion
+        for suggestion in past_workouts["next_session_suggestions"]
+    }
+
+    components = []
+    for position, exercise_name in enumerate(known_names[:RECOMMENDED_EXERCISE_COUNT]):
+        suggestion = suggestions.get(exercise_name, {"reps": "8-10", "weight": 10.0, "units": "kg"})
+        components.append({
+            "exercise_name": exercise_name,
+            "position": position,
+            "reps": suggestion["reps"],
+            "weight": suggestion["weight"],
+            "units": suggestion["units"],
+        })
+
+    return components
@@ -0,0 +1,114 @@
+"""
+Removes redundant versions from workout_component_history: versions with the same reps, weight and units as the
+version before them. Until the update endpoint started skipping unchanged components, every save of a workout added
+one of these for every component, whether it had changed or not.
+
+The first version of each run of identical versions is kept, so every component keeps its full history of actual
+changes, including when each change was made, and its latest values don't change.
+
+Works through components in batches, one transaction per batch, so it can run against a live database.
+
+    python -m app.utils.history_compaction --dry-run
+"""
+
+import argparse
+import logging
+import time
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+_BATCH_QUERY = text(
+    """
+    SELECT workout_component_id
+    FROM workout_components
+    WHERE (CAST(:after AS UUID) IS NULL OR workout_component_id > CAST(:after AS UUID))
+    ORDER BY workout_component_id
+    LIMIT :batch_size
+    """
+)
+
+# Versions identical to the one before them, within the batch's components
+_REDUNDANT_VERSIONS = """
+    SELECT workout_component_history_id
+    FROM (
+        SELECT
+            workout_component_history_id,
+            reps, weight, units,
+            LAG(reps) OVER component_versions AS previous_reps,
+            LAG(weight) OVER component_versions AS previous_weight,
+            LAG(units) OVER component_versions AS previous_units
+        FROM workout_component_history
+        WHERE workout_component_id = ANY(CAST(:workout_component_ids AS UUID[]))
+        WINDOW component_versions AS (
+            PARTITION BY workout_component_id
+            ORDER BY datetime_added, workout_component_history_id
+        )
+    ) AS versions
+    WHERE reps = previous_reps AND weight = previous_weight AND units = previous_units
+"""
+
+_COUNT_QUERY = text(f"SELECT count(*) FROM ({_REDUNDANT_VERSIONS}) AS redundant_versions")
+
+_DELETE_QUERY = text(
+    f"""
+    DELETE FROM workout_component_history
+    WHERE workout_component_history_id IN ({_REDUNDANT_VERSIONS})
+    """
+)
+
+def compact_component_history(engine, batch_size=1000, dry_run=False):
+    """
+    :param engine: Engine. The database to compact.
+    :param batch_size: int. Components per transaction.
+    :param dry_run: bool. Only count the redundant versions, without removing them.
+    :return: int. Number of versions removed, or that would be removed if dry_run.
+    """
+
+    removed_count = 0
+    last_component_id = None
+    start = time.perf_counter()
+
+    while True:
+
+        with engine.begin() as connection:
+
+            workout_component_ids = [
+                row.workout_component_id
+                for row in connection.execute(_BATCH_QUERY, {"after": last_component_id, "batch_size": batch_size})
+            ]
+            if not workout_component_ids:
+                break
+
+            parameters = {"workout_component_ids": workout_component_ids}
+            if dry_run:
+                removed_count += connection.execute(_COUNT_QUERY, parameters).scalar()
+            else:
+                removed_count += connection.execute(_DELETE_QUERY, parameters).rowcount
+
+        last_component_id = str(workout_component_ids[-1])
+
+    logger.info(
+        "Component history compacted",
+        extra={"removed_count": removed_count, "dry_run": dry_run, "duration_ms": round((time.perf_counter() - start) * 1000)},
+    )
+
+    return removed_count
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Remove repeated, unchanged versions from workout_component_history")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Components per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the versions that would be removed")
+    args = parser.parse_args()
+
+    from ..database import shard_engines
+
+    # Every shard's, see app/utils/sharding.py
+    for shard_name, engine in shard_engines.items():
+        removed_count = compact_component_history(engine, batch_size=args.batch_size, dry_run=args.dry_run)
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {removed_count} redundant versions [{shard_name}]")
+
+if __name__ == "__main__":
+    main()
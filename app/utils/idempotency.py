@@ -0,0 +1,335 @@
+"""
+Idempotency-Key support for write endpoints, so the app can safely retry a request after a timeout. Without it, a
+retry of a request that had in fact succeeded creates a second workout, finished session or user.
+
+The app sends a unique Idempotency-Key header with each write, and the same key with any retries of it. The first
+request with a key is handled as normal, and its response stored. Retries get the stored response back, with an
+Idempotent-Replayed header, without the request being handled again. Keys are scoped to the user (or to no user, for
+signups) and the endpoint, and reusing a key for a different request body gets a 422.
+
+Responses are stored in the idempotency_keys table, shared by every worker, with a per-worker LRU cache in front of it.
+A retry that arrives while the first request is still being handled waits for it to finish rather than racing it:
+in the same worker by waiting on it directly, otherwise by polling the table. If it's still not finished after
+IDEMPOTENCY_WAIT_SECONDS, the retry gets a 409 with a Retry-After header.
+
+Server errors, and responses that depend on the moment (such as 401s and 429s), aren't stored, so they can be retried.
+
+IDEMPOTENCY_TTL_SECONDS: How long responses are stored for, and so how long the app can retry for.
+IDEMPOTENCY_CACHE_SIZE: Responses cached per worker. 0 disables the cache, leaving only the table.
+"""
+
+import time
+import asyncio
+import hashlib
+import logging
+from os import getenv
+
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from .jwt import verify_jwt
+from ..database import engine
+from .metrics import idempotency_requests_total
+from .user_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = float(getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_WAIT_SECONDS = float(getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+
+# A request still in progress after this long is assumed to have died with its worker, and its key can be claimed again
+IDEMPOTENCY_LOCK_SECONDS = 60
+# How often the table is checked while waiting for a request in another worker
+IDEMPOTENCY_POLL_SECONDS = 0.1
+# How often each worker removes expired keys from the table
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = 300
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# POST endpoints whose requests can be made idempotent with a key
+IDEMPOTENT_ROUTES = {
+    "/users/signup",
+    "/workouts/create",
+    "/workouts/finish",
+    "/workouts/recommendation",
+    "/workouts/sessions",
+}
+
+# Responses that would be different if the request were made again later, so aren't stored
+UNSTORED_STATUS_CODES = {401, 408, 409, 425, 429}
+
+_CLAIM_KEY = text(
+    """
+    INSERT INTO idempotency_keys (idempotency_key_id, request_hash, expires_datetime)
+    VALUES (:idempotency_key_id, :request_hash, LOCALTIMESTAMP + make_interval(secs => :ttl_seconds))
+    ON CONFLICT (idempotency_key_id) DO UPDATE SET
+        request_hash = EXCLUDED.request_hash,
+        status_code = NULL,
+        content_type = NULL,
+        response_body = NULL,
+        claimed_datetime = LOCALTIMESTAMP,
+        expires_datetime = EXCLUDED.expires_datetime
+    -- Expired, or abandoned by a worker that died while handling it
+    WHERE idempotency_keys.expires_datetime < LOCALTIMESTAMP
+    OR (
+        idempotency_keys.status_code IS NULL
+        AND idempotency_keys.claimed_datetime < LOCALTIMESTAMP - make_interval(secs => :lock_seconds)
+    )
+    RETURNING idempotency_key_id
+    """
+)
+
+_GET_KEY = text(
+    """
+    SELECT request_hash, status_code, content_type, response_body,
+        EXTRACT(EPOCH FROM expires_datetime - LOCALTIMESTAMP) AS expires_in_seconds
+    FROM idempotency_keys
+    WHERE idempotency_key_id = :idempotency_key_id
+    """
+)
+
+_STORE_RESPONSE = text(
+    """
+    UPDATE idempotency_keys
+    SET status_code = :status_code, content_type = :content_type, response_body = :response_body
+    WHERE idempotency_key_id = :idempotency_key_id AND status_code IS NULL
+    """
+)
+
+_RELEASE_KEY = text("DELETE FROM idempotency_keys WHERE idempotency_key_id = :idempotency_key_id AND status_code IS NULL")
+
+_PURGE_EXPIRED = text(
+    """
+    DELETE FROM idempotency_keys
+    WHERE idempotency_key_id IN (
+        SELECT idempotency_key_id FROM idempotency_keys
+        WHERE expires_datetime < LOCALTIMESTAMP
+        LIMIT 1000
+    )
+    """
+)
+
+class IdempotencyKeyStore:
+    """
+    Claims keys, and stores and looks up their responses, in the idempotency_keys table. Called from a thread pool,
+    as the database calls block.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._last_purge = time.monotonic()
+
+    def claim(self, idempotency_key_id, request_hash):
+        """
+        :return: bool. Whether the key was claimed, in which case the request should be handled and its response stored.
+        """
+
+        with self.engine.begin() as connection:
+            claimed = connection.execute(
+                _CLAIM_KEY,
+                {
+                    "idempotency_key_id": idempotency_key_id,
+                    "request_hash": request_hash,
+                    "ttl_seconds": IDEMPOTENCY_TTL_SECONDS,
+                    "lock_seconds": IDEMPOTENCY_LOCK_SECONDS,
+                },
+            ).first() is not None
+
+        if time.monotonic() - self._last_purge > IDEMPOTENCY_PURGE_INTERVAL_SECONDS:
+            self._last_purge = time.monotonic()
+            self.purge_expired()
+
+        return claimed
+
+    def get(self, idempotency_key_id):
+        """
+        :return: Row. The key's request hash, stored response (status_code is None while in progress) and seconds until
+            it expires, or None if the key isn't in the table.
+        """
+
+        with self.engine.begin() as connection:
+            return connection.execute(_GET_KEY, {"idempotency_key_id": idempotency_key_id}).first()
+
+    def store(self, idempotency_key_id, status_code, content_type, response_body):
+        with self.engine.begin() as connection:
+            connection.execute(
+                _STORE_RESPONSE,
+                {
+                    "idempotency_key_id": idempotency_key_id,
+                    "status_code": status_code,
+                    "content_type": content_type,
+                    "response_body": response_body,
+                },
+            )
+
+    def release(self, idempotency_key_id):
+        with self.engine.begin() as connection:
+            connection.execute(_RELEASE_KEY, {"idempotency_key_id": idempotency_key_id})
+
+    def purge_expired(self):
+        with self.engine.begin() as connection:
+            removed_count = connection.execute(_PURGE_EXPIRED).rowcount
+        logger.debug("Purged expired idempotency keys", extra={"removed_count": removed_count})
+
+class IdempotencyController:
+    """
+    Replays stored responses for requests with an Idempotency-Key header, and stores the responses of new ones.
+    """
+
+    def __init__(self, store, cache_size):
+        self.store = store
+        # Key ID -> (request hash, status code, content type, body), for completed requests
+        self._cache = LRUCache(cache_size)
+        # Key ID -> future completed when the request handling it in this worker finishes. Only used from the event loop.
+        self._in_flight = {}
+
+    @staticmethod
+    def _user_scope(request):
+        """
+        :return: str. Who the key belongs to: the user ID from the access token, or '' if there isn't one. None if the
+            token is invalid, in which case the request will be rejected anyway.
+        """
+
+        authorization = request.headers.get("Authorization")
+        if not authorization:
+            return ""
+
+        _, _, token = authorization.partition(" ")
+        valid, decoded_token = verify_jwt(token.strip())
+        if not valid:
+            return None
+
+        return str(decoded_token.get("user_id", ""))
+
+    @staticmethod
+    def _mismatch():
+        idempotency_requests_total.labels("mismatch").inc()
+        return JSONResponse(
+            status_code=422,
+            content={"message": f"{IDEMPOTENCY_KEY_HEADER} was already used for a different request"},
+        )
+
+    def _replay(self, stored, request_hash, result):
+
+        stored_request_hash, status_code, content_type, body = stored
+        if stored_request_hash != request_hash:
+            return self._mismatch()
+
+        idempotency_requests_total.labels(result).inc()
+        return Response(
+            content=body,
+            status_code=status_code,
+            media_type=content_type,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    async def __call__(self, request, call_next):
+
+        idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if idempotency_key is None or request.method != "POST" or request.url.path not in IDEMPOTENT_ROUTES:
+            return await call_next(request)
+
+        if not idempotency_key or len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return JSONResponse(
+                status_code=400,
+                content={"message": f"{IDEMPOTENCY_KEY_HEADER} must be between 1 and {MAX_IDEMPOTENCY_KEY_LENGTH} characters"},
+            )
+
+        user_scope = self._user_scope(request)
+        if user_scope is None:
+            return await call_next(request)
+
+        # Hashed, so keys of any length fit the table, and stored keys reveal nothing about the requests
+        idempotency_key_id = hashlib.sha256(
+            f"{user_scope}\n{request.url.path}\n{idempotency_key}".encode()
+        ).hexdigest()
+        request_hash = hashlib.sha256(await request.body()).hexdigest()
+
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        waited = False
+
+        while True:
+
+            stored = self._cache.get(idempotency_key_id, None)
+            if stored is not None:
+                return self._replay(stored, request_hash, "waited" if waited else "replayed")
+
+            # Being handled in this worker, so wait for it, then look again
+            in_flight = self._in_flight.get(idempotency_key_id)
+            if in_flight is not None:
+                waited = True
+                try:
+                    await asyncio.wait_for(asyncio.shield(in_flight), timeout=max(0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                continue
+
+            if await run_in_threadpool(self.store.claim, idempotency_key_id, request_hash):
+                return await self._handle(request, call_next, idempotency_key_id, request_hash)
+
+            row = await run_in_threadpool(self.store.get, idempotency_key_id)
+            if row is not None and row.status_code is not None:
+                stored = (row.request_hash, row.status_code, row.content_type, bytes(row.response_body))
+                self._cache.set(idempotency_key_id, stored, max(0, float(row.expires_in_seconds)))
+                return self._replay(stored, request_hash, "waited" if waited else "replayed")
+            if row is not None and row.request_hash != request_hash:
+                return self._mismatch()
+
+            # Being handled in another worker. If it was released in the meantime, the next claim will succeed.
+            if time.monotonic() >= deadline:
+                break
+            waited = True
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+        idempotency_requests_total.labels("conflict").inc()
+        return JSONResponse(
+            status_code=409,
+            content={"message": f"A request with this {IDEMPOTENCY_KEY_HEADER} is still in progress"},
+            headers={"Retry-After": "1"},
+        )
+
+    async def _handle(self, request, call_next, idempotency_key_id, request_hash):
+
+        in_flight = asyncio.get_running_loop().create_future()
+        self._in_flight[idempotency_key_id] = in_flight
+        stored = False
+
+        try:
+            response = await call_next(request)
+
+            if response.status_code >= 500 or response.status_code in UNSTORED_STATUS_CODES:
+                return response
+
+            # The body has to be read to be stored, so the response is rebuilt from it
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            content_type = response.headers.get("content-type")
+            await run_in_threadpool(self.store.store, idempotency_key_id, response.status_code, content_type, body)
+            stored = True
+
+            self._cache.set(
+                idempotency_key_id,
+                (request_hash, response.status_code, content_type, body),
+                IDEMPOTENCY_TTL_SECONDS,
+            )
+            idempotency_requests_total.labels("new").inc()
+
+            return Response(
+                content=body,
+                status_code=response.status_code,
+                headers=dict(response.headers),
+            )
+
+        finally:
+            if not stored:
+                # So the request can be retried with the same key
+                try:
+                    await run_in_threadpool(self.store.release, idempotency_key_id)
+                except Exception as e:
+                    logger.warning("Failed to release idempotency key", extra={"error": str(e)})
+            del self._in_flight[idempotency_key_id]
+            in_flight.set_result(None)
+
+idempotency_controller = IdempotencyController(IdempotencyKeyStore(engine), IDEMPOTENCY_CACHE_SIZE)
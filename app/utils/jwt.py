@@ -3,9 +3,15 @@ from functools import wraps
 from fastapi import HTTPException, Depends, Request
 
 import jwt
+import logging
+from os import getenv
 from datetime import datetime, timedelta
 
 from .secrets import get_secret
+from .timing import timed_phase
+from .tracing import start_span
+
+logger = logging.getLogger(__name__)
 
 # https://stackoverflow.com/questions/64146591/custom-authentication-for-fastapi
 
@@ -51,24 +57,29 @@ def get_bearer_token_from_request(req: Request):
     
 def requires_authorization(req: Request):
 
+    with timed_phase("auth"), start_span("requires_authorization"):
+        return _requires_authorization(req)
+
+def _requires_authorization(req: Request):
+
     access_token = get_bearer_token_from_request(req)
     # ???
     # if (isinstance(access_token, tuple)):
     #     print(access_token)
     #     return access_token
 
-    print(f"[requires_authorization] Token: {access_token}")
-
     # Validate Token
     try:
         # TODO -> Pass access token to the caller
         decoded_access_token = verify_jwt_throws(access_token)
     except jwt.ExpiredSignatureError:
+        logger.debug("Access token was expired")
         raise HTTPException(
             status_code=401,
             detail=f'Endpoint requires authorization: Access token was expired',
         )
     except jwt.InvalidTokenError:
+        logger.info("Access token was invalid")
         raise HTTPException(
             status_code=401,
             detail=f'Endpoint requires authorization: Access token was invalid',
@@ -100,7 +111,8 @@ def requires_authorization(req: Request):
 #     return decorator
 
 # TODO -> This is a demo app, but eventually this will be a GCP secret
-jwt_secret_key = get_secret("workout-app-api-jwt-key")
+# JWT_SECRET_KEY is only intended for local runs that can't reach GCP, such as load tests
+jwt_secret_key = getenv("JWT_SECRET_KEY") or get_secret("workout-app-api-jwt-key")
 
 # TODO -> Should probably make the JWT contents explicit params so it is clear what goes in them,
 # as at the momement the contents are defined in the login functions.
@@ -118,8 +130,6 @@ def generate_jwt(token_lifetime=timedelta(minutes=30),**token_contents):
     # UTC to ensure a commonly used timezone
     payload['exp'] = datetime.utcnow() + token_lifetime
 
-    print("[DEBUG] Token contents:", payload)
-
     # TODO -> Have a real secret key
     # Secret key (used to sign the token)
     secret_key = jwt_secret_key
@@ -143,17 +153,13 @@ def verify_jwt(token):
         decoded_token = jwt.decode(token, jwt_secret_key, algorithms=['HS256'])
 
         # The token is valid if decoding doesn't raise an exception
-        print("[DEBUG] Token is valid!")
-        print(type(decoded_token))
-        print(decoded_token)  # The decoded token claims
-
         return True, decoded_token
 
     except jwt.ExpiredSignatureError:
-        print("[DEBUG] Token has expired!")
+        logger.debug("Token has expired")
         return False, None
     except jwt.InvalidTokenError:
-        print("[DEBUG] Token is invalid!")
+        logger.debug("Token is invalid")
         return False, None
     
 def verify_jwt_throws(token):
@@ -170,11 +176,7 @@ def verify_jwt_throws(token):
     # Verify the token using the secret key
     decoded_token = jwt.decode(token, jwt_secret_key, algorithms=['HS256'])
 
-    # The token is valid if decoding doesn't raise an exception
-    print("[DEBUG] Token is valid!")
-    print(type(decoded_token))
-    print(decoded_token)  # The decoded token claims
-
+    # The token is valid if decoding doesn't raise an exception. Claims are deliberately not logged.
     return decoded_token
 
 # def get_jwt_contents -> TODO
\ No newline at end of file
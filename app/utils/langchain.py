@@ -19,21 +19,41 @@ from langchain_google_vertexai import ChatVertexAI
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 
 from .langchain_tools import get_known_workout_names_tool, create_workout_recommendation_tool, get_past_5_workouts_tool
+from .langchain_callbacks import TimingCallbackHandler, MetricsCallbackHandler, TracingCallbackHandler
+from .tracing import traced
 
 # Debugging
 from langchain.globals import set_debug
 from langchain.globals import set_verbose
 
-set_debug(True)
-set_verbose(True)
+import logging
+from os import getenv
 
 import vertexai
 
+from .fake_llm import FakeToolCallingChatModel
+
+logger = logging.getLogger(__name__)
+
+# 'vertexai', or 'fake' to use a stand-in that needs no GCP access (see app/utils/fake_llm.py)
+LLM_BACKEND = getenv("LLM_BACKEND", "vertexai").lower()
+
+# LangChain's debug output goes straight to stdout for every chain step, so it is opt-in
+LANGCHAIN_DEBUG = getenv("LANGCHAIN_DEBUG", "false").lower() == "true"
+
+set_debug(LANGCHAIN_DEBUG)
+set_verbose(LANGCHAIN_DEBUG)
+
 # Needed since in a container, and the project isn't set through just credentials
 vertexai.init(project="practice-project-thorin", location="europe-west2")
 
 # from .utils.langchain_tools import get_known_workout_names_tool, create_workout_recommendation_tool
 
+# IMPORTANT: Always specify a specific version where possible. Different model versions may expect different prompt
+# templates.
+MODEL_NAME = "gemini-1.5-flash" # New as of 9th April 2024. Supports system messages now
+
+@traced("simple_prompt")
 def simple_prompt(
     user_query,
     user_id,
@@ -58,7 +78,7 @@ def simple_prompt(
     # TODO -> Limit number of tokens in user input
     # TODO -> Combine known workouts and user workouts into one step?
 
-    print(user_query)
+    logger.debug("Recommendation requested", extra={"user_id": user_id, "user_query": user_query})
 
     system_msg = f"""
     You are a helpful assistant who gives workout recommendations. The workouts recommended should target the muscle groups that the user specifies, if any.
@@ -67,7 +87,7 @@ def simple_prompt(
     
     Follow these steps exactly:
 
-    1. Use the get_past_5_workouts_tool tool to get the user's latest completed workouts, newest first. use this to get some context on the user's ability, such as the exercises, weights, and reps that they've used before.
+    1. Use the get_past_5_workouts_tool tool to get the user's latest completed workouts, newest first. use this to get some context on the user's ability, such as the exercises, weights, and reps that they've used before. It also gives next_session_suggestions, the reps and weight the user should use next for the exercises they've done recently.
     2. Get a list of exercise names using the get_known_workout_names_tool tool.
     3. Selecting only from the list of names in step 2, select the most suitable exercises for this recommendation. 5 or 6 names is a good number unless more are requested.
     4. Using the names selected in step 2, create a JSON following this format:
@@ -82,6 +102,8 @@ def simple_prompt(
         }}}}
     ]
 
+    For exercises in next_session_suggestions, use the suggested reps, weight and units. For other exercises, choose a weight suited to the user's ability. Only use a weight of 0 for bodyweight exercises.
+
     4. Pass the JSON from step 3 to the create_workout_recommendation_tool tool.
 
     """
@@ -106,11 +128,7 @@ def simple_prompt(
         get_past_5_workouts_tool,
     ]
 
-    for i, tool in enumerate(tools):
-        print(f"Tool {i+1}")
-        print(tool.name)
-        print(tool.description)
-        print(tool.args)
+    logger.debug("Tools available to the agent", extra={"tools": [tool.name for tool in tools]})
 
     # https://cloud.google.com/python/docs/reference/aiplatform/latest/vertexai.generative_models.GenerativeModel
     # https://cloud.google.com/vertex-ai/generative-ai/docs/model-reference/gemini
@@ -118,21 +136,22 @@ def simple_prompt(
 
     # See parameters available, like temperature
 
-    # IMPORTANT: Always specify a specific version where possible. Different model versions may expect different prompt
-    # templates.
-    llm = ChatVertexAI(
-        model_name="gemini-1.5-flash", # New as of 9th April 2024. Supports system messages now
-        convert_system_message_to_human=False,
-        max_retries=1,
-        request_parallelism=1,
-        temperature=0.0,
-        # max_output_tokens=2000,
-    )
+    if LLM_BACKEND == "fake":
+        llm = FakeToolCallingChatModel()
+    else:
+        llm = ChatVertexAI(
+            model_name=MODEL_NAME,
+            convert_system_message_to_human=False,
+            max_retries=1,
+            request_parallelism=1,
+            temperature=0.0,
+            # max_output_tokens=2000,
+        )
 
     agent = create_tool_calling_agent(llm, tools, prompt)
 
     # Note the verbose here
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=LANGCHAIN_DEBUG)
 
     # Seems to struggle in "day" is used, instead of workout
     agent_output = agent_executor.invoke(
@@ -145,9 +164,16 @@ def simple_prompt(
             # "input" : f"No additional user input",
             "input" : user_query,
         },
+        config={
+            "callbacks" : [
+                TimingCallbackHandler(),
+                MetricsCallbackHandler(),
+                TracingCallbackHandler(model_name=MODEL_NAME),
+            ],
+        },
     )
 
-    print(agent_output)
+    logger.debug("Agent finished", extra={"agent_output": agent_output.get("output")})
 
     # chain = prompt | llm
     # https://api.python.langchain.com/en/latest/messages/langchain_core.messages.ai.AIMessage.html
@@ -0,0 +1,135 @@
+"""
+LangChain callback handlers, passed to the agent executor to observe model calls and tool use.
+"""
+
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .timing import request_timings, record_phase
+from .metrics import llm_call_duration_seconds, llm_calls_total, llm_tool_calls_total
+from .tracing import current_span, begin_span, finish_span
+
+class TimingCallbackHandler(BaseCallbackHandler):
+    """
+    Records time spent waiting on the model ('llm') and running tools ('tool') against the current request's timings.
+
+    The request's timings are captured when the handler is created, as LangChain may call the handler from threads
+    that don't share the request's context.
+    """
+
+    def __init__(self):
+        self.timings = request_timings.get()
+        # run_id -> start time
+        self._run_starts = {}
+
+    def _start(self, run_id):
+        self._run_starts[run_id] = time.perf_counter()
+
+    def _end(self, phase_name, run_id):
+        start = self._run_starts.pop(run_id, None)
+        if start is not None and self.timings is not None:
+            record_phase(phase_name, time.perf_counter() - start, timings=self.timings)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end("llm", run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end("llm", run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end("tool", run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end("tool", run_id)
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records LLM call latencies and outcomes, and tool calls by tool and outcome, as Prometheus metrics.
+    """
+
+    def __init__(self):
+        # run_id -> start time
+        self._llm_starts = {}
+        # run_id -> tool name
+        self._tool_names = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._llm_starts[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._llm_starts[run_id] = time.perf_counter()
+
+    def _llm_finished(self, run_id, outcome):
+        start = self._llm_starts.pop(run_id, None)
+        if start is not None:
+            llm_call_duration_seconds.observe(time.perf_counter() - start)
+        llm_calls_total.labels(outcome).inc()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._llm_finished(run_id, "success")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._llm_finished(run_id, "error")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._tool_names[run_id] = (serialized or {}).get("name", "unknown")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        llm_tool_calls_total.labels(self._tool_names.pop(run_id, "unknown"), "success").inc()
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        llm_tool_calls_total.labels(self._tool_names.pop(run_id, "unknown"), "error").inc()
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Records each call to the model as a span. LangChain callbacks can't set the current span, so the spans are
+    parented explicitly to the span that was current when the handler was created.
+    """
+
+    def __init__(self, model_name=None):
+        self.parent_span = current_span.get()
+        self.model_name = model_name
+        # run_id -> Tuple(Span, Token)
+        self._spans = {}
+
+    def _start(self, serialized, run_id):
+        if self.parent_span is None:
+            return
+        self._spans[run_id] = begin_span(
+            "vertex_ai.chat",
+            parent=self.parent_span,
+            **{
+                "llm.model": self.model_name,
+                "llm.class": ((serialized or {}).get("id") or ["unknown"])[-1],
+            },
+        )
+
+    def _finish(self, run_id, exception=None, response=None):
+        span, token = self._spans.pop(run_id, (None, None))
+        if span is not None and response is not None:
+            token_usage = (response.llm_output or {}).get("usage_metadata") or {}
+            for key, value in token_usage.items():
+                span.set_attribute(f"llm.usage.{key}", value)
+        finish_span(span, token, exception=exception)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(serialized, run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(serialized, run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id, response=response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, exception=error)
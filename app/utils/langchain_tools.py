@@ -1,4 +1,5 @@
 from .database import get_known_workout_names, get_latest_finished_workouts_for_user
+from .progression import suggest_recent_exercises
 from ..route_functions import create_workout_raw
 from ..schemas import CreateWorkoutSchema
 
@@ -6,6 +7,8 @@ from langchain.tools import tool
 from typing import List, Dict, Any
 
 from ..database import SessionLocal
+from .tracing import traced
+from .sharding import open_user_session
 
 # TODO -> If this works, move to a different file
 def get_db():
@@ -15,9 +18,16 @@ def get_db():
     finally:
         db_session.close()
 
+# For the tools that read or write a user's data, which is on the user's shard, see app/utils/sharding.py
+def get_user_db(user_id, for_write=False):
+    with open_user_session(user_id, for_write=for_write) as db_session:
+        yield db_session
+
 # Once annotated as a tool, this doesn't work like a regular function anymore. Hence this is just essentially a decorator
 # that preserves the original function.
+# traced is applied first, so the span covers the function itself and its SQL statements become the span's children
 @tool
+@traced("tool.get_known_workout_names_tool")
 def get_known_workout_names_tool() -> List[str]:
     """
     Gets the names of all exercises that the backend is aware of. Workout recommendations
@@ -34,6 +44,7 @@ def get_known_workout_names_tool() -> List[str]:
     return result
 
 @tool
+@traced("tool.create_workout_recommendation_tool")
 def create_workout_recommendation_tool(
     user_id : str,
     workout_name : str,
@@ -64,7 +75,7 @@ def create_workout_recommendation_tool(
         "ai_generated" : True,
     }
 
-    db_gen = get_db()
+    db_gen = get_user_db(user_id, for_write=True)
     db_session = next(db_gen)
     try:
         result = create_workout_raw(
@@ -79,25 +90,35 @@ def create_workout_recommendation_tool(
     return result
 
 @tool
+@traced("tool.get_past_5_workouts_tool")
 def get_past_5_workouts_tool(
     user_id : str,
 ) -> None:
     """
-    Returns a list of the user's 5 most recently completed workouts.
+    Returns a list of the user's 5 most recently completed workouts, and the reps and weight the user should use next
+    for each exercise in their recently completed workouts, worked out from how their recent sessions of it went.
 
     The user_id to use with this tool will be provided to you.
     """
 
     # create_workout_recommendation(payload=, decoded_access_token=)
 
-    db_gen = get_db()
+    db_gen = get_user_db(user_id)
     db_session = next(db_gen)
     try:
         workouts = get_latest_finished_workouts_for_user(
             db_session=db_session,
             user_id=user_id,
         )
+        # In the same tool, so the model has them without another turn
+        next_session_suggestions = suggest_recent_exercises(
+            db_session=db_session,
+            user_id=user_id,
+        )
     finally:
         db_gen.close()
 
-    return workouts
\ No newline at end of file
+    return {
+        "workouts": workouts,
+        "next_session_suggestions": next_session_suggestions,
+    }
\ No newline at end of file
@@ -1,6 +1,11 @@
 from ..models import Users, Actions, ActionLog
 from sqlalchemy.orm import Session
 
+# Resolves to the standard library, not this module
+import logging
+
+logger = logging.getLogger(__name__)
+
 UNKNOWN_ACTION = "UNKNOWN_ACTION"
 FAILED_LOG = "FAILED_LOG"
 
@@ -48,7 +53,7 @@ def log_action(
     
     try:
 
-        print(f"[LOGGING] Log request for {action_name}")
+        logger.debug("Log request", extra={"action_name": action_name})
 
         if (not user_id is None) and ((not username is None)):
             raise ValueError("One of user_id or username should be non-None")
@@ -56,7 +61,7 @@ def log_action(
         if user_id is None:
             query = db_session.query(Users.user_id, Users.username).filter(Users.username == username)
             if query.count() != 1:
-                print("[WARNING] Failed to log action due to being unable to find the correct user_id")
+                logger.warning("Failed to log action due to being unable to find the correct user_id", extra={"action_name": action_name})
                 return False
 
             user_id = query.first().user_id
@@ -77,8 +82,7 @@ def log_action(
         
         return True
 
-    except Exception as e:
+    except Exception:
         # Allowing execution to continue even though logging failed.
-        print("[WARNING] Failed to log action due to an exception")
-        print(e)
+        logger.warning("Failed to log action due to an exception", exc_info=True, extra={"action_name": action_name})
         return False
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""
+Prometheus metrics, served in the text format by the /metrics endpoint.
+
+When PROMETHEUS_MULTIPROC_DIR is set (see config/gunicorn.conf.py), each gunicorn worker writes its values to files in
+that directory, and /metrics aggregates the files of all workers. Otherwise values are kept in memory, which is fine
+for a single process, such as local runs via uvicorn.
+
+The API is deployed publicly, so /metrics is only served where metrics_allowed says so, and is a 404 otherwise, as if it
+didn't exist.
+
+METRICS_TOKEN: If set, /metrics is only served to requests with "Authorization: Bearer <METRICS_TOKEN>", eg Prometheus
+    with its authorization credentials set to the token.
+METRICS_ENABLED: "true" to serve /metrics to anyone, when METRICS_TOKEN isn't set. Only for runs that aren't publicly
+    reachable, such as local ones (config/local.yaml). Not tied to ENV, as the dev environment is deployed publicly.
+"""
+
+import hmac
+import time
+import threading
+from os import getenv
+
+from prometheus_client import (
+    Counter, Histogram, Gauge,
+    CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+METRICS_TOKEN = getenv("METRICS_TOKEN")
+METRICS_ENABLED = getenv("METRICS_ENABLED", "false").lower() == "true"
+
+# Used for routes that didn't match anything, so that scanners can't create unbounded numbers of label values
+UNMATCHED_ROUTE = "unmatched"
+
+# Request latencies are mostly tens of milliseconds, but LLM requests can take tens of seconds
+REQUEST_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUERY_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+LLM_LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+http_requests_total = Counter(
+    "http_requests_total",
+    "Requests handled, by route template and status code",
+    ["method", "route", "status_code"],
+)
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time taken to handle requests, by route template",
+    ["method", "route"],
+    buckets=REQUEST_LATENCY_BUCKETS,
+)
+http_exception_responses_total = Counter(
+    "http_exception_responses_total",
+    "Responses produced by the HTTPException handler, by route template and status code",
+    ["route", "status_code"],
+)
+
+db_queries_total = Counter(
+    "db_queries_total",
+    "SQL statements executed, by statement type",
+    ["statement_type"],
+)
+db_query_duration_seconds = Histogram(
+    "db_query_duration_seconds",
+    "Time taken to execute SQL statements, by statement type",
+    ["statement_type"],
+    buckets=QUERY_LATENCY_BUCKETS,
+)
+# livesum, so the gauges add up across workers and ignore workers that have exited
+db_pool_checked_out = Gauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the pool, by database",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+db_pool_overflow = Gauge(
+    "db_pool_overflow",
+    "Connections currently open beyond the pool's size, by database",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+
+llm_call_duration_seconds = Histogram(
+    "llm_call_duration_seconds",
+    "Time taken by calls to the LLM",
+    buckets=LLM_LATENCY_BUCKETS,
+)
+llm_calls_total = Counter(
+    "llm_calls_total",
+    "Calls made to the LLM, by outcome",
+    ["outcome"],
+)
+llm_tool_calls_total = Counter(
+    "llm_tool_calls_total",
+    "Tool calls made by the agent, by tool and outcome",
+    ["tool", "outcome"],
+)
+
+admission_in_flight = Gauge(
+    "admission_in_flight",
+    "Requests currently admitted, by admission limiter",
+    ["limiter"],
+    multiprocess_mode="livesum",
+)
+admission_shed_total = Counter(
+    "admission_shed_total",
+    "Requests shed with a 503 by admission control, by limiter and reason",
+    ["limiter", "reason"],
+)
+user_quota_rejections_total = Counter(
+    "user_quota_rejections_total",
+    "Requests rejected with a 429 for exceeding a per-user quota, by quota and reason",
+    ["quota", "reason"],
+)
+
+user_cache_lookups_total = Counter(
+    "user_cache_lookups_total",
+    "Lookups in the per-worker user credentials cache, by result (hit, negative_hit or miss)",
+    ["result"],
+)
+
+idempotency_requests_total = Counter(
+    "idempotency_requests_total",
+    "Requests with an Idempotency-Key header, by result (new, replayed, waited, mismatch or conflict)",
+    ["result"],
+)
+
+response_cache_lookups_total = Counter(
+    "response_cache_lookups_total",
+    "Requests for cached responses, by response and result (not_modified, hit or miss)",
+    ["response", "result"],
+)
+
+def route_label(request):
+    """
+    :param request: Request. The request, after it has been routed.
+    :return: str. The template of the route that handled the request, eg /workouts/saved.
+    """
+
+    route = request.scope.get("route")
+    return route.path if route is not None else UNMATCHED_ROUTE
+
+def observe_request(request, status_code, duration):
+    """
+    Records a handled request.
+    :param request: Request. The request, after it has been routed.
+    :param status_code: int. The status code of the response.
+    :param duration: float. Seconds taken to handle the request.
+    """
+
+    route = route_label(request)
+    http_requests_total.labels(request.method, route, str(status_code)).inc()
+    http_request_duration_seconds.labels(request.method, route).observe(duration)
+
+def instrument_engine_metrics(engine, database="core_db"):
+    """
+    Registers SQLAlchemy events on the engine, so that statements and the state of the connection pool are recorded.
+    :param engine: Engine. The engine to instrument.
+    :param database: str. The engine's bind name, which its pool's gauges are labelled with.
+    """
+
+    pool = engine.pool
+
+    # Counted here rather than read from pool.checkedout(), which hasn't been updated yet when checkin fires
+    pool_state = {"checked_out": 0}
+    pool_state_lock = threading.Lock()
+
+    def _update_pool_gauges(change):
+        with pool_state_lock:
+            pool_state["checked_out"] += change
+            checked_out = pool_state["checked_out"]
+        db_pool_checked_out.labels(database).set(checked_out)
+        db_pool_overflow.labels(database).set(max(0, checked_out - pool.size()))
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statement_type = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        db_queries_total.labels(statement_type).inc()
+        db_query_duration_seconds.labels(statement_type).observe(time.perf_counter() - context._metrics_start)
+
+    # Only pools that keep connections around (QueuePool, the default for Postgres) can report these
+    if not hasattr(pool, "checkedout"):
+        return
+
+    @event.listens_for(pool, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        _update_pool_gauges(1)
+
+    @event.listens_for(pool, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        _update_pool_gauges(-1)
+
+def metrics_allowed(authorization):
+    """
+    :param authorization: str. The request's Authorization header, or None.
+    :return: bool. Whether /metrics can be served to the request, see the module's docstring.
+    """
+
+    if METRICS_TOKEN:
+        # Constant time, so the token can't be guessed a character at a time
+        return authorization is not None and hmac.compare_digest(
+            authorization.encode(),
+            f"Bearer {METRICS_TOKEN}".encode(),
+        )
+
+    return METRICS_ENABLED
+
+def generate_metrics():
+    """
+    :return: Tuple(bytes, str). The current metrics in the Prometheus text format, and their content type.
+    """
+
+    if getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
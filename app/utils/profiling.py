@@ -0,0 +1,223 @@
+"""
+A pure-Python sampling profiler, for finding out where a slow request spends its time.
+
+A background thread periodically takes the stacks of the other threads (sys._current_frames), and counts how often
+each stack was seen. The result is written in the "folded" format, one stack per line followed by its sample count,
+which flamegraph.pl, speedscope (https://www.speedscope.app) and inferno can all turn into a flame graph.
+
+A profile of one request only samples the threads running its endpoint, which TimedRoute (app/utils/timing.py) records
+in profiled_thread_ids, so other requests handled at the same time aren't mixed in. Worker profiles sample every thread.
+
+Only available in the dev and debug environments, see the profiling middleware in app/__init__.py and the /debug
+endpoints in app/routes.py.
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from os import getenv
+
+PROFILING_ENVS = ["dev", "debug"]
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Where profiles are written, so they can be fetched after the request they were made for. Only the latest
+# PROFILE_MAX_FILES are kept, as /tmp is held in memory on Cloud Run.
+PROFILE_DIR = getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_MAX_FILES = int(getenv("PROFILE_MAX_FILES", "100"))
+
+# IDs of the threads currently running the profiled request's endpoint. Mutated in place, so that the threads the
+# endpoint runs in, which are handed a copy of the request's context, add to the set the profiler reads.
+profiled_thread_ids: ContextVar[set] = ContextVar("profiled_thread_ids", default=None)
+
+# Frames from files under this directory are the API's own code
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_UNSAFE_FILENAME_CHARACTERS = re.compile(r"[^A-Za-z0-9_.-]+")
+
+def profiling_allowed():
+    """
+    :return: bool. Whether profiling is allowed in the current environment.
+    """
+
+    return getenv("ENV") in PROFILING_ENVS
+
+@contextmanager
+def profiled_thread():
+    """
+    Includes the current thread in the current request's profile, if it's being profiled, for the with block.
+    """
+
+    thread_ids = profiled_thread_ids.get()
+    if thread_ids is None:
+        yield
+        return
+
+    thread_id = threading.get_ident()
+    thread_ids.add(thread_id)
+    try:
+        yield
+    finally:
+        thread_ids.discard(thread_id)
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the process's threads until stopped.
+
+    By default only stacks that pass through the API's own code are kept, which leaves out idle threads (such as
+    threadpool workers waiting for work) and most of the event loop's bookkeeping.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL, app_frames_only=True, thread_ids=None):
+        """
+        :param interval: float. Seconds between samples.
+        :param app_frames_only: bool. Whether to only keep stacks that include a frame from the API's own code.
+        :param thread_ids: Set[int]. Only sample these threads, read on each sample so it can change while profiling.
+            Every thread if None.
+        """
+
+        self.interval = interval
+        self.app_frames_only = app_frames_only
+        self.thread_ids = thread_ids
+        # Folded stack -> number of samples
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self.duration = None
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+        return self
+
+    def _run(self):
+
+        own_thread_id = threading.get_ident()
+
+        while not self._stop_event.is_set():
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                folded_stack = self._fold(frame)
+                if folded_stack is not None:
+                    self.samples[folded_stack] += 1
+
+            self.sample_count += 1
+            self._stop_event.wait(self.interval)
+
+    def _fold(self, frame):
+        """
+        :return: str. The stack as 'root;...;leaf', or None if the stack should not be kept.
+        """
+
+        frame_names = []
+        includes_app_frame = False
+
+        while frame is not None:
+            code = frame.f_code
+            includes_app_frame = includes_app_frame or code.co_filename.startswith(_APP_ROOT)
+            frame_names.append(f"{code.co_name} ({_short_filename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+
+        if self.app_frames_only and not includes_app_frame:
+            return None
+
+        frame_names.reverse()
+        return ";".join(frame_names)
+
+    def folded(self):
+        """
+        :return: str. The samples in the folded format, most sampled stacks first.
+        """
+
+        return "\n".join(
+            f"{stack} {count}"
+            for stack, count in self.samples.most_common()
+        ) + "\n"
+
+    def save(self, label):
+        """
+        Writes the samples to a file in PROFILE_DIR, and removes the oldest profiles past PROFILE_MAX_FILES.
+        :param label: str. Included in the file name, such as the request's method and path.
+        :return: str. The profile's ID (its file name), which can be passed to load_profile.
+        """
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+
+        profile_id = _UNSAFE_FILENAME_CHARACTERS.sub(
+            "_",
+            f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}_{label}",
+        ).strip("_") + ".folded"
+
+        with open(os.path.join(PROFILE_DIR, profile_id), "w") as profile_file:
+            profile_file.write(self.folded())
+
+        _remove_old_profiles()
+
+        return profile_id
+
+def _remove_old_profiles():
+
+    # Profile IDs start with the time they were saved, so sort oldest first
+    profile_ids = sorted(
+        file_name
+        for file_name in os.listdir(PROFILE_DIR)
+        if file_name.endswith(".folded")
+    )
+
+    for profile_id in profile_ids[:max(len(profile_ids) - PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, profile_id))
+        except FileNotFoundError:
+            # Already removed by another worker
+            pass
+
+def load_profile(profile_id):
+    """
+    :param profile_id: str. A profile ID returned by SamplingProfiler.save.
+    :return: str. The profile in the folded format, or None if there is no such profile.
+    """
+
+    # Profile IDs are file names, so anything that could escape PROFILE_DIR is rejected
+    if _UNSAFE_FILENAME_CHARACTERS.search(profile_id) or profile_id.startswith("."):
+        return None
+
+    profile_path = os.path.join(PROFILE_DIR, profile_id)
+    if not os.path.isfile(profile_path):
+        return None
+
+    with open(profile_path) as profile_file:
+        return profile_file.read()
+
+def _short_filename(filename):
+    # Paths relative to the API, or to site-packages for libraries, keep frame names readable
+    if filename.startswith(_APP_ROOT):
+        return os.path.relpath(filename, os.path.dirname(_APP_ROOT))
+    site_packages_index = filename.rfind("site-packages")
+    if site_packages_index != -1:
+        return filename[site_packages_index + len("site-packages") + 1:]
+    return os.path.basename(filename)
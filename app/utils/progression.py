@@ -0,0 +1,384 @@
+"""
+Suggests the reps and weight for the next session of each workout component, from how its recent sessions went.
+
+For each component, its last PROGRESSION_SESSIONS completions in the user's recent finished workouts are read, with the
+values each was completed with, as the stats count them (see app/utils/stats.py). A straight line
+is fitted to the estimated one rep maxes (Epley) of those sessions over time, which gives the component's trend. Then:
+
+- progress: The current weight was completed in each of the last PROGRESS_AFTER_SESSIONS sessions, and the trend isn't
+  falling. The weight goes up by one increment (2.5 kg or 5 lbs). Bodyweight components (a weight of 0) add a rep
+  instead.
+- deload: The trend is falling, and the latest session's estimated one rep max is more than DELOAD_DROP below the best
+  in the window. The weight drops by DELOAD_DROP, rounded down to an increment.
+- repeat: Otherwise, the same reps and weight again. Components whose weight has been reset to 0, but were recently
+  completed with weight, repeat the weight their trend gives for their reps rather than 0.
+- start: No recent sessions, so the current reps and weight.
+
+All the components are worked out together, as NumPy arrays of one row per component, so the cost is one statement
+and a handful of array operations however many components there are. The rules are deterministic: the same history
+always gives the same suggestions.
+"""
+
+import uuid
+import logging
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .custom_exceptions import WorkoutNotOwnedException
+
+logger = logging.getLogger(__name__)
+
+# Completions of each component used, newest first, and how far back they can go: within the user's last
+# PROGRESSION_WORKOUTS finished workouts, and PROGRESSION_WINDOW_DAYS
+PROGRESSION_SESSIONS = 8
+PROGRESSION_WORKOUTS = 100
+PROGRESSION_WINDOW_DAYS = 120
+# Completions needed for a trend to be fitted
+MIN_TREND_SESSIONS = 3
+# Trends closer to 0 than this (kg per day) are flat
+FLAT_TREND_KG_PER_DAY = 1e-9
+# Consecutive sessions at the current weight before it goes up
+PROGRESS_AFTER_SESSIONS = 2
+# Drop from the best estimated one rep max in the window that triggers a deload, and the deload itself
+DELOAD_DROP = 0.1
+
+# Smallest weight change, by units. Other units are taken to be kg, as in the stats.
+KG_INCREMENT = 2.5
+LBS_INCREMENT = 5.0
+KG_PER_LB = 0.45359237
+
+PROGRESS = "progress"
+REPEAT = "repeat"
+DELOAD = "deload"
+START = "start"
+
+# The components, with their latest version, and their recent completions (one row each, newest first, or one row of
+# nulls if there are none). Components are chosen by the {selected} query. Completions are looked for in the user's
+# latest finished workouts, rather than in each component's completions, which for a component done for years would
+# mean reading all of them to find the latest. They aren't filtered by component until they're joined, so the planner
+# can't choose to read them by component either.
+_PROGRESSION_INPUTS = """
+    WITH selected AS (
+        {selected}
+    ),
+    recent_workouts AS (
+        SELECT finished_workout_id, completed_datetime, datetime_recorded
+        FROM finished_workouts
+        WHERE user_id = CAST(:user_id AS UUID)
+        AND completed_datetime >= LOCALTIMESTAMP - make_interval(days => :window_days)
+        ORDER BY completed_datetime DESC
+        LIMIT :workouts
+    ),
+    completions AS (
+        SELECT
+            finished_workout_components.workout_component_id,
+            finished_workout_components.reps_min,
+            finished_workout_components.weight,
+            finished_workout_components.units,
+            recent_workouts.completed_datetime,
+            recent_workouts.datetime_recorded,
+            ROW_NUMBER() OVER (
+                PARTITION BY finished_workout_components.workout_component_id
+                ORDER BY recent_workouts.completed_datetime DESC
+            ) AS session_number
+        FROM recent_workouts
+        JOIN finished_workout_components ON finished_workout_components.finished_workout_id = recent_workouts.finished_workout_id
+    )
+    SELECT
+        workout_components.workout_component_id,
+        workout_components.position,
+        exercises.exercise_name,
+        latest.reps,
+        latest.reps_min,
+        latest.reps_max,
+        latest.weight,
+        latest.units,
+        CASE WHEN lower(latest.units) IN ('lb', 'lbs') THEN latest.weight * 0.45359237 ELSE latest.weight END AS weight_kg,
+        EXTRACT(EPOCH FROM LOCALTIMESTAMP - completions.completed_datetime) / 86400 AS days_ago,
+        version.reps_min AS completed_reps,
+        CASE WHEN lower(version.units) IN ('lb', 'lbs') THEN version.weight * 0.45359237 ELSE version.weight END AS completed_weight_kg
+    FROM selected
+    JOIN workout_components ON workout_components.workout_component_id = selected.workout_component_id
+    JOIN exercises ON exercises.exercise_id = workout_components.exercise_id
+    JOIN LATERAL (
+        SELECT reps, reps_min, reps_max, weight, units
+        FROM workout_component_history
+        WHERE workout_component_history.workout_component_id = workout_components.workout_component_id
+        ORDER BY workout_component_history.datetime_added DESC
+        LIMIT 1
+    ) AS latest ON TRUE
+    LEFT JOIN completions
+        ON completions.workout_component_id = workout_components.workout_component_id
+        AND completions.session_number <= :sessions
+    -- The values each completion was done with, if they were recorded, otherwise its version when it was recorded
+    LEFT JOIN LATERAL (
+        SELECT completions.reps_min, completions.weight, completions.units
+        WHERE completions.weight IS NOT NULL
+        UNION ALL
+        (
+            SELECT reps_min, weight, units
+            FROM workout_component_history
+            WHERE workout_component_history.workout_component_id = completions.workout_component_id
+            AND workout_component_history.datetime_added <= completions.datetime_recorded
+            AND completions.weight IS NULL
+            ORDER BY workout_component_history.datetime_added DESC
+            LIMIT 1
+        )
+    ) AS version ON TRUE
+    ORDER BY workout_components.position, workout_components.workout_component_id, completions.completed_datetime DESC
+"""
+
+# The components of one of the user's workouts
+_WORKOUT_PROGRESSION_INPUTS = text(
+    _PROGRESSION_INPUTS.format(
+        selected="""
+        SELECT workout_components.workout_component_id
+        FROM user_workouts
+        JOIN workout_components ON workout_components.workout_id = user_workouts.workout_id
+        WHERE user_workouts.workout_id = CAST(:workout_id AS UUID)
+        AND user_workouts.user_id = CAST(:user_id AS UUID)
+        """
+    )
+)
+
+# The components completed in the user's latest finished workouts
+_RECENT_PROGRESSION_INPUTS = text(
+    _PROGRESSION_INPUTS.format(
+        selected="""
+        SELECT DISTINCT finished_workout_components.workout_component_id
+        FROM (
+            SELECT finished_workout_id
+            FROM finished_workouts
+            WHERE user_id = CAST(:user_id AS UUID)
+            ORDER BY completed_datetime DESC
+            LIMIT :recent_workouts
+        ) AS recent
+        JOIN finished_workout_components ON finished_workout_components.finished_workout_id = recent.finished_workout_id
+        """
+    )
+)
+
+def _is_lbs(units):
+    return units.lower() in ["lb", "lbs"]
+
+def _format_reps(reps, reps_min, reps_max, added_reps):
+    """
+    :return: str. The reps, with added_reps added to each of their numbers. Unchanged if nothing is added.
+    """
+
+    if added_reps == 0 or reps_min is None:
+        return reps
+    # A single number, such as "8", parses to the same min and max
+    if reps_max is None or reps_max == reps_min:
+        return str(reps_min + added_reps)
+    return f"{reps_min + added_reps}-{reps_max + added_reps}"
+
+def _to_arrays(rows):
+    """
+    :return: Tuple(List, Dict[str, ndarray]). The components, in order, and their completions as arrays of shape
+        (components, PROGRESSION_SESSIONS), newest first. Missing completions are NaN.
+    """
+
+    components = []
+    completion_rows = []
+    for row in rows:
+        if not components or components[-1].workout_component_id != row.workout_component_id:
+            components.append(row)
+            completion_rows.append([])
+        if row.days_ago is not None:
+            completion_rows[-1].append(row)
+
+    shape = (len(components), PROGRESSION_SESSIONS)
+    completions = {
+        "days_ago": np.full(shape, np.nan),
+        "reps": np.full(shape, np.nan),
+        "weight_kg": np.full(shape, np.nan),
+    }
+    for component_index, component_completions in enumerate(completion_rows):
+        for session_index, row in enumerate(component_completions):
+            completions["days_ago"][component_index, session_index] = float(row.days_ago)
+            completions["reps"][component_index, session_index] = np.nan if row.completed_reps is None else row.completed_reps
+            completions["weight_kg"][component_index, session_index] = np.nan if row.completed_weight_kg is None else row.completed_weight_kg
+
+    return components, completions
+
+def calculate_progression(rows):
+    """
+    :param rows: List[Row]. From _PROGRESSION_INPUTS, ordered by component then newest completion first.
+    :return: List[Dict]. Follows NextSessionComponentSchema, one per component, in order.
+    """
+
+    components, completions = _to_arrays(rows)
+    if not components:
+        return []
+
+    weight = np.array([component.weight for component in components], dtype=float)
+    weight_kg = np.array([component.weight_kg for component in components], dtype=float)
+    reps_min = np.array([np.nan if component.reps_min is None else component.reps_min for component in components])
+    increment = np.array([LBS_INCREMENT if _is_lbs(component.units) else KG_INCREMENT for component in components])
+
+    completed_weight_kg = completions["weight_kg"]
+    completed_reps = completions["reps"]
+    completed = ~np.isnan(completions["days_ago"])
+    # Reps with no number (eg AMRAP) and bodyweight sessions have no one rep max, but still count as sessions at a weight
+    estimable = completed & (np.nan_to_num(completed_weight_kg) > 0) & (np.nan_to_num(completed_reps) >= 1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+
+        one_rep_max_kg = np.where(
+            completed_reps == 1,
+            completed_weight_kg,
+            completed_weight_kg * (1 + completed_reps / 30.0),
+        )
+        one_rep_max_kg = np.where(estimable, one_rep_max_kg, np.nan)
+
+        # Least squares line through each component's one rep maxes, against days (negative, so later is larger)
+        session_count = estimable.sum(axis=1)
+        days = np.where(estimable, -completions["days_ago"], 0.0)
+        maxes = np.where(estimable, one_rep_max_kg, 0.0)
+        mean_days = days.sum(axis=1) / session_count
+        mean_max = maxes.sum(axis=1) / session_count
+        day_offsets = np.where(estimable, days - mean_days[:, None], 0.0)
+        max_offsets = np.where(estimable, maxes - mean_max[:, None], 0.0)
+        day_variance = (day_offsets ** 2).sum(axis=1)
+        has_trend = (session_count >= MIN_TREND_SESSIONS) & (day_variance > 0)
+        slope_kg_per_day = np.where(has_trend, (day_offsets * max_offsets).sum(axis=1) / day_variance, np.nan)
+        # Rounding leaves flat trends just either side of 0, depending on the order the sessions were summed in
+        slope_kg_per_day = np.where(np.abs(slope_kg_per_day) < FLAT_TREND_KG_PER_DAY, 0.0, slope_kg_per_day)
+
+        # Latest estimable session, and the line's estimate at it. Without a trend, the session's own estimate.
+        latest_index = np.argmax(estimable, axis=1)
+        rows_index = np.arange(len(components))
+        latest_max = one_rep_max_kg[rows_index, latest_index]
+        latest_days = days[rows_index, latest_index]
+        estimated_max = np.where(has_trend, mean_max + slope_kg_per_day * (latest_days - mean_days), latest_max)
+        best_max = np.nanmax(np.where(estimable, one_rep_max_kg, -np.inf), axis=1)
+
+        # Sessions in a row, from the latest, at the current weight
+        at_weight = completed & np.isclose(completed_weight_kg, weight_kg[:, None], atol=0.01)
+        sessions_at_weight = np.cumprod(at_weight, axis=1).sum(axis=1)
+
+        falling = has_trend & (slope_kg_per_day < 0)
+        deload = falling & (latest_max < (1 - DELOAD_DROP) * best_max) & (weight > 0)
+        # Bodyweight components progress by reps, so need a number of reps to add to
+        can_progress = (weight > 0) | ~np.isnan(reps_min)
+        progress = ~deload & ~falling & can_progress & (sessions_at_weight >= PROGRESS_AFTER_SESSIONS)
+        started = completed.any(axis=1)
+
+        # A weight reset to 0 (eg by a recommendation) after sessions with weight, which the trend can fill in
+        per_kg = np.where(np.array([_is_lbs(component.units) for component in components]), 1 / KG_PER_LB, 1.0)
+        trend_weight = estimated_max / np.where(reps_min > 1, 1 + reps_min / 30.0, 1.0) * per_kg
+        refill = (weight == 0) & ~np.isnan(trend_weight) & (trend_weight >= increment)
+
+        suggested_weight = np.select(
+            [deload, progress & (weight > 0), refill],
+            [
+                np.maximum(np.floor(weight * (1 - DELOAD_DROP) / increment) * increment, np.minimum(weight, increment)),
+                weight + increment,
+                np.floor(trend_weight / increment) * increment,
+            ],
+            default=weight,
+        )
+        added_reps = np.where(progress & (weight == 0) & ~refill, 1, 0)
+
+    action = np.select([~started, deload, progress], [START, DELOAD, PROGRESS], default=REPEAT)
+
+    suggestions = []
+    for index, component in enumerate(components):
+        suggestions.append({
+            "workout_component_id": str(component.workout_component_id),
+            "exercise_name": component.exercise_name,
+            "position": component.position,
+            "reps": component.reps,
+            "weight": component.weight,
+            "units": component.units,
+            "suggested_reps": _format_reps(component.reps, component.reps_min, component.reps_max, int(added_reps[index])),
+            "suggested_weight": float(suggested_weight[index]),
+            "action": str(action[index]),
+            "sessions_considered": int(completed[index].sum()),
+            "estimated_one_rep_max_kg": None if np.isnan(estimated_max[index]) else round(float(estimated_max[index]), 2),
+            "trend_kg_per_week": None if np.isnan(slope_kg_per_day[index]) else round(float(slope_kg_per_day[index] * 7), 2),
+        })
+
+    return suggestions
+
+def _progression_parameters(user_id, **parameters):
+    return {
+        "user_id": str(user_id),
+        "sessions": PROGRESSION_SESSIONS,
+        "workouts": PROGRESSION_WORKOUTS,
+        "window_days": PROGRESSION_WINDOW_DAYS,
+        **parameters,
+    }
+
+# Throws WorkoutNotOwnedException
+def suggest_next_session(
+    db_session: Session,
+    user_id,
+    workout_id,
+):
+    """
+    :param user_id: str. The user who owns the workout.
+    :param workout_id: str. The workout to suggest the next session of.
+    :return: List[Dict]. Follows NextSessionComponentSchema, one per component in position order.
+    """
+
+    try:
+        workout_id = uuid.UUID(str(workout_id))
+    except ValueError:
+        raise WorkoutNotOwnedException(workout_id=workout_id)
+
+    rows = db_session.execute(
+        _WORKOUT_PROGRESSION_INPUTS,
+        _progression_parameters(user_id, workout_id=str(workout_id)),
+    ).all()
+
+    # Every workout has components, so none means it isn't the user's
+    if not rows:
+        raise WorkoutNotOwnedException(workout_id=str(workout_id))
+
+    suggestions = calculate_progression(rows)
+    logger.debug(
+        "Next session suggested",
+        extra={"component_count": len(suggestions), "actions": [suggestion["action"] for suggestion in suggestions]},
+    )
+
+    return suggestions
+
+def suggest_recent_exercises(
+    db_session: Session,
+    user_id,
+    workouts=5,
+):
+    """
+    Used by the LLMs, to base the weights they recommend on what the user has been doing.
+    :param user_id: str. The user to suggest for.
+    :param workouts: int. How many of the user's latest finished workouts to take exercises from.
+    :return: List[Dict]. Suggested reps and weight of each exercise in the workouts. Where an exercise is in more than
+        one workout, the one with the heaviest suggested weight in kg.
+    """
+
+    rows = db_session.execute(
+        _RECENT_PROGRESSION_INPUTS,
+        _progression_parameters(user_id, recent_workouts=workouts),
+    ).all()
+
+    by_exercise = {}
+    for suggestion in calculate_progression(rows):
+        suggested_kg = suggestion["suggested_weight"] * (KG_PER_LB if _is_lbs(suggestion["units"]) else 1.0)
+        current = by_exercise.get(suggestion["exercise_name"])
+        if current is None or suggested_kg > current[0]:
+            by_exercise[suggestion["exercise_name"]] = (suggested_kg, suggestion)
+
+    return [
+        {
+            "exercise_name": suggestion["exercise_name"],
+            "reps": suggestion["suggested_reps"],
+            "weight": suggestion["suggested_weight"],
+            "units": suggestion["units"],
+            "action": suggestion["action"],
+        }
+        for _, suggestion in sorted(by_exercise.values(), key=lambda item: item[1]["exercise_name"])
+    ]
@@ -0,0 +1,197 @@
+"""
+Counts the SQL statements executed per request (or any other unit of work), to catch round trips creeping back in.
+
+- Every request is counted by the middleware in app/__init__.py, and checked against ROUTE_QUERY_BUDGETS.
+- Statements with the same shape (same SQL, ignoring parameter values) executed N_PLUS_ONE_THRESHOLD or more times
+  in one unit of work are reported as a likely N+1 pattern. Statements that are meant to run once per transaction
+  (such as the shard lock in app/utils/sharding.py) set the REPEATABLE execution option, and are only counted.
+- Code and tests can declare their own budget with the query_budget context manager:
+
+    with query_budget(2, name="get_workouts_for_user", mode=RAISE):
+        get_workouts_for_user(db_session=db_session, user_id=user_id)
+
+What happens on a violation depends on QUERY_BUDGET_MODE (raise, warn or off). It defaults to warn in the dev and
+debug environments, and off everywhere else, in which case statements aren't counted at all.
+"""
+
+import re
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getenv
+
+from sqlalchemy import event
+
+from .custom_exceptions import QueryBudgetExceededException
+
+logger = logging.getLogger(__name__)
+
+RAISE = "raise"
+WARN = "warn"
+OFF = "off"
+
+QUERY_BUDGET_MODE = getenv("QUERY_BUDGET_MODE", WARN if getenv("ENV") in ["dev", "debug"] else OFF).lower()
+
+# The same statement shape this many times in one unit of work is treated as an N+1 pattern
+N_PLUS_ONE_THRESHOLD = int(getenv("N_PLUS_ONE_THRESHOLD", "3"))
+
+# Execution option for statements that are expected to repeat, which aren't checked for N+1 patterns
+REPEATABLE = "query_budget_repeatable"
+
+# Maximum statements per request, by route template. Routes not listed are only checked for N+1 patterns. With more
+# than one shard (see app/utils/sharding.py), routes are allowed one more, for the lookup of the user's shard.
+ROUTE_QUERY_BUDGETS = {
+    "/users/salt": 1,
+    "/users/login": 6,
+    "/access_tokens": 0,
+    # Data version, then the workouts and their finished workouts if not cached
+    "/workouts/saved": 3,
+    # Latest versions, then the insert of any that changed, and the data version bump
+    "/workouts/update/components": 3,
+    # Finished workout, its components, the data version bump, then the stats: the user's row, exercises, personal
+    # records, weeks and months, days, and the update of the user's row
+    "/workouts/finish": 9,
+    # Data version, then changed workouts, components and finished workouts. Only the first if nothing has changed.
+    "/sync": 4,
+    # Latest versions, the finished workouts, their components, new versions and the data version bump, however many
+    # sessions are uploaded. One more if any were already uploaded. Then the stats, as for /workouts/finish.
+    "/workouts/sessions": 12,
+    # The user's totals, recent weeks and months, exercises, and personal records
+    "/users/stats": 4,
+    # Data version for weeks and months, then the days of the range if not cached
+    "/users/activity": 2,
+    # The workout's components, with their latest versions and recent sessions
+    "/workouts/{workout_id}/next": 1,
+}
+
+# Counters for the units of work currently being counted, innermost last. A tuple, so each context gets its own.
+_active_counters: ContextVar[tuple] = ContextVar("active_query_counters", default=())
+
+# Parameter placeholders (psycopg2 uses %(name)s), and numeric literals
+_PLACEHOLDER_PATTERN = re.compile(r"%\(\w+\)s|%s|\?|\$\d+|\b\d+(\.\d+)?\b")
+# Lists of placeholders, eg from IN clauses, which vary in length
+_PLACEHOLDER_LIST_PATTERN = re.compile(r"\(\s*\?(\s*,\s*\?)*\s*\)")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+class QueryCounter:
+    """
+    Statements executed within a unit of work.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.count = 0
+        # Statement shape -> times executed
+        self.shapes = Counter()
+
+    def record(self, statement, repeatable=False):
+        self.count += 1
+        if not repeatable:
+            self.shapes[normalize_statement(statement)] += 1
+
+    def repeated_shapes(self, threshold=None):
+        """
+        :param threshold: int. Minimum number of executions to be reported. Defaults to N_PLUS_ONE_THRESHOLD.
+        :return: Dict[str, int]. Statement shapes executed at least threshold times, mapped to their counts.
+        """
+
+        threshold = N_PLUS_ONE_THRESHOLD if threshold is None else threshold
+        return {
+            shape: count
+            for shape, count in self.shapes.items()
+            if count >= threshold
+        }
+
+def normalize_statement(statement):
+    """
+    Reduces a statement to its shape, so statements that only differ by their parameters are grouped together.
+    :param statement: str. The SQL statement, as sent to the driver.
+    :return: str. The statement's shape.
+    """
+
+    shape = _PLACEHOLDER_PATTERN.sub("?", statement)
+    shape = _PLACEHOLDER_LIST_PATTERN.sub("(?)", shape)
+    return _WHITESPACE_PATTERN.sub(" ", shape).strip()
+
+def instrument_engine_query_counting(engine):
+    """
+    Registers a SQLAlchemy event on the engine, so that statements are added to any active counters.
+    :param engine: Engine. The engine to instrument.
+    """
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        for counter in _active_counters.get():
+            counter.record(statement, repeatable=context.execution_options.get(REPEATABLE, False))
+
+@contextmanager
+def count_queries(name=None):
+    """
+    Counts the statements executed within the with block, including those of any nested counters.
+    Threads started with a copy of the current context (such as FastAPI's threadpool) are included.
+    :param name: str. Name of the unit of work, used in reports.
+    :return: QueryCounter. Yielded, and filled in as statements are executed.
+    """
+
+    counter = QueryCounter(name=name)
+    token = _active_counters.set(_active_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _active_counters.reset(token)
+
+def check_query_budget(counter, max_queries=None, mode=None):
+    """
+    Checks a finished unit of work against a budget, and for N+1 patterns.
+    :param counter: QueryCounter. The unit of work's counter.
+    :param max_queries: int. Maximum number of statements allowed, or None to only check for N+1 patterns.
+    :param mode: str. RAISE or WARN. Defaults to QUERY_BUDGET_MODE.
+    :return: List[str]. Descriptions of the problems found, empty if there were none.
+    :throws: QueryBudgetExceededException if problems were found and the mode is RAISE
+    """
+
+    mode = QUERY_BUDGET_MODE if mode is None else mode
+
+    problems = []
+
+    if max_queries is not None and counter.count > max_queries:
+        problems.append(f"{counter.count} statements executed, budget is {max_queries}")
+
+    for shape, count in counter.repeated_shapes().items():
+        problems.append(f"Possible N+1, statement executed {count} times: {shape}")
+
+    if not problems or mode == OFF:
+        return problems
+
+    if mode == RAISE:
+        raise QueryBudgetExceededException(message="Query budget exceeded: " + "; ".join(problems), name=counter.name)
+
+    logger.warning(
+        "Query budget exceeded",
+        extra={
+            "unit_of_work": counter.name,
+            "query_count": counter.count,
+            "query_budget": max_queries,
+            "problems": problems,
+        },
+    )
+
+    return problems
+
+@contextmanager
+def query_budget(max_queries=None, name=None, mode=None):
+    """
+    Counts the statements executed within the with block, and checks them against a budget when the block exits.
+    Intended for tests and for code paths that have been optimized and should stay that way.
+    :param max_queries: int. Maximum number of statements allowed, or None to only check for N+1 patterns.
+    :param name: str. Name of the unit of work, used in reports.
+    :param mode: str. RAISE or WARN. Defaults to QUERY_BUDGET_MODE.
+    :return: QueryCounter. Yielded, and filled in as statements are executed.
+    :throws: QueryBudgetExceededException on exit, if the budget was exceeded and the mode is RAISE
+    """
+
+    with count_queries(name=name) as counter:
+        yield counter
+
+    check_query_budget(counter, max_queries=max_queries, mode=mode)
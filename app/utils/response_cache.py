@@ -0,0 +1,324 @@
+"""
+Caches the serialized /workouts/saved response for each user, so that app launches with nothing new to fetch don't
+recompute the user's whole workout history.
+
+Each user has a data version (user_data_versions), which every write to their workouts increases: in the same
+transaction as the write when saving components and finishing a workout, and straight after the inserts when creating
+a workout, as they commit one at a time. Cached responses are keyed
+by user and version, so a write makes the old entry unreachable in every worker at once, with nothing to invalidate.
+The version is also the response's ETag, so the app can revalidate with If-None-Match and get an empty 304 back.
+
+RESPONSE_CACHE_BACKEND: Where responses are cached.
+    memory: In each worker, least recently used dropped first once RESPONSE_CACHE_MAX_BYTES is reached. The default.
+    redis: Shared by all workers, in a Redis server (or anything speaking its protocol) at RESPONSE_CACHE_REDIS_URL.
+    none: Not cached. ETags and 304s still work.
+RESPONSE_CACHE_TTL_SECONDS: How long entries are kept for. Entries never go stale, this only frees the space of users
+    who have gone quiet.
+"""
+
+import time
+import socket
+import logging
+import threading
+from collections import OrderedDict
+from os import getenv
+from urllib.parse import urlparse
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .metrics import response_cache_lookups_total
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_BACKEND = getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_MAX_BYTES = int(getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 2**20)))
+RESPONSE_CACHE_TTL_SECONDS = float(getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_REDIS_URL = getenv("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_REDIS_TIMEOUT_SECONDS = float(getenv("RESPONSE_CACHE_REDIS_TIMEOUT_SECONDS", "0.1"))
+
+# Increase when the format of a cached response changes, so entries cached by older code aren't served
+RESPONSE_FORMAT_VERSION = 1
+
+_BUMP_VERSION = text(
+    """
+    INSERT INTO user_data_versions (user_id, version)
+    VALUES (CAST(:user_id AS UUID), 1)
+    ON CONFLICT (user_id) DO UPDATE SET version = user_data_versions.version + 1
+    """
+)
+
+_BUMP_VERSIONS = text(
+    """
+    INSERT INTO user_data_versions (user_id, version)
+    SELECT user_id, 1
+    FROM unnest(CAST(:user_ids AS UUID[])) AS bumped (user_id)
+    ON CONFLICT (user_id) DO UPDATE SET version = user_data_versions.version + 1
+    """
+)
+
+_GET_VERSION = text("SELECT version FROM user_data_versions WHERE user_id = CAST(:user_id AS UUID)")
+
+def bump_user_data_version(
+    db_session: Session,
+    user_id,
+):
+    """
+    Marks the user's cached responses as out of date. Call in the same transaction as the write, so the new version
+    is only seen once the write is. Writes that commit in several steps, such as create_new_workout, call it after
+    their last commit instead, never before the write is visible, as a response cached in between would then be kept
+    under the new version. Does not commit.
+    :param user_id: str. The user whose workouts were written to.
+    """
+
+    db_session.execute(_BUMP_VERSION, {"user_id": str(user_id)})
+
+def bump_user_data_versions(
+    db_session: Session,
+    user_ids,
+):
+    """
+    bump_user_data_version for many users at once, eg when their data is rebuilt. Does not commit.
+    :param user_ids: List[str]. The users whose data was written to.
+    """
+
+    db_session.execute(_BUMP_VERSIONS, {"user_ids": [str(user_id) for user_id in user_ids]})
+
+def get_user_data_version(
+    db_session: Session,
+    user_id,
+):
+    """
+    :param user_id: str. The user.
+    :return: int. The user's data version, 0 if they've never written anything.
+    """
+
+    version = db_session.execute(_GET_VERSION, {"user_id": str(user_id)}).scalar()
+
+    return version if version is not None else 0
+
+def make_etag(name, user_id, version):
+    """
+    :param name: str. The cached response, eg 'saved'.
+    :return: str. A strong ETag for the response, at this version of the user's data.
+    """
+
+    return f'"{name}-{RESPONSE_FORMAT_VERSION}-{user_id}-{version}"'
+
+def etag_matches(if_none_match, etag):
+    """
+    :param if_none_match: str. The If-None-Match request header, or None.
+    :param etag: str. The current ETag.
+    :return: bool. Whether the client's copy is current, so a 304 can be returned.
+    """
+
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # If-None-Match uses the weak comparison, so W/ prefixes are ignored (RFC 9110 13.1.2)
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+
+    return False
+
+class InMemoryResponseCache:
+    """
+    Thread safe LRU cache of response bodies, limited by their total size rather than by number of entries, as users
+    with long histories have far larger responses than new users.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        # Key -> (expiry time, body), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: bytes. The cached body, or None if not cached or expired.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, body = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body, ttl_seconds):
+
+        # Too large to be worth pushing everything else out for
+        if len(body) > self.max_bytes // 4:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl_seconds, body)
+            self.size_bytes += len(body)
+            while self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(entry[1])
+
+class RedisResponseCache:
+    """
+    Caches response bodies in a Redis server, shared by every worker. Only GET and SET with PX are used, so any server
+    speaking the Redis protocol (RESP) will do, such as testing/load/resp_server.py locally.
+
+    Eviction is left to the server (eg maxmemory-policy allkeys-lru). The cache is only an optimisation, so if the
+    server can't be reached, lookups are misses and the response is computed as normal.
+    """
+
+    # Seconds to wait before trying the server again, after failing to reach it
+    RECONNECT_DELAY_SECONDS = 5
+
+    def __init__(self, url, timeout_seconds):
+        parsed_url = urlparse(url)
+        self.host = parsed_url.hostname or "localhost"
+        self.port = parsed_url.port or 6379
+        self.password = parsed_url.password
+        self.db = int(parsed_url.path.lstrip("/") or 0)
+        self.timeout_seconds = timeout_seconds
+        # A connection per thread, as requests run in a thread pool and RESP replies must be read in order
+        self._local = threading.local()
+        self._unavailable_until = 0
+
+    def _connection(self):
+
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout_seconds)
+        connection = (sock, sock.makefile("rb"))
+        self._local.connection = connection
+
+        if self.password:
+            self._command(connection, "AUTH", self.password)
+        if self.db:
+            self._command(connection, "SELECT", str(self.db))
+
+        return connection
+
+    def _close(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    @staticmethod
+    def _encode(*args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    @staticmethod
+    def _read_reply(reader):
+
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the cache server")
+
+        reply_type, value = line[:1], line[1:-2]
+        if reply_type == b"+":
+            return value
+        if reply_type == b"-":
+            raise ConnectionError(f"Cache server error: {value.decode(errors='replace')}")
+        if reply_type == b":":
+            return int(value)
+        if reply_type == b"$":
+            length = int(value)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the cache server")
+            return data[:-2]
+
+        raise ConnectionError(f"Unexpected reply from the cache server: {line[:20]!r}")
+
+    def _command(self, connection, *args):
+        sock, reader = connection
+        sock.sendall(self._encode(*args))
+        return self._read_reply(reader)
+
+    def _execute(self, *args):
+        """
+        :return: The reply, or None if the server couldn't be reached.
+        """
+
+        if time.monotonic() < self._unavailable_until:
+            return None
+
+        try:
+            return self._command(self._connection(), *args)
+        except (OSError, ConnectionError, ValueError) as e:
+            # The connection may be part way through a reply, so it can't be reused
+            self._close()
+            self._unavailable_until = time.monotonic() + self.RECONNECT_DELAY_SECONDS
+            logger.warning("Response cache server unavailable", extra={"host": self.host, "port": self.port, "error": str(e)})
+            return None
+
+    def get(self, key):
+        return self._execute("GET", key)
+
+    def set(self, key, body, ttl_seconds):
+        self._execute("SET", key, body, "PX", int(ttl_seconds * 1000))
+
+def _create_response_cache(backend):
+
+    if backend == "memory":
+        return InMemoryResponseCache(RESPONSE_CACHE_MAX_BYTES)
+    if backend == "redis":
+        return RedisResponseCache(RESPONSE_CACHE_REDIS_URL, RESPONSE_CACHE_REDIS_TIMEOUT_SECONDS)
+    if backend == "none":
+        return None
+
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {backend}. Expected memory, redis or none")
+
+_response_cache = _create_response_cache(RESPONSE_CACHE_BACKEND)
+
+def _cache_key(name, user_id, version, variant):
+    key = f"response:{name}:{RESPONSE_FORMAT_VERSION}:{user_id}:{version}"
+    return key if variant is None else f"{key}:{variant}"
+
+def get_cached_response(name, user_id, version, variant=None):
+    """
+    :param name: str. The cached response, eg 'saved'.
+    :param variant: str. Which of the response's variants, for responses that depend on the request, eg on its query
+        parameters. Kept out of the metrics' labels, so it can take any number of values.
+    :return: bytes. The response body cached for this version of the user's data, or None.
+    """
+
+    if _response_cache is None:
+        return None
+
+    body = _response_cache.get(_cache_key(name, user_id, version, variant))
+    response_cache_lookups_total.labels(name, "hit" if body is not None else "miss").inc()
+
+    return body
+
+def cache_response(name, user_id, version, body, variant=None):
+    """
+    :param name: str. The cached response, eg 'saved'.
+    :param body: bytes. The serialized response, for this version of the user's data.
+    :param variant: str. Which of the response's variants, as for get_cached_response.
+    """
+
+    if _response_cache is None:
+        return
+
+    _response_cache.set(_cache_key(name, user_id, version, variant), body, RESPONSE_CACHE_TTL_SECONDS)
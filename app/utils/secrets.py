@@ -1,10 +1,16 @@
 from os import getenv
 from google.cloud import secretmanager
 
-secret_client = secretmanager.SecretManagerServiceClient()
+secret_client = None
 
 def get_secret(secret_name):
 
+    global secret_client
+
+    # Created on first use, so runs that don't need any secrets (eg local load tests) don't need GCP credentials
+    if secret_client is None:
+        secret_client = secretmanager.SecretManagerServiceClient()
+
     project = getenv("PROJECT")
     name = secret_client.secret_version_path(project, secret_name, "latest")
     response = secret_client.access_secret_version(request={"name": name})
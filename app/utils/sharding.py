@@ -0,0 +1,632 @@
+"""
+Sharding of users' data across several databases by user ID, so write throughput isn't limited to one instance.
+
+Almost everything is per-user: workouts, their components and history, finished workouts, and the stats kept from
+them. Each user's rows are stored together on one shard, so every request stays on one database. The shards are the
+databases in SHARD_DB_URLS, plus core_db, which also keeps what is global:
+
+- The shard directory (user_shards), of which shard each user is on. Users without a row are on core_db, so existing
+  databases keep working unchanged, and rebalance moves their users out later.
+- Logins: users, user_password_hashes and action_log. Every user's users row is in core_db. Users on other shards
+  also have a copy of their users row there, for the foreign keys of their data.
+- Idempotency keys, see app/utils/idempotency.py.
+
+The exercises and actions catalogs are needed alongside the data on every shard, and are replicated from core_db with
+the same IDs by replicate-catalogs. Run it after adding a shard, or changing the catalogs.
+
+New users are placed by a consistent hash ring, so adding a shard only moves the users the ring now places on it, about
+1 / (number of shards) of them. Their data isn't moved by the ring, only by the move and rebalance commands below.
+
+Requests look up the user's shard in the directory, cached per worker for SHARD_DIRECTORY_CACHE_SECONDS. Reads can use
+a cached entry, so after a move a worker can read from the old shard for up to that long, which still holds a full
+copy of the user's data until the move removes it. Writes always read the directory, and hold a lock on the user's
+users row in core_db until the request ends, so a move waits for writes in progress to finish, and writes wait for
+moves. So a write can never land on a shard the user has just been moved away from. For users on core_db, the lock is
+taken by the request's own session, so each request holds one connection from core_db's pool. Only users on other
+shards hold a core_db connection for the lock alongside their shard's. With a single database, none of this happens:
+sessions are opened on core_db as before, with no lookups.
+
+SHARD_RING: Comma separated shards that new users, and rebalance, can place users on. Defaults to every shard. Leave a
+    shard out to stop placing users on it, then rebalance to drain it.
+SHARD_VIRTUAL_NODES: Points on the ring per shard. More spreads users more evenly.
+SHARD_DIRECTORY_CACHE_SECONDS: How long workers cache a user's shard for reads. Moves wait this long before removing
+    the user's data from the old shard.
+SHARD_DIRECTORY_CACHE_SIZE: Maximum cached entries per worker, least recently used are dropped first.
+
+Run with:
+
+    python -m app.utils.sharding status
+    python -m app.utils.sharding replicate-catalogs
+    python -m app.utils.sharding move --user-id USER_ID --to SHARD
+    python -m app.utils.sharding rebalance [--dry-run] [--limit N]
+
+Migrations, stats rebuilds and history compaction run against every shard. Analytics exports read one database, so
+export each shard in turn with --db-url.
+"""
+
+import argparse
+import bisect
+import hashlib
+import logging
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from os import getenv
+
+from sqlalchemy import event, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from .custom_exceptions import UnknownShardException
+from .user_cache import LRUCache
+from .query_budget import REPEATABLE
+from ..database import SessionLocal, shard_engines, shard_sessions
+from ..models import Base
+
+logger = logging.getLogger(__name__)
+
+CORE_SHARD = "core_db"
+
+SHARD_VIRTUAL_NODES = int(getenv("SHARD_VIRTUAL_NODES", "64"))
+SHARD_DIRECTORY_CACHE_SECONDS = float(getenv("SHARD_DIRECTORY_CACHE_SECONDS", "30"))
+SHARD_DIRECTORY_CACHE_SIZE = int(getenv("SHARD_DIRECTORY_CACHE_SIZE", "100000"))
+SHARD_RING = [name.strip() for name in getenv("SHARD_RING", "").split(",") if name.strip()] or list(shard_engines)
+
+# Bytes of each table's rows held in memory when copying a user's data between shards, beyond which they're spooled to
+# a temporary file
+COPY_SPOOL_BYTES = 64 * 1024 * 1024
+# Tables replicated to every shard from core_db
+CATALOG_TABLES = ["actions", "exercises"]
+
+_BY_USER = "user_id = CAST(:user_id AS UUID)"
+
+# Tables holding each user's data, parents before children, and how to select a user's rows from each
+USER_DATA_TABLES = [
+    ("users", _BY_USER),
+    ("user_workouts", _BY_USER),
+    (
+        "workout_components",
+        "workout_id IN (SELECT workout_id FROM user_workouts WHERE user_id = CAST(:user_id AS UUID))",
+    ),
+    (
+        "workout_component_history",
+        """
+        workout_component_id IN (
+            SELECT wc.workout_component_id
+            FROM workout_components wc
+            INNER JOIN user_workouts uw ON uw.workout_id = wc.workout_id
+            WHERE uw.user_id = CAST(:user_id AS UUID)
+        )
+        """,
+    ),
+    ("finished_workouts", _BY_USER),
+    (
+        "finished_workout_components",
+        "finished_workout_id IN (SELECT finished_workout_id FROM finished_workouts WHERE user_id = CAST(:user_id AS UUID))",
+    ),
+    ("user_data_versions", _BY_USER),
+    ("user_stats", _BY_USER),
+    ("user_workout_periods", _BY_USER),
+    ("user_exercise_stats", _BY_USER),
+    ("personal_records", _BY_USER),
+    ("user_daily_activity", _BY_USER),
+]
+
+# The user's shard, and their users row locked: shared by writes, exclusively by moves
+_GET_USER_SHARD = """
+    SELECT COALESCE(us.shard_name, :core_shard) AS shard_name
+    FROM users u
+    LEFT JOIN user_shards us ON us.user_id = u.user_id
+    WHERE u.user_id = CAST(:user_id AS UUID)
+"""
+_LOCK_MODES = {
+    None: text(_GET_USER_SHARD),
+    # Taken again by each transaction of a request for a user on core_db, see open_user_session
+    "share": text(_GET_USER_SHARD + " FOR SHARE OF u").execution_options(**{REPEATABLE: True}),
+    "move": text(_GET_USER_SHARD + " FOR NO KEY UPDATE OF u"),
+}
+
+_SET_USER_SHARD = text(
+    """
+    INSERT INTO user_shards (user_id, shard_name)
+    VALUES (CAST(:user_id AS UUID), :shard_name)
+    ON CONFLICT (user_id) DO UPDATE SET shard_name = EXCLUDED.shard_name, assigned_datetime = CURRENT_TIMESTAMP
+    """
+)
+
+_COPY_USER_ROW = text(
+    """
+    INSERT INTO users (user_id, username)
+    VALUES (CAST(:user_id AS UUID), :username)
+    ON CONFLICT (user_id) DO NOTHING
+    """
+)
+
+# Users, after the given user ID, with the shard they're on
+_USERS_BATCH = text(
+    """
+    SELECT u.user_id, COALESCE(us.shard_name, :core_shard) AS shard_name
+    FROM users u
+    LEFT JOIN user_shards us ON us.user_id = u.user_id
+    WHERE (CAST(:after AS UUID) IS NULL OR u.user_id > CAST(:after AS UUID))
+    ORDER BY u.user_id
+    LIMIT :batch_size
+    """
+)
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    """
+    Consistent hashing of keys to shards. Each shard is placed at several points on a ring of hashes, and a key belongs
+    to the first shard at or after its own hash, so adding or removing a shard only moves the keys next to its points.
+    """
+
+    def __init__(self, shard_names, virtual_nodes=SHARD_VIRTUAL_NODES):
+
+        if not shard_names:
+            raise ValueError("A hash ring needs at least one shard")
+
+        points = sorted(
+            (_hash(f"{shard_name}#{node}"), shard_name)
+            for shard_name in shard_names
+            for node in range(virtual_nodes)
+        )
+        self._hashes = [point_hash for point_hash, _ in points]
+        self._shard_names = [shard_name for _, shard_name in points]
+
+    def shard_for(self, key):
+        """
+        :param key: Any. Converted to a string, eg a user ID.
+        :return: str. The name of the key's shard.
+        """
+
+        index = bisect.bisect_left(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._shard_names[index]
+
+# User ID -> name of the shard they're on
+_directory_cache = LRUCache(SHARD_DIRECTORY_CACHE_SIZE)
+
+def sharding_enabled():
+    """
+    :return: bool. Whether there is more than one shard. If not, everything is in core_db and nothing is looked up.
+    """
+
+    return len(shard_engines) > 1
+
+# Throws UnknownShardException
+def check_shard_name(shard_name):
+
+    if shard_name not in shard_engines:
+        raise UnknownShardException(shard_name=shard_name)
+
+    return shard_name
+
+# Fails at startup rather than at the first signup, if SHARD_RING names a shard that isn't configured
+shard_ring = HashRing([check_shard_name(shard_name) for shard_name in SHARD_RING])
+
+def _lookup_user_shard(directory_session, user_id, lock=None):
+    """
+    :param directory_session: Session or Connection. On core_db.
+    :param lock: str. None, "share" for writes, or "move".
+    :return: str. The user's shard, or None if the user doesn't exist.
+    """
+
+    return directory_session.execute(
+        _LOCK_MODES[lock],
+        {"user_id": str(user_id), "core_shard": CORE_SHARD},
+    ).scalar()
+
+def get_user_shard(user_id):
+    """
+    :return: str. The shard the user's data is on, possibly up to SHARD_DIRECTORY_CACHE_SECONDS out of date.
+    """
+
+    if not sharding_enabled():
+        return CORE_SHARD
+
+    shard_name = _directory_cache.get(str(user_id))
+    if shard_name is not LRUCache.MISSING:
+        return shard_name
+
+    with SessionLocal() as directory_session:
+        shard_name = _lookup_user_shard(directory_session, user_id) or CORE_SHARD
+
+    _directory_cache.set(str(user_id), shard_name, SHARD_DIRECTORY_CACHE_SECONDS)
+    return shard_name
+
+# Throws UnknownShardException
+def get_user_sessionmaker(user_id):
+    """
+    For reads only, as the user's shard may be out of date, see the module's docstring.
+    :return: sessionmaker. Creates sessions on the user's shard.
+    """
+
+    return shard_sessions[check_shard_name(get_user_shard(user_id))]
+
+# Throws UnknownShardException
+@contextmanager
+def open_user_session(user_id, for_write=False):
+    """
+    Opens a session on the shard the user's data is on.
+    :param user_id: str. The user whose data the session is for.
+    :param for_write: bool. Whether the session will write to the user's data. If so, the directory is read rather
+        than the cache, and the user can't be moved until the session is closed.
+    :return: Session. Yielded, and closed when the with block exits.
+    """
+
+    directory_session = None
+
+    try:
+
+        if not sharding_enabled():
+            shard_name = CORE_SHARD
+        elif for_write:
+            directory_session = SessionLocal()
+            shard_name = _lookup_user_shard(directory_session, user_id, lock="share") or CORE_SHARD
+            _directory_cache.set(str(user_id), shard_name, SHARD_DIRECTORY_CACHE_SECONDS)
+        else:
+            shard_name = get_user_shard(user_id)
+
+        if directory_session is not None and shard_name == CORE_SHARD:
+            # Already on core_db, and holding the lock, so it's used for the data too, rather than taking a second
+            # connection from the same pool. The lock is released when a transaction ends, so it's taken again as
+            # each following one begins.
+            db_session, directory_session = directory_session, None
+            event.listen(
+                db_session,
+                "after_begin",
+                lambda session, transaction, connection: _lookup_user_shard(connection, user_id, lock="share"),
+            )
+        else:
+            db_session = shard_sessions[check_shard_name(shard_name)]()
+
+        try:
+            yield db_session
+        finally:
+            db_session.close()
+
+    finally:
+        # Releases the lock on the user, once their writes are committed or rolled back
+        if directory_session is not None:
+            directory_session.close()
+
+def assign_new_user_shard(db_session, user_id, username):
+    """
+    Places a new user on a shard, by the hash ring. Their users row must already be committed in core_db.
+    :param db_session: Session. On core_db.
+    :return: str. The user's shard.
+    """
+
+    if not sharding_enabled():
+        return CORE_SHARD
+
+    shard_name = shard_ring.shard_for(user_id)
+    if shard_name != CORE_SHARD:
+        with shard_sessions[shard_name]() as shard_session:
+            shard_session.execute(_COPY_USER_ROW, {"user_id": str(user_id), "username": username})
+            shard_session.commit()
+
+    # Committed last, so until then the user is on core_db, where their users row already is
+    db_session.execute(_SET_USER_SHARD, {"user_id": str(user_id), "shard_name": shard_name})
+    db_session.commit()
+
+    logger.info("User assigned to shard", extra={"shard_name": shard_name})
+
+    return shard_name
+
+def _delete_user_rows(connection, user_id, include_users_row):
+    """
+    Deletes the user's data, children before parents.
+    :return: int. Number of rows deleted.
+    """
+
+    deleted_count = 0
+    for table_name, where in reversed(USER_DATA_TABLES):
+        if table_name == "users" and not include_users_row:
+            continue
+        deleted_count += connection.execute(
+            text(f"DELETE FROM {table_name} WHERE {where}"),
+            {"user_id": str(user_id)},
+        ).rowcount
+
+    return deleted_count
+
+def _copy_user_rows(source_connection, target_connection, user_id):
+    """
+    Copies the user's data with COPY, table by table, spooled through memory or a temporary file.
+    :return: int. Number of rows copied.
+    """
+
+    # COPY can't take parameters, so the user ID is written as a literal, once it's known to be a UUID
+    user_id_literal = f"CAST('{uuid.UUID(str(user_id))}' AS UUID)"
+
+    source_cursor = source_connection.connection.cursor()
+    target_cursor = target_connection.connection.cursor()
+
+    copied_count = 0
+    for table_name, where in USER_DATA_TABLES:
+
+        if table_name == "users":
+            # Already there on core_db, and on shards the user was on before
+            username = source_connection.execute(
+                text("SELECT username FROM users WHERE user_id = CAST(:user_id AS UUID)"),
+                {"user_id": str(user_id)},
+            ).scalar()
+            target_connection.execute(_COPY_USER_ROW, {"user_id": str(user_id), "username": username})
+            copied_count += 1
+            continue
+
+        # Named, as the columns can be in a different order on a shard created after the table was altered
+        columns = ", ".join(f'"{column.name}"' for column in Base.metadata.tables[table_name].columns)
+        query = f"SELECT {columns} FROM {table_name} WHERE {where.replace('CAST(:user_id AS UUID)', user_id_literal)}"
+
+        with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_BYTES) as rows:
+            source_cursor.copy_expert(f"COPY ({query}) TO STDOUT", rows)
+            rows.seek(0)
+            target_cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN", rows)
+        copied_count += target_cursor.rowcount
+
+    return copied_count
+
+# Throws UnknownShardException, ValueError
+def copy_user_to_shard(user_id, target_shard):
+    """
+    Copies the user's data to the target shard, and points the directory at it. Writes to the user's data wait until
+    this is done. The data is left on the old shard, for reads that use a cached directory entry, until removed with
+    remove_user_from_shard. Can be rerun after a failure, leftovers of an earlier attempt on the target are replaced.
+    :param target_shard: str. Name of the shard to move the user to.
+    :return: str. The shard the user was on, the same as the target if they were already there.
+    """
+
+    check_shard_name(target_shard)
+
+    with SessionLocal() as directory_session:
+
+        # Waits for the user's writes in progress, and holds off new ones, until the directory is updated
+        source_shard = _lookup_user_shard(directory_session, user_id, lock="move")
+        if source_shard is None:
+            raise ValueError(f"User does not exist [{user_id}]")
+        check_shard_name(source_shard)
+        if source_shard == target_shard:
+            return source_shard
+
+        start = time.perf_counter()
+
+        # A consistent snapshot of every table, although writes are held off anyway
+        with shard_engines[source_shard].connect().execution_options(isolation_level="REPEATABLE READ") as source_connection, \
+                shard_engines[target_shard].begin() as target_connection:
+            with source_connection.begin():
+                _delete_user_rows(target_connection, user_id, include_users_row=False)
+                copied_count = _copy_user_rows(source_connection, target_connection, user_id)
+
+        directory_session.execute(_SET_USER_SHARD, {"user_id": str(user_id), "shard_name": target_shard})
+        directory_session.commit()
+
+    _directory_cache.delete(str(user_id))
+
+    logger.info(
+        "User copied to shard",
+        extra={
+            "source_shard": source_shard,
+            "target_shard": target_shard,
+            "copied_count": copied_count,
+            "duration_ms": round((time.perf_counter() - start) * 1000),
+        },
+    )
+
+    return source_shard
+
+# Throws UnknownShardException, ValueError
+def remove_user_from_shard(user_id, shard_name):
+    """
+    Deletes what's left of the user's data on a shard they've been moved away from. Their users row stays in core_db.
+    Callers should wait SHARD_DIRECTORY_CACHE_SECONDS after the move first, for workers' cached entries to expire.
+    :return: int. Number of rows deleted.
+    """
+
+    check_shard_name(shard_name)
+
+    with SessionLocal() as directory_session:
+        if (_lookup_user_shard(directory_session, user_id) or CORE_SHARD) == shard_name:
+            raise ValueError(f"User's data is still on this shard, not removing it [{user_id}, {shard_name}]")
+
+    with shard_engines[shard_name].begin() as connection:
+        deleted_count = _delete_user_rows(connection, user_id, include_users_row=shard_name != CORE_SHARD)
+
+    logger.info("User removed from shard", extra={"shard_name": shard_name, "deleted_count": deleted_count})
+
+    return deleted_count
+
+def move_user(user_id, target_shard, wait_seconds=None):
+    """
+    Moves the user's data to the target shard. Writes to it wait while it's copied, reads don't.
+    :param wait_seconds: float. How long to wait between the copy and removing the old data. Defaults to
+        SHARD_DIRECTORY_CACHE_SECONDS, for workers' cached entries to expire.
+    :return: str. The shard the user was on.
+    """
+
+    source_shard = copy_user_to_shard(user_id, target_shard)
+    if source_shard != target_shard:
+        time.sleep(SHARD_DIRECTORY_CACHE_SECONDS if wait_seconds is None else wait_seconds)
+        remove_user_from_shard(user_id, source_shard)
+
+    return source_shard
+
+def misplaced_users(batch_size=1000):
+    """
+    Users that aren't on the shard the hash ring places them on.
+    :return: Iterator[Tuple(str, str, str)]. Each user's ID, current shard, and the ring's shard.
+    """
+
+    after = None
+
+    while True:
+
+        with SessionLocal() as directory_session:
+            rows = directory_session.execute(
+                _USERS_BATCH,
+                {"after": after, "batch_size": batch_size, "core_shard": CORE_SHARD},
+            ).all()
+
+        if not rows:
+            return
+
+        for row in rows:
+            ring_shard = shard_ring.shard_for(row.user_id)
+            if row.shard_name != ring_shard:
+                yield str(row.user_id), row.shard_name, ring_shard
+
+        after = str(rows[-1].user_id)
+
+def rebalance(batch_size=100, limit=None, dry_run=False, wait_seconds=None):
+    """
+    Moves users that aren't on the shard the hash ring places them on, a batch at a time: each batch is copied, then
+    the old data is removed once workers' cached entries have expired, so the wait is once per batch.
+    :param batch_size: int. Users per batch.
+    :param limit: int. Maximum number of users to move, or None for all of them.
+    :param dry_run: bool. Only count the users that would be moved.
+    :return: int. Number of users moved, or that would be moved if dry_run.
+    """
+
+    moved_count = 0
+    batch = []
+
+    def _finish_batch():
+        if not batch:
+            return
+        time.sleep(SHARD_DIRECTORY_CACHE_SECONDS if wait_seconds is None else wait_seconds)
+        for user_id, source_shard in batch:
+            remove_user_from_shard(user_id, source_shard)
+        batch.clear()
+
+    for user_id, current_shard, ring_shard in misplaced_users():
+
+        if limit is not None and moved_count >= limit:
+            break
+
+        moved_count += 1
+        if dry_run:
+            continue
+
+        source_shard = copy_user_to_shard(user_id, ring_shard)
+        if source_shard != ring_shard:
+            batch.append((user_id, source_shard))
+        if len(batch) >= batch_size:
+            _finish_batch()
+
+        logger.info("Rebalancing users", extra={"moved_count": moved_count})
+
+    _finish_batch()
+
+    return moved_count
+
+def replicate_catalogs(shard_names=None):
+    """
+    Copies the exercises and actions catalogs from core_db to other shards, with the same IDs, so the users' data
+    refers to the same rows wherever it is. Rows already there are updated.
+    :param shard_names: List[str]. Shards to copy to. Defaults to every shard but core_db.
+    :return: int. Number of rows copied to each shard.
+    """
+
+    shard_names = [name for name in (shard_names or shard_engines) if name != CORE_SHARD]
+
+    with shard_engines[CORE_SHARD].connect() as core_connection:
+        catalogs = {
+            table_name: [dict(row._mapping) for row in core_connection.execute(select(Base.metadata.tables[table_name]))]
+            for table_name in CATALOG_TABLES
+        }
+
+    for shard_name in shard_names:
+        with shard_engines[check_shard_name(shard_name)].begin() as shard_connection:
+            for table_name, rows in catalogs.items():
+                if not rows:
+                    continue
+                table = Base.metadata.tables[table_name]
+                statement = insert(table)
+                statement = statement.on_conflict_do_update(
+                    index_elements=[column.name for column in table.primary_key.columns],
+                    set_={
+                        column.name: statement.excluded[column.name]
+                        for column in table.columns
+                        if not column.primary_key
+                    },
+                )
+                shard_connection.execute(statement, rows)
+        logger.info("Catalogs replicated", extra={"shard_name": shard_name})
+
+    return sum(len(rows) for rows in catalogs.values())
+
+def shard_user_counts():
+    """
+    :return: Dict[str, int]. Number of users on each shard, from the directory.
+    """
+
+    with SessionLocal() as directory_session:
+        rows = directory_session.execute(
+            text(
+                """
+                SELECT COALESCE(us.shard_name, :core_shard) AS shard_name, COUNT(*) AS user_count
+                FROM users u
+                LEFT JOIN user_shards us ON us.user_id = u.user_id
+                GROUP BY 1
+                """
+            ),
+            {"core_shard": CORE_SHARD},
+        ).all()
+
+    return {row.shard_name: row.user_count for row in rows}
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Manage the shards users' data is stored on")
+    parser.add_argument(
+        "command",
+        choices=["status", "replicate-catalogs", "move", "rebalance"],
+        help=(
+            "status: Users per shard. replicate-catalogs: Copy exercises and actions to every shard. "
+            "move: Move one user's data. rebalance: Move users the hash ring places on other shards"
+        ),
+    )
+    parser.add_argument("--user-id", help="move: The user to move")
+    parser.add_argument("--to", help="move: The shard to move them to")
+    parser.add_argument("--limit", type=int, help="rebalance: Maximum number of users to move")
+    parser.add_argument("--batch-size", type=int, default=100, help="rebalance: Users moved per wait")
+    parser.add_argument("--dry-run", action="store_true", help="rebalance: Only count the users that would be moved")
+    parser.add_argument(
+        "--wait-seconds",
+        type=float,
+        help="Wait before removing moved data from the old shard. Defaults to SHARD_DIRECTORY_CACHE_SECONDS",
+    )
+    args = parser.parse_args()
+
+    if args.command == "status":
+        user_counts = shard_user_counts()
+        for shard_name in shard_engines:
+            in_ring = "ring" if shard_name in SHARD_RING else "-"
+            print(f"{shard_name:<20} {in_ring:<5} {user_counts.pop(shard_name, 0)} users")
+        for shard_name, user_count in user_counts.items():
+            print(f"{shard_name:<20} {'?':<5} {user_count} users, not configured")
+
+    elif args.command == "replicate-catalogs":
+        row_count = replicate_catalogs()
+        print(f"Replicated {row_count} catalog rows to {len(shard_engines) - 1} shards")
+
+    elif args.command == "move":
+        if not args.user_id or not args.to:
+            parser.error("move needs --user-id and --to")
+        source_shard = move_user(args.user_id, args.to, wait_seconds=args.wait_seconds)
+        print(f"Moved {args.user_id} from {source_shard} to {args.to}")
+
+    elif args.command == "rebalance":
+        moved_count = rebalance(
+            batch_size=args.batch_size,
+            limit=args.limit,
+            dry_run=args.dry_run,
+            wait_seconds=args.wait_seconds,
+        )
+        print(f"{'Would move' if args.dry_run else 'Moved'} {moved_count} users")
+
+if __name__ == "__main__":
+    main()
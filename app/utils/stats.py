@@ -0,0 +1,636 @@
+"""
+Training statistics for each user: workouts completed per week and month, weekly streaks, and per exercise, how often
+it was completed, total reps and volume (reps x weight), and best estimated one rep max.
+
+Computing these from a user's full history on every request would mean reading every finished workout and the version
+of every component completed in them. Instead, they're kept in aggregate tables (user_stats, user_workout_periods and
+user_exercise_stats), which are updated by each finished workout in the same transaction that records it, so they're
+never out of step with the history. Reading them is a few primary key lookups. What was completed on each day is kept
+the same way (user_daily_activity), for the activity calendar (see app/utils/activity.py).
+
+How finished components are counted:
+
+- Their values are those they were completed with, recorded for each session uploaded from the app's offline queue,
+  so several sessions in one upload each count as they were done. Otherwise they're the component's version in effect
+  when the workout was recorded, so changes saved with a finish are included.
+- Reps are the lowest of the component's reps (reps_min, parsed when the version was saved), so a range such as 8-12
+  counts as 8, the number the user is sure to have done. Reps with no number (eg AMRAP) count towards completions, but
+  not reps, volume, one rep maxes or records.
+- Weights in lbs are converted to kg, so an exercise's totals are in one unit.
+- Estimated one rep maxes use the Epley formula, weight x (1 + reps / 30), and are the weight itself for single reps.
+
+Personal records are the heaviest weight completed for each exercise and number of reps (personal_records), and the
+best estimated one rep max of each exercise. Each finished workout's new records are found as its stats are updated,
+with a primary key lookup per exercise and number of reps, and returned with the finished workout. Only records that
+beat a previous one are returned, not the first time an exercise is done at a number of reps.
+
+Streaks are consecutive weeks (Monday to Sunday, in the database's time zone) with at least one workout. The current
+streak is only reported while it can still be continued, ie if its last week is this week or last week.
+
+Stats for history recorded before the tables existed, or loaded directly into the database, are rebuilt with:
+
+    python -m app.utils.stats rebuild
+"""
+
+import argparse
+import logging
+from datetime import timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .response_cache import bump_user_data_versions
+
+logger = logging.getLogger(__name__)
+
+# Weeks and months of workout counts returned with a user's stats, including the current one
+STATS_RECENT_PERIODS = 12
+
+WEEK = "week"
+MONTH = "month"
+
+# Kinds of personal record
+ESTIMATED_ONE_REP_MAX = "estimated_one_rep_max"
+REP_MAX = "rep_max"
+
+# Each completed component, with the values it was completed with if they were recorded (sessions uploaded from the
+# app's offline queue), otherwise its values in effect when its workout was recorded. Finished workouts are given either
+# by ID (:finished_workout_ids) or by user (:user_ids).
+_COMPLETED_COMPONENTS = """
+    SELECT
+        finished_workouts.user_id,
+        workout_components.exercise_id,
+        finished_workouts.finished_workout_id,
+        finished_workouts.completed_datetime,
+        version.reps_min AS reps,
+        CASE WHEN lower(version.units) IN ('lb', 'lbs') THEN version.weight * 0.45359237 ELSE version.weight END AS weight_kg
+    FROM finished_workouts
+    JOIN finished_workout_components ON finished_workout_components.finished_workout_id = finished_workouts.finished_workout_id
+    JOIN workout_components ON workout_components.workout_component_id = finished_workout_components.workout_component_id
+    LEFT JOIN LATERAL (
+        SELECT finished_workout_components.reps_min, finished_workout_components.weight, finished_workout_components.units
+        WHERE finished_workout_components.weight IS NOT NULL
+        UNION ALL
+        -- Only read when the values weren't recorded
+        (
+            SELECT reps_min, weight, units
+            FROM workout_component_history
+            WHERE workout_component_history.workout_component_id = finished_workout_components.workout_component_id
+            AND workout_component_history.datetime_added <= finished_workouts.datetime_recorded
+            AND finished_workout_components.weight IS NULL
+            ORDER BY workout_component_history.datetime_added DESC
+            LIMIT 1
+        )
+    ) AS version ON TRUE
+    WHERE finished_workouts.user_id IS NOT NULL
+    AND (CAST(:finished_workout_ids AS UUID[]) IS NULL OR finished_workouts.finished_workout_id = ANY(CAST(:finished_workout_ids AS UUID[])))
+    AND (CAST(:user_ids AS UUID[]) IS NULL OR finished_workouts.user_id = ANY(CAST(:user_ids AS UUID[])))
+"""
+
+# Adds the finished workouts' components to their exercises' totals. Returns the updated totals of those exercises.
+_UPSERT_EXERCISE_STATS = text(
+    f"""
+    WITH completed AS (
+        {_COMPLETED_COMPONENTS}
+    ),
+    estimated AS (
+        SELECT
+            user_id,
+            exercise_id,
+            completed_datetime,
+            reps,
+            reps * weight_kg AS volume_kg,
+            CASE WHEN reps = 1 THEN weight_kg WHEN reps > 1 THEN weight_kg * (1 + reps / 30.0) END AS one_rep_max_kg
+        FROM completed
+    ),
+    -- Read before the upsert, as the statement sees the table as it was when it started
+    previous AS (
+        SELECT user_exercise_stats.user_id, user_exercise_stats.exercise_id, user_exercise_stats.best_one_rep_max_kg
+        FROM user_exercise_stats
+        JOIN (SELECT DISTINCT user_id, exercise_id FROM estimated) AS exercises_completed
+            ON exercises_completed.user_id = user_exercise_stats.user_id
+            AND exercises_completed.exercise_id = user_exercise_stats.exercise_id
+    ),
+    upserted AS (
+        INSERT INTO user_exercise_stats (
+            user_id, exercise_id, completed_count, total_reps, total_volume_kg, best_one_rep_max_kg, best_one_rep_max_datetime
+        )
+        SELECT
+            user_id,
+            exercise_id,
+            COUNT(*),
+            COALESCE(SUM(reps), 0),
+            COALESCE(SUM(volume_kg), 0),
+            MAX(one_rep_max_kg),
+            (ARRAY_AGG(completed_datetime ORDER BY one_rep_max_kg DESC NULLS LAST))[1]
+        FROM estimated
+        GROUP BY user_id, exercise_id
+        ON CONFLICT (user_id, exercise_id) DO UPDATE SET
+            completed_count = user_exercise_stats.completed_count + EXCLUDED.completed_count,
+            total_reps = user_exercise_stats.total_reps + EXCLUDED.total_reps,
+            total_volume_kg = user_exercise_stats.total_volume_kg + EXCLUDED.total_volume_kg,
+            best_one_rep_max_kg = GREATEST(user_exercise_stats.best_one_rep_max_kg, EXCLUDED.best_one_rep_max_kg),
+            best_one_rep_max_datetime = CASE
+                WHEN EXCLUDED.best_one_rep_max_kg > COALESCE(user_exercise_stats.best_one_rep_max_kg, -1)
+                THEN EXCLUDED.best_one_rep_max_datetime
+                ELSE user_exercise_stats.best_one_rep_max_datetime
+            END
+        RETURNING *
+    )
+    SELECT upserted.*, exercises.exercise_name, previous.best_one_rep_max_kg AS previous_best_one_rep_max_kg
+    FROM upserted
+    JOIN exercises ON exercises.exercise_id = upserted.exercise_id
+    LEFT JOIN previous ON previous.user_id = upserted.user_id AND previous.exercise_id = upserted.exercise_id
+    ORDER BY exercises.exercise_name
+    """
+)
+
+# Records the heaviest weight of each exercise and number of reps in the finished workouts, where it beats the user's
+# record. Returns the records beaten, with the weights they replaced, but not first records.
+_UPSERT_PERSONAL_RECORDS = text(
+    f"""
+    WITH completed AS (
+        {_COMPLETED_COMPONENTS}
+    ),
+    -- The heaviest, and of those the first completed, of each exercise and number of reps
+    best AS (
+        SELECT DISTINCT ON (user_id, exercise_id, reps)
+            user_id, exercise_id, reps, weight_kg, finished_workout_id, completed_datetime
+        FROM completed
+        WHERE reps > 0 AND weight_kg IS NOT NULL
+        ORDER BY user_id, exercise_id, reps, weight_kg DESC, completed_datetime
+    ),
+    previous AS (
+        SELECT personal_records.user_id, personal_records.exercise_id, personal_records.reps, personal_records.weight_kg
+        FROM personal_records
+        JOIN best
+            ON best.user_id = personal_records.user_id
+            AND best.exercise_id = personal_records.exercise_id
+            AND best.reps = personal_records.reps
+    ),
+    upserted AS (
+        INSERT INTO personal_records (user_id, exercise_id, reps, weight_kg, finished_workout_id, achieved_datetime)
+        SELECT user_id, exercise_id, reps, weight_kg, finished_workout_id, completed_datetime
+        FROM best
+        ON CONFLICT (user_id, exercise_id, reps) DO UPDATE SET
+            weight_kg = EXCLUDED.weight_kg,
+            finished_workout_id = EXCLUDED.finished_workout_id,
+            achieved_datetime = EXCLUDED.achieved_datetime
+        WHERE EXCLUDED.weight_kg > personal_records.weight_kg
+        RETURNING personal_records.user_id, personal_records.exercise_id, personal_records.reps, personal_records.weight_kg
+    )
+    SELECT exercises.exercise_name, upserted.reps, upserted.weight_kg, previous.weight_kg AS previous_weight_kg
+    FROM upserted
+    JOIN previous
+        ON previous.user_id = upserted.user_id
+        AND previous.exercise_id = upserted.exercise_id
+        AND previous.reps = upserted.reps
+    JOIN exercises ON exercises.exercise_id = upserted.exercise_id
+    ORDER BY exercises.exercise_name, upserted.reps
+    """
+)
+
+# Adds the finished workouts to the counts of the weeks and months they were completed in
+_UPSERT_WORKOUT_PERIODS = text(
+    """
+    INSERT INTO user_workout_periods (user_id, period_type, period_start, workout_count)
+    SELECT finished_workouts.user_id, periods.period_type, periods.period_start, COUNT(*)
+    FROM finished_workouts
+    CROSS JOIN LATERAL (
+        VALUES
+            ('week', CAST(date_trunc('week', finished_workouts.completed_datetime) AS DATE)),
+            ('month', CAST(date_trunc('month', finished_workouts.completed_datetime) AS DATE))
+    ) AS periods (period_type, period_start)
+    WHERE finished_workouts.user_id IS NOT NULL
+    AND (CAST(:finished_workout_ids AS UUID[]) IS NULL OR finished_workouts.finished_workout_id = ANY(CAST(:finished_workout_ids AS UUID[])))
+    AND (CAST(:user_ids AS UUID[]) IS NULL OR finished_workouts.user_id = ANY(CAST(:user_ids AS UUID[])))
+    GROUP BY finished_workouts.user_id, periods.period_type, periods.period_start
+    ON CONFLICT (user_id, period_type, period_start) DO UPDATE SET
+        workout_count = user_workout_periods.workout_count + EXCLUDED.workout_count
+    RETURNING period_type, period_start, workout_count
+    """
+)
+
+# Adds the finished workouts, and their components, to the days they were completed on. Workouts are counted from
+# finished_workouts, so those with no components still count.
+_UPSERT_DAILY_ACTIVITY = text(
+    f"""
+    WITH completed AS (
+        {_COMPLETED_COMPONENTS}
+    ),
+    workout_totals AS (
+        SELECT
+            finished_workouts.user_id,
+            CAST(finished_workouts.completed_datetime AS DATE) AS activity_date,
+            COUNT(completed.finished_workout_id) AS component_count,
+            COALESCE(SUM(completed.reps), 0) AS total_reps,
+            COALESCE(SUM(completed.reps * completed.weight_kg), 0) AS total_volume_kg
+        FROM finished_workouts
+        LEFT JOIN completed ON completed.finished_workout_id = finished_workouts.finished_workout_id
+        WHERE finished_workouts.user_id IS NOT NULL
+        AND (CAST(:finished_workout_ids AS UUID[]) IS NULL OR finished_workouts.finished_workout_id = ANY(CAST(:finished_workout_ids AS UUID[])))
+        AND (CAST(:user_ids AS UUID[]) IS NULL OR finished_workouts.user_id = ANY(CAST(:user_ids AS UUID[])))
+        GROUP BY finished_workouts.user_id, finished_workouts.finished_workout_id
+    )
+    INSERT INTO user_daily_activity (user_id, activity_date, workout_count, component_count, total_reps, total_volume_kg)
+    SELECT user_id, activity_date, COUNT(*), SUM(component_count), SUM(total_reps), SUM(total_volume_kg)
+    FROM workout_totals
+    GROUP BY user_id, activity_date
+    ON CONFLICT (user_id, activity_date) DO UPDATE SET
+        workout_count = user_daily_activity.workout_count + EXCLUDED.workout_count,
+        component_count = user_daily_activity.component_count + EXCLUDED.component_count,
+        total_reps = user_daily_activity.total_reps + EXCLUDED.total_reps,
+        total_volume_kg = user_daily_activity.total_volume_kg + EXCLUDED.total_volume_kg
+    """
+)
+
+# Creates the users' rows if they don't have one, and locks them, so that concurrent updates of a user's stats happen
+# one after the other. The no-op update is what takes the lock on rows that already exist.
+_LOCK_USER_STATS = text(
+    """
+    INSERT INTO user_stats (user_id, workout_count, current_streak_weeks, longest_streak_weeks)
+    SELECT user_id, 0, 0, 0
+    FROM unnest(CAST(:user_ids AS UUID[])) AS locked (user_id)
+    ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id
+    RETURNING
+        workout_count,
+        current_streak_weeks,
+        longest_streak_weeks,
+        last_workout_week,
+        CAST(date_trunc('week', LOCALTIMESTAMP) AS DATE) AS current_week,
+        CAST(date_trunc('month', LOCALTIMESTAMP) AS DATE) AS current_month
+    """
+)
+
+_UPDATE_USER_STATS = text(
+    """
+    UPDATE user_stats
+    SET
+        workout_count = :workout_count,
+        current_streak_weeks = :current_streak_weeks,
+        longest_streak_weeks = :longest_streak_weeks,
+        last_workout_week = :last_workout_week
+    WHERE user_id = CAST(:user_id AS UUID)
+    """
+)
+
+# Recounts the users' totals and streaks from their weekly counts. Consecutive weeks are those whose start, less a
+# week per week before them, is the same, and each run of them is a streak.
+_REBUILD_USER_STATS = text(
+    """
+    WITH weeks AS (
+        SELECT
+            user_id,
+            period_start,
+            workout_count,
+            period_start - 7 * CAST(ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY period_start) AS INTEGER) AS streak_id
+        FROM user_workout_periods
+        WHERE period_type = 'week'
+        AND user_id = ANY(CAST(:user_ids AS UUID[]))
+    ),
+    streaks AS (
+        SELECT user_id, COUNT(*) AS streak_weeks, MAX(period_start) AS last_week, SUM(workout_count) AS workout_count
+        FROM weeks
+        GROUP BY user_id, streak_id
+    ),
+    totals AS (
+        SELECT
+            user_id,
+            SUM(workout_count) AS workout_count,
+            (ARRAY_AGG(streak_weeks ORDER BY last_week DESC))[1] AS current_streak_weeks,
+            MAX(streak_weeks) AS longest_streak_weeks,
+            MAX(last_week) AS last_workout_week
+        FROM streaks
+        GROUP BY user_id
+    )
+    UPDATE user_stats
+    SET
+        workout_count = COALESCE(totals.workout_count, 0),
+        current_streak_weeks = COALESCE(totals.current_streak_weeks, 0),
+        longest_streak_weeks = COALESCE(totals.longest_streak_weeks, 0),
+        last_workout_week = totals.last_workout_week
+    FROM unnest(CAST(:user_ids AS UUID[])) AS rebuilt (user_id)
+    LEFT JOIN totals ON totals.user_id = rebuilt.user_id
+    WHERE user_stats.user_id = rebuilt.user_id
+    RETURNING user_stats.workout_count, user_stats.current_streak_weeks, user_stats.longest_streak_weeks, user_stats.last_workout_week
+    """
+)
+
+_CLEAR_USER_STATS = [
+    text("DELETE FROM user_exercise_stats WHERE user_id = ANY(CAST(:user_ids AS UUID[]))"),
+    text("DELETE FROM personal_records WHERE user_id = ANY(CAST(:user_ids AS UUID[]))"),
+    text("DELETE FROM user_workout_periods WHERE user_id = ANY(CAST(:user_ids AS UUID[]))"),
+    text("DELETE FROM user_daily_activity WHERE user_id = ANY(CAST(:user_ids AS UUID[]))"),
+]
+
+_GET_USER_STATS = text(
+    """
+    SELECT
+        CAST(date_trunc('week', LOCALTIMESTAMP) AS DATE) AS current_week,
+        user_stats.workout_count,
+        user_stats.current_streak_weeks,
+        user_stats.longest_streak_weeks,
+        user_stats.last_workout_week
+    FROM (VALUES (1)) AS now
+    LEFT JOIN user_stats ON user_stats.user_id = CAST(:user_id AS UUID)
+    """
+)
+
+# The user's workout counts for each of the most recent weeks and months, including those with none
+_GET_RECENT_PERIODS = text(
+    """
+    SELECT periods.period_type, periods.period_start, COALESCE(user_workout_periods.workout_count, 0) AS workout_count
+    FROM (
+        SELECT 'week' AS period_type, CAST(series AS DATE) AS period_start
+        FROM generate_series(
+            date_trunc('week', LOCALTIMESTAMP) - make_interval(weeks => :periods - 1),
+            date_trunc('week', LOCALTIMESTAMP),
+            INTERVAL '1 week'
+        ) AS series
+        UNION ALL
+        SELECT 'month', CAST(series AS DATE)
+        FROM generate_series(
+            date_trunc('month', LOCALTIMESTAMP) - make_interval(months => :periods - 1),
+            date_trunc('month', LOCALTIMESTAMP),
+            INTERVAL '1 month'
+        ) AS series
+    ) AS periods
+    LEFT JOIN user_workout_periods
+        ON user_workout_periods.user_id = CAST(:user_id AS UUID)
+        AND user_workout_periods.period_type = periods.period_type
+        AND user_workout_periods.period_start = periods.period_start
+    ORDER BY periods.period_type, periods.period_start
+    """
+)
+
+_GET_PERSONAL_RECORDS = text(
+    """
+    SELECT exercises.exercise_name, personal_records.reps, personal_records.weight_kg, personal_records.achieved_datetime
+    FROM personal_records
+    JOIN exercises ON exercises.exercise_id = personal_records.exercise_id
+    WHERE personal_records.user_id = CAST(:user_id AS UUID)
+    ORDER BY exercises.exercise_name, personal_records.reps
+    """
+)
+
+_GET_EXERCISE_STATS = text(
+    """
+    SELECT user_exercise_stats.*, exercises.exercise_name
+    FROM user_exercise_stats
+    JOIN exercises ON exercises.exercise_id = user_exercise_stats.exercise_id
+    WHERE user_exercise_stats.user_id = CAST(:user_id AS UUID)
+    ORDER BY exercises.exercise_name
+    """
+)
+
+def _reported_streak(current_streak_weeks, last_workout_week, current_week):
+    """
+    :return: int. The current streak, or 0 if it has already been broken, ie the user has gone a whole week without a
+        workout since it ended.
+    """
+
+    if last_workout_week is None or last_workout_week < current_week - timedelta(weeks=1):
+        return 0
+
+    return current_streak_weeks
+
+def _exercise_stats(row):
+    return {
+        "exercise_name": row.exercise_name,
+        "completed_count": row.completed_count,
+        "total_reps": row.total_reps,
+        "total_volume_kg": row.total_volume_kg,
+        "best_one_rep_max_kg": row.best_one_rep_max_kg,
+        "best_one_rep_max_datetime": row.best_one_rep_max_datetime,
+    }
+
+def _beaten_records(exercise_rows, record_rows):
+    """
+    :return: List[Dict]. Follows PersonalRecordSchema: the estimated one rep maxes and heaviest weights for a number of
+        reps that were beaten, by exercise.
+    """
+
+    beaten_records = [
+        {
+            "exercise_name": row.exercise_name,
+            "record_type": ESTIMATED_ONE_REP_MAX,
+            "reps": None,
+            "weight_kg": row.best_one_rep_max_kg,
+            "previous_weight_kg": row.previous_best_one_rep_max_kg,
+        }
+        for row in exercise_rows
+        if row.previous_best_one_rep_max_kg is not None and row.best_one_rep_max_kg > row.previous_best_one_rep_max_kg
+    ]
+    beaten_records.extend(
+        {
+            "exercise_name": row.exercise_name,
+            "record_type": REP_MAX,
+            "reps": row.reps,
+            "weight_kg": row.weight_kg,
+            "previous_weight_kg": row.previous_weight_kg,
+        }
+        for row in record_rows
+    )
+
+    return sorted(beaten_records, key=lambda record: (record["exercise_name"], record["reps"] or 0))
+
+def record_finished_workouts(
+    db_session: Session,
+    user_id,
+    finished_workout_ids,
+):
+    """
+    Adds finished workouts, and their components, to the user's stats. Call once the workouts' components have been
+    written, in the same transaction. Does not commit.
+    :param user_id: str. The user who finished the workouts.
+    :param finished_workout_ids: List[UUID]. Newly finished workouts of the user's.
+    :return: Dict. Follows FinishedWorkoutStatsSchema: the user's updated totals and streaks, the updated stats of
+        the exercises in the workouts, and the personal records they beat.
+    """
+
+    parameters = {
+        "finished_workout_ids": [str(finished_workout_id) for finished_workout_id in finished_workout_ids],
+        "user_ids": None,
+    }
+
+    # First, so the user's stats are updated by one transaction at a time
+    stats = db_session.execute(_LOCK_USER_STATS, {"user_ids": [str(user_id)]}).one()
+
+    exercise_rows = db_session.execute(_UPSERT_EXERCISE_STATS, parameters).all()
+    record_rows = db_session.execute(_UPSERT_PERSONAL_RECORDS, parameters).all()
+    period_rows = db_session.execute(_UPSERT_WORKOUT_PERIODS, parameters).all()
+    db_session.execute(_UPSERT_DAILY_ACTIVITY, parameters)
+
+    period_counts = {(row.period_type, row.period_start): row.workout_count for row in period_rows}
+    new_weeks = sorted(period_start for period_type, period_start in period_counts if period_type == WEEK)
+
+    workout_count = stats.workout_count + len(finished_workout_ids)
+    current_streak_weeks = stats.current_streak_weeks
+    longest_streak_weeks = stats.longest_streak_weeks
+    last_workout_week = stats.last_workout_week
+
+    if last_workout_week is not None and new_weeks and new_weeks[0] < last_workout_week:
+        # Workouts from before the latest week, eg uploaded from the app's offline queue, may join streaks together.
+        # Rare, so the streaks are recounted from the weekly counts rather than tracked precisely.
+        rebuilt = db_session.execute(_REBUILD_USER_STATS, {"user_ids": [str(user_id)]}).one()
+        workout_count = rebuilt.workout_count
+        current_streak_weeks = rebuilt.current_streak_weeks
+        longest_streak_weeks = rebuilt.longest_streak_weeks
+        last_workout_week = rebuilt.last_workout_week
+
+    else:
+        for week in new_weeks:
+            if last_workout_week is None or week > last_workout_week + timedelta(weeks=1):
+                current_streak_weeks = 1
+            elif week == last_workout_week + timedelta(weeks=1):
+                current_streak_weeks += 1
+            last_workout_week = max(week, last_workout_week or week)
+            longest_streak_weeks = max(longest_streak_weeks, current_streak_weeks)
+
+        db_session.execute(
+            _UPDATE_USER_STATS,
+            {
+                "user_id": str(user_id),
+                "workout_count": workout_count,
+                "current_streak_weeks": current_streak_weeks,
+                "longest_streak_weeks": longest_streak_weeks,
+                "last_workout_week": last_workout_week,
+            },
+        )
+
+    return {
+        "workout_count": workout_count,
+        "workouts_this_week": period_counts.get((WEEK, stats.current_week), 0),
+        "workouts_this_month": period_counts.get((MONTH, stats.current_month), 0),
+        "current_streak_weeks": _reported_streak(current_streak_weeks, last_workout_week, stats.current_week),
+        "longest_streak_weeks": longest_streak_weeks,
+        "exercises": [_exercise_stats(row) for row in exercise_rows],
+        "personal_records": _beaten_records(exercise_rows, record_rows),
+    }
+
+def get_user_stats(
+    db_session: Session,
+    user_id,
+):
+    """
+    :param user_id: str. The user whose stats to get.
+    :return: Dict. Follows UserStatsResponseSchema: the user's totals and streaks, workouts per week and per month for
+        the last STATS_RECENT_PERIODS of each, and stats and personal records for every exercise they have completed.
+    """
+
+    stats = db_session.execute(_GET_USER_STATS, {"user_id": str(user_id)}).one()
+    period_rows = db_session.execute(_GET_RECENT_PERIODS, {"user_id": str(user_id), "periods": STATS_RECENT_PERIODS}).all()
+    exercise_rows = db_session.execute(_GET_EXERCISE_STATS, {"user_id": str(user_id)}).all()
+    record_rows = db_session.execute(_GET_PERSONAL_RECORDS, {"user_id": str(user_id)}).all()
+
+    weeks = [{"period_start": row.period_start, "workout_count": row.workout_count} for row in period_rows if row.period_type == WEEK]
+    months = [{"period_start": row.period_start, "workout_count": row.workout_count} for row in period_rows if row.period_type == MONTH]
+
+    return {
+        "workout_count": stats.workout_count or 0,
+        # The current week and month are the last of each
+        "workouts_this_week": weeks[-1]["workout_count"],
+        "workouts_this_month": months[-1]["workout_count"],
+        "current_streak_weeks": _reported_streak(stats.current_streak_weeks, stats.last_workout_week, stats.current_week),
+        "longest_streak_weeks": stats.longest_streak_weeks or 0,
+        "last_workout_week": stats.last_workout_week,
+        "weeks": weeks,
+        "months": months,
+        "exercises": [_exercise_stats(row) for row in exercise_rows],
+        "personal_records": [
+            {
+                "exercise_name": row.exercise_name,
+                "reps": row.reps,
+                "weight_kg": row.weight_kg,
+                "achieved_datetime": row.achieved_datetime,
+            }
+            for row in record_rows
+        ],
+    }
+
+def rebuild_user_stats(
+    db_session: Session,
+    user_ids,
+):
+    """
+    Recomputes the users' stats from their full history, replacing what they had. Does not commit.
+    :param user_ids: List[str]. Users to rebuild.
+    """
+
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not user_ids:
+        return
+
+    db_session.execute(_LOCK_USER_STATS, {"user_ids": user_ids}).all()
+    for statement in _CLEAR_USER_STATS:
+        db_session.execute(statement, {"user_ids": user_ids})
+
+    parameters = {"finished_workout_ids": None, "user_ids": user_ids}
+    db_session.execute(_UPSERT_EXERCISE_STATS, parameters).all()
+    db_session.execute(_UPSERT_PERSONAL_RECORDS, parameters).all()
+    db_session.execute(_UPSERT_WORKOUT_PERIODS, parameters).all()
+    db_session.execute(_UPSERT_DAILY_ACTIVITY, parameters)
+    db_session.execute(_REBUILD_USER_STATS, {"user_ids": user_ids}).all()
+
+    # The activity calendar's cached responses are of the old stats
+    bump_user_data_versions(db_session=db_session, user_ids=user_ids)
+
+def rebuild_all_user_stats(engine, batch_size=500, shard_name="core_db"):
+    """
+    Rebuilds every user's stats, one transaction per batch of users, so it can run against a live database.
+    :param shard_name: str. The engine's shard. Users the directory places on other shards are skipped, see
+        app/utils/sharding.py.
+    :return: int. Number of users rebuilt.
+    """
+
+    rebuilt_count = 0
+    after = None
+
+    while True:
+
+        with Session(engine) as db_session:
+            user_ids = db_session.execute(
+                text(
+                    """
+                    SELECT user_id FROM users
+                    WHERE (CAST(:after AS UUID) IS NULL OR user_id > CAST(:after AS UUID))
+                    -- The directory is only filled in on core_db, which has every user's users row
+                    AND NOT EXISTS (
+                        SELECT 1 FROM user_shards
+                        WHERE user_shards.user_id = users.user_id
+                        AND user_shards.shard_name <> :shard_name
+                    )
+                    ORDER BY user_id
+                    LIMIT :batch_size
+                    """
+                ),
+                {"after": after, "batch_size": batch_size, "shard_name": shard_name},
+            ).scalars().all()
+
+            if not user_ids:
+                break
+
+            rebuild_user_stats(db_session, user_ids)
+            db_session.commit()
+
+        rebuilt_count += len(user_ids)
+        after = str(user_ids[-1])
+        logger.info("Rebuilt user stats", extra={"rebuilt_count": rebuilt_count})
+
+    return rebuilt_count
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Rebuild users' training stats from their full history")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: Rebuild every user's stats")
+    parser.add_argument("--batch-size", type=int, default=500, help="Users per transaction")
+    args = parser.parse_args()
+
+    from ..database import shard_engines
+
+    for shard_name, engine in shard_engines.items():
+        rebuilt_count = rebuild_all_user_stats(engine, batch_size=args.batch_size, shard_name=shard_name)
+        print(f"Rebuilt the stats of {rebuilt_count} users [{shard_name}]")
+
+if __name__ == "__main__":
+    main()
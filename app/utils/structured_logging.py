@@ -0,0 +1,232 @@
+"""
+Logging setup for the API.
+
+Records are formatted as single line JSON objects, so that Cloud Run/Cloud Logging can pick out the level and any
+extra fields. Request threads only ever put records onto a queue, a background listener thread does the formatting
+and the writing to stdout. Threads don't survive a fork, and gunicorn preloads the app in its master before forking
+the workers, so each forked process starts its own queue and listener.
+
+Configured via environment variables:
+
+LOG_LEVEL: Level for the root logger. Defaults to INFO.
+LOG_LEVELS: Per-module levels, eg "app.utils.database=DEBUG,app.utils.jwt=WARNING".
+LOG_DEBUG_SAMPLE_RATE: Fraction (0.0 - 1.0) of requests whose DEBUG records are kept. Defaults to 1.0.
+LOG_QUEUE_SIZE: Maximum number of records waiting to be written. Records are dropped, not waited on, past this.
+"""
+
+import os
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import atexit
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from os import getenv
+
+# Fields bound to the current request (or other unit of work), added to every record logged within it
+log_context: ContextVar[dict] = ContextVar("log_context", default=None)
+# Whether DEBUG records should be kept for the current request. None means decide per record.
+debug_sampled: ContextVar[bool] = ContextVar("debug_sampled", default=None)
+
+# Attributes every LogRecord has, anything else on a record was passed via extra={...}
+_STANDARD_RECORD_ATTRIBUTES = set(
+    logging.LogRecord("", 0, "", 0, "", None, None).__dict__.keys()
+) | {"message", "asctime"}
+
+_listener = None
+_queue_handler = None
+_stream_handler = None
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object. Keys match what Cloud Logging looks for (severity, message).
+    """
+
+    def format(self, record):
+
+        log_entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRIBUTES and not key.startswith("_"):
+                log_entry[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log_entry["exception"] = record.exc_text
+
+        # default=str, as UUIDs and datetimes are common in the extra fields
+        return json.dumps(log_entry, default=str)
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Drops a fraction of DEBUG records. Records above DEBUG are always kept.
+
+    If a sampling decision has been made for the current request (see bind_log_context), all of the request's DEBUG
+    records are kept or dropped together, so that sampled traces are complete.
+    """
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+
+        if record.levelno > logging.DEBUG:
+            return True
+
+        sampled = debug_sampled.get()
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+
+        return sampled
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the fields bound to the current context onto the record. Has to run in the logging thread, since the
+    listener thread does not share the request's context.
+    """
+
+    def filter(self, record):
+
+        context = log_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller. If the queue is full, the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped_records = 0
+
+    def prepare(self, record):
+        # Only resolve what can't be resolved later. Message args and exc_info may not be safe to use once the
+        # calling thread has moved on, so they are flattened here. Formatting to JSON happens in the listener.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+def parse_module_levels(module_levels):
+    """
+    Parses a string of the form "module=LEVEL,module=LEVEL".
+    :param module_levels: str. The string to parse, can be None or empty.
+    :return: Dict[str, str]. Logger names mapped to level names.
+    """
+
+    parsed_levels = {}
+
+    if not module_levels:
+        return parsed_levels
+
+    for entry in module_levels.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        module_name, _, level_name = entry.partition("=")
+        parsed_levels[module_name.strip()] = level_name.strip().upper()
+
+    return parsed_levels
+
+def setup_logging():
+    """
+    Configures the root logger using the environment variables described at the top of this file. Safe to call
+    more than once, only the first call has any effect.
+    """
+
+    global _queue_handler, _stream_handler
+
+    if _listener is not None:
+        return
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(getenv("LOG_LEVEL", "INFO").upper())
+
+    for module_name, level_name in parse_module_levels(getenv("LOG_LEVELS")).items():
+        logging.getLogger(module_name).setLevel(level_name)
+
+    _queue_handler = NonBlockingQueueHandler(None)
+    _queue_handler.addFilter(DebugSamplingFilter(sample_rate=float(getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))))
+    _queue_handler.addFilter(ContextFilter())
+
+    _stream_handler = logging.StreamHandler(sys.stdout)
+    _stream_handler.setFormatter(JsonFormatter())
+
+    # Replaces any handlers added by basicConfig or imported libraries
+    root_logger.handlers = [_queue_handler]
+
+    _start_listener()
+    # The listener thread isn't copied into forked processes, eg gunicorn's workers when the app is preloaded
+    os.register_at_fork(after_in_child=_start_listener)
+
+    # Flush anything still queued when the worker exits
+    atexit.register(_stop_listener)
+
+def _start_listener():
+    """
+    Starts this process's listener, on a new queue. A queue copied from the parent process could hold records the
+    parent will write, and locks held by the parent's threads at the time of the fork.
+    """
+
+    global _listener
+
+    log_queue = queue.Queue(maxsize=int(getenv("LOG_QUEUE_SIZE", "10000")))
+    _queue_handler.queue = log_queue
+
+    _listener = logging.handlers.QueueListener(log_queue, _stream_handler, respect_handler_level=True)
+    _listener.start()
+
+def _stop_listener():
+    _listener.stop()
+
+def bind_log_context(**fields):
+    """
+    Binds fields to the current context, so they appear on every record logged within it. Also makes the DEBUG
+    sampling decision for the context, so that a request's DEBUG records are kept or dropped together.
+    :param fields: Any. The fields to add to records, such as a request ID.
+    :return: Tuple. Tokens that can be passed to reset_log_context.
+    """
+
+    sample_rate = float(getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+    context = dict(log_context.get() or {})
+    context.update(fields)
+
+    return (
+        log_context.set(context),
+        debug_sampled.set(random.random() < sample_rate),
+    )
+
+def reset_log_context(tokens):
+    """
+    Undoes a call to bind_log_context.
+    :param tokens: Tuple. The value returned by bind_log_context.
+    """
+
+    context_token, sampled_token = tokens
+    log_context.reset(context_token)
+    debug_sampled.reset(sampled_token)
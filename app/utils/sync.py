@@ -0,0 +1,202 @@
+"""
+Changes to a user's workouts since the app last synced, so the app only downloads what's new rather than everything
+in /workouts/saved.
+
+The app sends back the cursor returned by its last sync. Cursors hold two things:
+
+- The user's data version (see app/utils/response_cache.py), increased by every write to their workouts. If it hasn't
+  changed, nothing has, and the sync costs a single primary key lookup.
+- The database's time when the last sync started. Rows are stamped with the time their transaction started, but only
+  become visible when it commits, so a write in progress during the last sync can have an earlier time than the
+  cursor. Changes are therefore read from SYNC_OVERLAP_SECONDS before the cursor, which covers any write shorter than
+  that, and the app may receive a few items it already has. Everything returned has an ID, so the app upserts it.
+
+Superseded component versions are never sent: each changed component is sent once, with its latest values. Nothing sent
+is ever deleted later, as workouts and components can't be deleted, and history compaction only removes versions that
+aren't the latest. If that changes, deletions will need recording (tombstones) and sending here too.
+
+Cursors that can't be used (from an older cursor format, or a newer version than the database has, eg after a restore)
+get a full sync, which the response marks so the app can replace what it has.
+"""
+
+from datetime import datetime, timedelta
+from os import getenv
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .custom_exceptions import InvalidSyncCursorException
+
+SYNC_OVERLAP_SECONDS = float(getenv("SYNC_OVERLAP_SECONDS", "60"))
+
+# Increase when what a cursor holds changes. Cursors in older formats get a full sync.
+SYNC_CURSOR_FORMAT = 1
+
+_EPOCH = datetime(1970, 1, 1)
+
+_SYNC_STATE = text(
+    """
+    SELECT
+        COALESCE((SELECT version FROM user_data_versions WHERE user_id = CAST(:user_id AS UUID)), 0) AS version,
+        LOCALTIMESTAMP AS synced_datetime
+    """
+)
+
+_CHANGED_WORKOUTS = text(
+    """
+    SELECT workout_id, workout_name, ai_generated, datetime_created
+    FROM user_workouts
+    WHERE user_id = CAST(:user_id AS UUID)
+    AND (CAST(:since AS TIMESTAMP) IS NULL OR datetime_created > CAST(:since AS TIMESTAMP))
+    ORDER BY datetime_created, workout_id
+    """
+)
+
+# New components have their first version added with them, so this covers new and changed components
+_CHANGED_COMPONENTS = text(
+    """
+    SELECT DISTINCT ON (workout_component_history.workout_component_id)
+        workout_component_history.workout_component_id,
+        workout_components.workout_id,
+        exercises.exercise_name,
+        workout_components.position,
+        workout_component_history.reps,
+        workout_component_history.weight,
+        workout_component_history.units,
+        workout_component_history.datetime_added
+    FROM user_workouts
+    JOIN workout_components ON workout_components.workout_id = user_workouts.workout_id
+    JOIN workout_component_history ON workout_component_history.workout_component_id = workout_components.workout_component_id
+    JOIN exercises ON exercises.exercise_id = workout_components.exercise_id
+    WHERE user_workouts.user_id = CAST(:user_id AS UUID)
+    AND (CAST(:since AS TIMESTAMP) IS NULL OR workout_component_history.datetime_added > CAST(:since AS TIMESTAMP))
+    ORDER BY
+        workout_component_history.workout_component_id,
+        workout_component_history.datetime_added DESC,
+        workout_component_history.workout_component_history_id DESC
+    """
+)
+
+_CHANGED_FINISHED_WORKOUTS = text(
+    """
+    SELECT
+        finished_workouts.finished_workout_id,
+        finished_workouts.completed_datetime,
+        array_remove(
+            array_agg(finished_workout_components.workout_component_id ORDER BY finished_workout_components.finished_workout_component_id),
+            NULL
+        ) AS workout_component_ids
+    FROM finished_workouts
+    LEFT JOIN finished_workout_components ON finished_workout_components.finished_workout_id = finished_workouts.finished_workout_id
+    WHERE finished_workouts.user_id = CAST(:user_id AS UUID)
+    -- Recorded rather than completed, as sessions uploaded from the app's offline queue were completed before the last sync
+    AND (CAST(:since AS TIMESTAMP) IS NULL OR finished_workouts.datetime_recorded > CAST(:since AS TIMESTAMP))
+    GROUP BY finished_workouts.finished_workout_id, finished_workouts.completed_datetime
+    ORDER BY finished_workouts.completed_datetime, finished_workouts.finished_workout_id
+    """
+)
+
+def encode_sync_cursor(version, synced_datetime):
+    """
+    :param version: int. The user's data version when the sync started.
+    :param synced_datetime: datetime. The database's time when the sync started.
+    :return: str. An opaque cursor for the app to send back with its next sync.
+    """
+
+    synced_microseconds = (synced_datetime - _EPOCH) // timedelta(microseconds=1)
+
+    return f"{SYNC_CURSOR_FORMAT}.{version}.{synced_microseconds}"
+
+# Throws InvalidSyncCursorException
+def decode_sync_cursor(cursor):
+    """
+    :param cursor: str. A cursor from encode_sync_cursor.
+    :return: Tuple(int, datetime). The data version and time the cursor was made at, or None if the cursor is in an
+        older format, in which case a full sync is needed.
+    """
+
+    try:
+        cursor_format, version, synced_microseconds = (int(part) for part in cursor.split("."))
+    except ValueError:
+        raise InvalidSyncCursorException(cursor=cursor)
+
+    if cursor_format != SYNC_CURSOR_FORMAT:
+        return None
+
+    return version, _EPOCH + timedelta(microseconds=synced_microseconds)
+
+# Throws InvalidSyncCursorException
+def get_changes_for_user(
+    db_session: Session,
+    user_id,
+    cursor=None,
+):
+    """
+    :param user_id: str. The user syncing.
+    :param cursor: str. The cursor returned by the user's last sync, or None for everything.
+    :return: Dict. Follows SyncResponseSchema: the new cursor, whether this was a full sync, and the workouts,
+        components and finished workouts created or changed since the cursor.
+    """
+
+    since = decode_sync_cursor(cursor) if cursor is not None else None
+
+    state = db_session.execute(_SYNC_STATE, {"user_id": str(user_id)}).one()
+
+    # A cursor from a version the database hasn't reached can't be trusted to describe what the app has
+    if since is not None and since[0] > state.version:
+        since = None
+
+    changes = {
+        "cursor": encode_sync_cursor(state.version, state.synced_datetime),
+        "full": since is None,
+        "workouts": [],
+        "workout_components": [],
+        "finished_workouts": [],
+    }
+
+    if since is not None:
+        since_version, since_datetime = since
+
+        if since_version == state.version:
+            # Nothing has been written, so the app keeps its cursor, including its time
+            changes["cursor"] = cursor
+            return changes
+
+        since = since_datetime - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+
+    parameters = {"user_id": str(user_id), "since": since}
+
+    changes["workouts"] = [
+        {
+            "workout_id": str(row.workout_id),
+            "name": row.workout_name,
+            "ai_generated": row.ai_generated,
+            "datetime_created": row.datetime_created,
+        }
+        for row in db_session.execute(_CHANGED_WORKOUTS, parameters)
+    ]
+
+    changes["workout_components"] = [
+        {
+            "workout_component_id": str(row.workout_component_id),
+            "workout_id": str(row.workout_id),
+            "exercise_name": row.exercise_name,
+            "position": row.position,
+            "reps": row.reps,
+            "weight": row.weight,
+            "units": row.units,
+            "datetime_updated": row.datetime_added,
+        }
+        for row in db_session.execute(_CHANGED_COMPONENTS, parameters)
+    ]
+
+    changes["finished_workouts"] = [
+        {
+            "finished_workout_id": str(row.finished_workout_id),
+            "completed_datetime": row.completed_datetime,
+            "workout_component_ids": [str(workout_component_id) for workout_component_id in row.workout_component_ids],
+        }
+        for row in db_session.execute(_CHANGED_FINISHED_WORKOUTS, parameters)
+    ]
+
+    return changes
@@ -0,0 +1,171 @@
+"""
+Per-request phase timings, such as time spent verifying JWTs, running SQL, shaping query results or waiting on the LLM.
+
+The middleware in app/__init__.py starts a set of timings for each request, and the hooks in this file add to it.
+The timings are returned to the client in a Server-Timing header, and logged with the request.
+"""
+
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from .profiling import profiled_thread
+
+# Phase name -> [total seconds, number of times the phase was entered]. Mutated in place, so that threads which were
+# handed a copy of the request's context (sync endpoints, dependencies) still add to the same timings.
+request_timings: ContextVar[dict] = ContextVar("request_timings", default=None)
+
+def start_request_timings():
+    """
+    Starts a new, empty set of timings for the current context.
+    :return: Tuple(dict, Token). The timings, and a token that can be used to reset the context variable.
+    """
+
+    timings = {}
+    return timings, request_timings.set(timings)
+
+def record_phase(phase_name, duration, timings=None):
+    """
+    Adds a duration to a phase of the current request. Does nothing outside of a request.
+    :param phase_name: str. Name of the phase, used as the Server-Timing metric name.
+    :param duration: float. Seconds spent in the phase.
+    :param timings: dict. Timings to add to, if not the current context's.
+    """
+
+    if timings is None:
+        timings = request_timings.get()
+    if timings is None:
+        return
+
+    phase = timings.setdefault(phase_name, [0.0, 0])
+    phase[0] += duration
+    phase[1] += 1
+
+@contextmanager
+def timed_phase(phase_name):
+    """
+    Records the time spent in the with block against a phase of the current request.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase_name, time.perf_counter() - start)
+
+def format_server_timing(timings, total_duration=None):
+    """
+    Formats timings as a Server-Timing header value, eg 'db;dur=12.1;desc="4 calls", total;dur=30.5'.
+    :param timings: dict. Timings built by record_phase.
+    :param total_duration: float. Seconds the whole request took, if known.
+    :return: str. The header value.
+    """
+
+    entries = [
+        f'{phase_name};dur={duration * 1000:.1f};desc="{count} calls"'
+        for phase_name, (duration, count) in _phases(timings)
+    ]
+
+    if total_duration is not None:
+        entries.append(f"total;dur={total_duration * 1000:.1f}")
+
+    return ", ".join(entries)
+
+def timings_as_log_fields(timings):
+    """
+    :return: Dict[str, float]. Milliseconds per phase, for structured logging.
+    """
+
+    return {
+        f"{phase_name}_ms": round(duration * 1000, 2)
+        for phase_name, (duration, _) in _phases(timings)
+    }
+
+def _phases(timings):
+    # Keys starting with _ are markers used by the hooks, not phases
+    return [
+        (phase_name, phase)
+        for phase_name, phase in timings.items()
+        if not phase_name.startswith("_")
+    ]
+
+def instrument_engine_timings(engine):
+    """
+    Registers SQLAlchemy events on the engine, so that time spent executing statements is recorded in the 'db' phase.
+    :param engine: Engine. The engine to instrument.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._timing_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_phase("db", time.perf_counter() - context._timing_start)
+
+class TimedRoute(APIRoute):
+    """
+    Route class that records how long the endpoint function took ('endpoint'), and how long FastAPI then took to
+    validate and serialize what it returned ('serialize'). Sync endpoints also add the thread they run in to the
+    request's profile, if it's being profiled (see app/utils/profiling.py).
+
+    Set as the router's route_class before any routes are registered.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+
+        route_handler = super().get_route_handler()
+
+        async def timed_route_handler(request):
+            response = await route_handler(request)
+            timings = request_timings.get()
+            if timings is not None and "_endpoint_finished" in timings:
+                record_phase("serialize", time.perf_counter() - timings.pop("_endpoint_finished"))
+            return response
+
+        return timed_route_handler
+
+def _timed_endpoint(endpoint):
+    """
+    Wraps an endpoint so its duration is recorded. The signature is preserved (via __wrapped__), so FastAPI still
+    resolves the endpoint's parameters and dependencies from the original function.
+    """
+
+    def _finish(start):
+        timings = request_timings.get()
+        if timings is not None:
+            finished = time.perf_counter()
+            record_phase("endpoint", finished - start, timings=timings)
+            timings["_endpoint_finished"] = finished
+
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _finish(start)
+
+    else:
+
+        # Async endpoints share the event loop's thread with other requests, so aren't added to profiles
+        @functools.wraps(endpoint)
+        def timed_endpoint(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with profiled_thread():
+                    return endpoint(*args, **kwargs)
+            finally:
+                _finish(start)
+
+    return timed_endpoint
@@ -0,0 +1,352 @@
+"""
+Lightweight, OpenTelemetry-style tracing. Spans have parent/child relationships, so a request can be broken down into
+its auth check, SQL statements, LLM calls and tool calls, and the time taken by each.
+
+The current span is held in a context variable, so spans started within another span become its children, including
+in threads that were started with a copy of the context (FastAPI's threadpool, LangChain tool calls).
+
+Finished spans are passed to an exporter, chosen via the TRACE_EXPORTER environment variable:
+
+none: Tracing is disabled, and starting a span does nothing. The default.
+memory: Spans are kept in memory (see InMemorySpanExporter), for tests and local debugging.
+file: Spans are appended as JSON lines to TRACE_FILE, by a background thread in each process.
+
+Other exporters can be plugged in with set_span_exporter.
+"""
+
+import json
+import queue
+import random
+import threading
+import time
+import atexit
+import functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getenv, getpid
+
+from sqlalchemy import event
+
+current_span: ContextVar["Span"] = ContextVar("current_span", default=None)
+
+# SQL is truncated in span attributes, to keep exported spans a sensible size
+MAX_STATEMENT_LENGTH = 500
+
+_span_exporter = None
+
+class Span:
+    """
+    A timed operation within a trace.
+    """
+
+    def __init__(self, name, trace_id, parent_span_id=None, attributes=None):
+
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        # Nanoseconds since the epoch, like OpenTelemetry
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exception):
+        self.status = "error"
+        self.attributes["exception.type"] = type(exception).__name__
+        self.attributes["exception.message"] = str(exception)
+
+    def end(self):
+        """
+        Ends the span, and passes it to the exporter. Does nothing if the span has already ended.
+        """
+
+        if self.end_time is not None:
+            return
+
+        self.end_time = time.time_ns()
+
+        if _span_exporter is not None:
+            _span_exporter.export(self)
+
+    @property
+    def duration_ms(self):
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start_time) / 1e6
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+class InMemorySpanExporter:
+    """
+    Keeps the most recent finished spans in memory.
+    """
+
+    def __init__(self, max_spans=10000):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def get_finished_spans(self, trace_id=None):
+        """
+        :param trace_id: str. Only return spans from this trace, if given.
+        :return: List[Span]. Finished spans, oldest first.
+        """
+
+        with self._lock:
+            spans = list(self._spans)
+
+        if trace_id is not None:
+            spans = [span for span in spans if span.trace_id == trace_id]
+
+        return spans
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+class FileSpanExporter:
+    """
+    Appends finished spans to a file as JSON lines. Writing happens on a background thread, so the threads that end
+    spans never wait on the disk. Spans are dropped, not waited on, if the queue fills up.
+
+    The thread is started by the first span exported in each process. Threads aren't copied into forked processes,
+    and gunicorn creates the exporter in its master when it preloads the app, then forks the workers.
+    """
+
+    def __init__(self, file_path, max_queued_spans=10000):
+
+        self.file_path = file_path
+        self.max_queued_spans = max_queued_spans
+        self.dropped_spans = 0
+
+        # The process the queue and thread belong to
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        atexit.register(self.shutdown)
+
+    def export(self, span):
+
+        if self._pid != getpid():
+            self._start()
+
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped_spans += 1
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queued_spans)
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), name="span-file-exporter", daemon=True)
+            self._thread.start()
+            self._pid = getpid()
+
+    def _run(self, span_queue):
+
+        with open(self.file_path, "a") as trace_file:
+            while True:
+                span_dict = span_queue.get()
+                if span_dict is None:
+                    break
+                trace_file.write(json.dumps(span_dict, default=str) + "\n")
+                # Only flush once caught up, rather than once per span
+                if span_queue.empty():
+                    trace_file.flush()
+
+    def shutdown(self):
+        if self._pid == getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+def set_span_exporter(exporter):
+    """
+    Sets where finished spans are sent. Passing None disables tracing.
+    :param exporter: Any. An object with an export(span) method, or None.
+    """
+
+    global _span_exporter
+    _span_exporter = exporter
+
+def get_span_exporter():
+    return _span_exporter
+
+def tracing_enabled():
+    return _span_exporter is not None
+
+def _exporter_from_environment():
+
+    exporter_name = getenv("TRACE_EXPORTER", "none").lower()
+
+    if exporter_name == "memory":
+        return InMemorySpanExporter()
+    if exporter_name == "file":
+        return FileSpanExporter(getenv("TRACE_FILE", "/tmp/traces.jsonl"))
+
+    return None
+
+set_span_exporter(_exporter_from_environment())
+
+def begin_span(name, parent=None, trace_id=None, parent_span_id=None, **attributes):
+    """
+    Starts a span and makes it the current span. For code that can't use the start_span context manager, such as
+    pairs of event hooks. Must be followed by a call to finish_span.
+    :param name: str. Name of the span.
+    :param parent: Span. The span's parent. Defaults to the current span.
+    :param trace_id: str. Trace to start the span in, when it has no parent span in this process.
+    :param parent_span_id: str. ID of a parent span from another process, such as a caller's traceparent header.
+    :param attributes: Any. Attributes of the span.
+    :return: Tuple(Span, Token). The span, and a token for finish_span. Both None if tracing is disabled.
+    """
+
+    if _span_exporter is None:
+        return None, None
+
+    if parent is None:
+        parent = current_span.get()
+
+    if parent is not None:
+        trace_id = parent.trace_id
+        parent_span_id = parent.span_id
+    elif trace_id is None:
+        trace_id = f"{random.getrandbits(128):032x}"
+
+    span = Span(name, trace_id=trace_id, parent_span_id=parent_span_id, attributes=attributes)
+
+    return span, current_span.set(span)
+
+def finish_span(span, token, exception=None):
+    """
+    Ends a span started by begin_span, and restores the previous current span.
+    :param span: Span. The span to end. Can be None, if tracing was disabled.
+    :param token: Token. The token returned by begin_span.
+    :param exception: Exception. The exception that ended the span, if any.
+    """
+
+    if span is None:
+        return
+
+    if exception is not None:
+        span.record_exception(exception)
+
+    span.end()
+
+    try:
+        current_span.reset(token)
+    except ValueError:
+        # Ended in a different context than it was started in (eg a cursor closed by another thread)
+        pass
+
+@contextmanager
+def start_span(name, **attributes):
+    """
+    Runs the with block in a new span, a child of the current span. Yields None if tracing is disabled.
+    """
+
+    span, token = begin_span(name, **attributes)
+    try:
+        yield span
+    except BaseException as e:
+        if span is not None:
+            span.record_exception(e)
+        raise
+    finally:
+        finish_span(span, token)
+
+def traced(name=None):
+    """
+    Decorator that runs each call of the function in a new span.
+    :param name: str. Name of the span. Defaults to the function's name.
+    """
+
+    def decorator(function):
+
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with start_span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def parse_traceparent(header_value):
+    """
+    Parses a W3C traceparent header, so that spans can continue a caller's trace.
+    :param header_value: str. The header's value, eg '00-<32 hex trace id>-<16 hex span id>-01'.
+    :return: Tuple(str, str). The trace ID and parent span ID, or (None, None) if the header is missing or invalid.
+    """
+
+    if not header_value:
+        return None, None
+
+    parts = header_value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None, None
+
+    return parts[1], parts[2]
+
+def instrument_engine_tracing(engine):
+    """
+    Registers SQLAlchemy events on the engine, so that each statement is recorded as a span.
+    :param engine: Engine. The engine to instrument.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Statements outside of a trace (eg at start up) aren't worth a trace of their own
+        if current_span.get() is None:
+            context._trace_span = None
+            return
+        context._trace_span = begin_span(
+            "sql",
+            **{
+                "db.system": "postgresql",
+                "db.statement": statement[:MAX_STATEMENT_LENGTH],
+                "db.executemany": executemany,
+            },
+        )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span, token = getattr(context, "_trace_span", None) or (None, None)
+        if span is not None:
+            span.set_attribute("db.rowcount", cursor.rowcount)
+        finish_span(span, token)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        execution_context = exception_context.execution_context
+        span, token = getattr(execution_context, "_trace_span", None) or (None, None)
+        finish_span(span, token, exception=exception_context.original_exception)
@@ -0,0 +1,127 @@
+"""
+A per-worker cache of users' login credentials (user_id, salt and password hash), by username.
+
+The app calls /users/salt and then /users/login for every login, and both need the same Users x UserPasswordHashes
+join, so with the cache only the first of the two reaches the database. Usernames that don't exist are cached too
+(negative caching), so floods of requests for made up usernames don't reach the database either.
+
+Entries are dropped when a user signs up or changes their password, but only in the worker that handled that request.
+Other workers keep their entries until they expire, so expiry times are kept short:
+
+USER_CACHE_TTL_SECONDS: How long credentials are cached for. Bounds how long another worker can accept an old password
+    after a password change.
+USER_CACHE_NEGATIVE_TTL_SECONDS: How long unknown usernames are cached for. Bounds how long another worker can report
+    a newly signed up username as not existing.
+USER_CACHE_SIZE: Maximum entries per worker, least recently used are dropped first. 0 disables the cache.
+"""
+
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from os import getenv
+
+from sqlalchemy.orm import Session
+
+from .metrics import user_cache_lookups_total
+from ..models import Users, UserPasswordHashes
+
+USER_CACHE_SIZE = int(getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(getenv("USER_CACHE_TTL_SECONDS", "300"))
+USER_CACHE_NEGATIVE_TTL_SECONDS = float(getenv("USER_CACHE_NEGATIVE_TTL_SECONDS", "10"))
+
+UserCredentials = namedtuple("UserCredentials", ["user_id", "salt", "hash"])
+
+class LRUCache:
+    """
+    Thread safe LRU cache with per-entry expiry. None can be cached, as a value, to record that something doesn't exist.
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # Key -> (expiry time, value), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        """
+        :return: Any. The cached value, or the given default (LRUCache.MISSING by default) if not cached or expired.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl_seconds):
+
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+_credentials_cache = LRUCache(USER_CACHE_SIZE)
+
+def get_user_credentials(
+    db_session: Session,
+    username,
+):
+    """
+    :param username: str. The username to look up.
+    :return: UserCredentials. The user's ID, salt and password hash, or None if there is no user with this username.
+    """
+
+    cached_credentials = _credentials_cache.get(username)
+    if cached_credentials is not LRUCache.MISSING:
+        user_cache_lookups_total.labels("hit" if cached_credentials is not None else "negative_hit").inc()
+        return cached_credentials
+
+    user_cache_lookups_total.labels("miss").inc()
+
+    # Use joins, to avoid a cartesian join
+    result = (
+        db_session
+        .query(Users.user_id, UserPasswordHashes.salt, UserPasswordHashes.hash)
+        .filter(Users.user_id == UserPasswordHashes.user_id)
+        .filter(Users.username == username)
+        .first()
+    )
+
+    if result is None:
+        _credentials_cache.set(username, None, USER_CACHE_NEGATIVE_TTL_SECONDS)
+        return None
+
+    credentials = UserCredentials(user_id=result.user_id, salt=result.salt, hash=result.hash)
+    _credentials_cache.set(username, credentials, USER_CACHE_TTL_SECONDS)
+
+    return credentials
+
+def invalidate_user_credentials(username):
+    """
+    Drops the cached credentials for a username, in this worker. Call after signing up a user, or changing a password.
+    :param username: str. The username.
+    """
+
+    _credentials_cache.delete(username)
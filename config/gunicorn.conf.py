@@ -1,6 +1,22 @@
+import os
+import shutil
+
 accesslog = '-'
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
 errorlog = '-'
 capture_output = True
 preload_app = True
-# timeout = 
\ No newline at end of file
+# timeout =
+
+# Workers write their Prometheus metrics to files here, so /metrics can aggregate them (see app/utils/metrics.py).
+# Has to be set before prometheus_client is imported, which happens when the app is preloaded.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+# Values left over from a previous run would otherwise be added to this run's
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+def child_exit(server, worker):
+    # Stops the exited worker's gauges from being included in livesum gauges
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
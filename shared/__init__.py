@@ -0,0 +1,4 @@
+"""
+Code used by both the API (app) and the tools in testing. Importing it has no side effects, unlike importing app, which
+reads the API's configuration and secrets, so tools can use it against any database without the API being configured.
+"""
@@ -0,0 +1,120 @@
+"""
+Compares random (uuid4) and time-ordered (uuid7) primary keys: insert throughput, and the size of the resulting
+primary key index. Rows are shaped like workout_component_history rows, and inserted in small transactions as the
+API does.
+
+    python -m testing.benchmarks.uuid_keys --rows 1000000
+
+Each key type gets its own scratch table, which is dropped afterwards. Differences grow with the number of rows, as
+random keys need more of the index to be in memory to insert into it, so use a row count whose index outgrows
+shared_buffers to see the effect on a real database.
+"""
+
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from psycopg2.extras import execute_values
+
+from shared.general import uuid7
+
+KEY_GENERATORS = {
+    "uuid4": uuid.uuid4,
+    "uuid7": uuid7,
+}
+
+def _create_table(cursor, table_name):
+    cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cursor.execute(
+        f"""
+        CREATE TABLE {table_name} (
+            id UUID PRIMARY KEY,
+            workout_component_id UUID NOT NULL,
+            datetime_added TIMESTAMP NOT NULL,
+            reps VARCHAR(30) NOT NULL,
+            weight FLOAT NOT NULL,
+            units VARCHAR(30) NOT NULL
+        )
+        """
+    )
+
+def benchmark_key_type(connection, key_name, rows, batch_size, keep_table=False):
+    """
+    :return: Dict. Insert throughput and table/index sizes for the key type.
+    """
+
+    generate_key = KEY_GENERATORS[key_name]
+    table_name = f"benchmark_{key_name}_keys"
+    rng = random.Random(0)
+    component_ids = [uuid.UUID(int=rng.getrandbits(128), version=4) for _ in range(1000)]
+
+    cursor = connection.cursor()
+    _create_table(cursor, table_name)
+    connection.commit()
+
+    start = time.perf_counter()
+
+    for _ in range(0, rows, batch_size):
+        now = datetime.utcnow()
+        batch = [
+            (str(generate_key()), str(rng.choice(component_ids)), now, "8-10", 20.0, "kg")
+            for _ in range(batch_size)
+        ]
+        execute_values(cursor, f"INSERT INTO {table_name} VALUES %s", batch)
+        connection.commit()
+
+    elapsed = time.perf_counter() - start
+
+    cursor.execute(
+        "SELECT pg_relation_size(%s), pg_relation_size(%s)",
+        (table_name, f"{table_name}_pkey"),
+    )
+    table_bytes, index_bytes = cursor.fetchone()
+
+    if not keep_table:
+        cursor.execute(f"DROP TABLE {table_name}")
+        connection.commit()
+
+    return {
+        "rows": rows,
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round(rows / elapsed),
+        "table_mb": round(table_bytes / 2**20, 1),
+        "index_mb": round(index_bytes / 2**20, 1),
+    }
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare uuid4 and uuid7 primary keys")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=10, help="Rows per transaction. The API inserts a few rows at a time")
+    parser.add_argument("--keep-tables", action="store_true", help="Keep the scratch tables, to inspect them")
+    parser.add_argument("--db-url", default=None, help="Defaults to the database configured for the API")
+    args = parser.parse_args()
+
+    if args.db_url is not None:
+        engine = create_engine(args.db_url)
+    else:
+        from app.database import engine
+
+    connection = engine.raw_connection()
+    try:
+        results = {
+            key_name: benchmark_key_type(connection, key_name, args.rows, args.batch_size, keep_table=args.keep_tables)
+            for key_name in KEY_GENERATORS
+        }
+    finally:
+        connection.close()
+
+    print(f"{'key':<8} {'rows/s':>10} {'seconds':>9} {'table MB':>9} {'pkey MB':>9}")
+    for key_name, result in results.items():
+        print(
+            f"{key_name:<8} {result['rows_per_second']:>10} {result['seconds']:>9} "
+            f"{result['table_mb']:>9} {result['index_mb']:>9}"
+        )
+
+if __name__ == "__main__":
+    main()
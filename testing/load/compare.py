@@ -0,0 +1,71 @@
+"""
+Compares two load test result files, such as runs before and after a change.
+
+    python -m testing.load.compare testing/load/results/before.json testing/load/results/after.json
+"""
+
+import argparse
+import json
+
+METRICS = [
+    ("throughput_rps", lambda summary: summary["throughput_rps"]),
+    ("error_rate", lambda summary: summary["error_rate"]),
+    ("p50_ms", lambda summary: summary["latency_ms"]["p50"]),
+    ("p95_ms", lambda summary: summary["latency_ms"]["p95"]),
+    ("p99_ms", lambda summary: summary["latency_ms"]["p99"]),
+]
+
+def _change(before, after):
+    if before is None or after is None:
+        return "n/a"
+    if before == 0:
+        return "n/a" if after == 0 else "new"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+def compare(before_results, after_results):
+    """
+    :return: List[Tuple]. (label, metric, before, after, change) for every endpoint found in both results.
+    """
+
+    def _summaries(results):
+        return {
+            **results["endpoints"],
+            "overall": results["overall"],
+            "scenario iterations": results["iterations"],
+        }
+
+    before_summaries = _summaries(before_results)
+    after_summaries = _summaries(after_results)
+
+    rows = []
+    for label in before_summaries:
+        if label not in after_summaries:
+            continue
+        for metric_name, get_metric in METRICS:
+            before = get_metric(before_summaries[label])
+            after = get_metric(after_summaries[label])
+            rows.append((label, metric_name, before, after, _change(before, after)))
+
+    return rows
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare two load test result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before) as before_file:
+        before_results = json.load(before_file)
+    with open(args.after) as after_file:
+        after_results = json.load(after_file)
+
+    print(f"before: {before_results.get('commit')} {before_results.get('label') or ''}")
+    print(f"after:  {after_results.get('commit')} {after_results.get('label') or ''}")
+
+    print(f"{'endpoint':<36} {'metric':<15} {'before':>10} {'after':>10} {'change':>9}")
+    for label, metric_name, before, after, change in compare(before_results, after_results):
+        print(f"{label:<36} {metric_name:<15} {str(before):>10} {str(after):>10} {change:>9}")
+
+if __name__ == "__main__":
+    main()
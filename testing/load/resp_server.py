@@ -0,0 +1,118 @@
+"""
+A minimal stand-in for Redis, for running the API with RESPONSE_CACHE_BACKEND=redis locally and in load tests
+without a Redis server. Speaks enough of the Redis protocol (RESP) for app/utils/response_cache.py: PING, AUTH,
+SELECT, GET, SET (with EX/PX), DEL, DBSIZE and FLUSHALL. Everything is kept in memory, with no eviction other than
+expiry.
+
+    python -m testing.load.resp_server --port 6379
+"""
+
+import argparse
+import asyncio
+import time
+
+# Key -> (expiry time or None, value)
+_store = {}
+
+def _encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode()
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+def _error(message):
+    return f"-ERR {message}\r\n".encode()
+
+def _get(key):
+    entry = _store.get(key)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    if expires_at is not None and expires_at <= time.monotonic():
+        del _store[key]
+        return None
+    return value
+
+def _set(args):
+    key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+    expires_at = None
+    if b"PX" in options:
+        expires_at = time.monotonic() + int(args[2 + options.index(b"PX") + 1]) / 1000
+    elif b"EX" in options:
+        expires_at = time.monotonic() + int(args[2 + options.index(b"EX") + 1])
+    _store[key] = (expires_at, value)
+    return "OK"
+
+COMMANDS = {
+    b"PING": lambda args: "PONG",
+    b"AUTH": lambda args: "OK",
+    b"SELECT": lambda args: "OK",
+    b"GET": lambda args: _get(args[0]),
+    b"SET": _set,
+    b"DEL": lambda args: sum(_store.pop(key, None) is not None for key in args),
+    b"DBSIZE": lambda args: len(_store),
+    b"FLUSHALL": lambda args: _store.clear() or "OK",
+}
+
+async def _read_command(reader):
+    """
+    :return: List[bytes]. The command and its arguments, or None if the client disconnected.
+    """
+
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, as sent by eg telnet
+        return line.split()
+
+    args = []
+    for _ in range(int(line[1:-2])):
+        length = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+async def _handle_client(reader, writer):
+
+    try:
+        while True:
+            args = await _read_command(reader)
+            if args is None:
+                break
+            if not args:
+                continue
+
+            command = COMMANDS.get(args[0].upper())
+            if command is None:
+                writer.write(_error(f"unknown command '{args[0].decode(errors='replace')}'"))
+            else:
+                try:
+                    writer.write(_encode(command(args[1:])))
+                except (IndexError, ValueError):
+                    writer.write(_error("wrong number or type of arguments"))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host, port):
+    server = await asyncio.start_server(_handle_client, host, port)
+    print(f"Listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Minimal in-memory Redis protocol server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port))
+
+if __name__ == "__main__":
+    main()
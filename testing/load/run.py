@@ -0,0 +1,229 @@
+"""
+Runs a load test against a running API, and writes the results to a JSON file.
+
+Example, against an API started with testing/load/start_app.sh:
+
+    python -m testing.load.run --scenario session --concurrency 20 --duration 60
+
+Each virtual user is signed up and given a workout, then runs the scenario in a loop until the duration is up. Results
+include throughput, latency percentiles and error rates, per endpoint and for whole scenario iterations.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+from .scenarios import SCENARIOS, VirtualUser, ScenarioError, setup_user
+
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+class Recorder:
+    """
+    Records the latency and outcome of every request made during the timed part of a test.
+    """
+
+    def __init__(self):
+        # Label -> list of (latency seconds, succeeded)
+        self.requests = defaultdict(list)
+        self.enabled = True
+
+    async def timed(self, label, response_coroutine):
+
+        start = time.perf_counter()
+        try:
+            response = await response_coroutine
+        except httpx.HTTPError:
+            if self.enabled:
+                self.requests[label].append((time.perf_counter() - start, False))
+            raise
+
+        if self.enabled:
+            self.requests[label].append((time.perf_counter() - start, response.status_code < 400))
+
+        return response
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile.
+    :param sorted_values: List[float]. Values, in ascending order.
+    :param fraction: float. Percentile as a fraction, eg 0.95.
+    :return: float. The percentile, or None if there are no values.
+    """
+
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarise(samples, duration):
+    """
+    :param samples: List[Tuple(float, bool)]. Latencies in seconds, and whether each succeeded.
+    :param duration: float. Seconds the timed part of the test ran for.
+    :return: Dict. Counts, throughput, error rate and latency percentiles (in milliseconds).
+    """
+
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, succeeded in samples if not succeeded)
+
+    def _ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / duration, 2) if duration > 0 else None,
+        "latency_ms": {
+            "mean": _ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": _ms(percentile(latencies, 0.50)),
+            "p95": _ms(percentile(latencies, 0.95)),
+            "p99": _ms(percentile(latencies, 0.99)),
+            "max": _ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+async def run_virtual_user(client, user, scenario, recorder, deadline, max_iterations, iterations):
+    """
+    Runs the scenario in a loop until the deadline or the maximum number of iterations.
+    """
+
+    completed = 0
+
+    while time.perf_counter() < deadline and (max_iterations is None or completed < max_iterations):
+
+        start = time.perf_counter()
+        try:
+            await scenario(client, user, recorder)
+            succeeded = True
+        except (ScenarioError, httpx.HTTPError, KeyError, ValueError):
+            succeeded = False
+
+        iterations.append((time.perf_counter() - start, succeeded))
+        completed += 1
+
+async def run_load_test(base_url, scenario_name, concurrency, duration, max_iterations, timeout):
+
+    scenario = SCENARIOS[scenario_name]
+    run_id = uuid.uuid4().hex[:8]
+    recorder = Recorder()
+    iterations = []
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+
+        users = [VirtualUser(run_id, index) for index in range(concurrency)]
+
+        # Setup isn't part of what's being measured
+        recorder.enabled = False
+        await asyncio.gather(*(setup_user(client, user, recorder) for user in users))
+        recorder.enabled = True
+
+        start = time.perf_counter()
+        deadline = start + duration
+
+        await asyncio.gather(
+            *(
+                run_virtual_user(client, user, scenario, recorder, deadline, max_iterations, iterations)
+                for user in users
+            )
+        )
+
+        elapsed = time.perf_counter() - start
+
+    return {
+        "endpoints": {
+            label: summarise(samples, elapsed)
+            for label, samples in sorted(recorder.requests.items())
+        },
+        "overall": summarise([sample for samples in recorder.requests.values() for sample in samples], elapsed),
+        "iterations": summarise(iterations, elapsed),
+        "elapsed_seconds": round(elapsed, 2),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(results):
+
+    print(f"{'endpoint':<36} {'count':>7} {'rps':>8} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8}")
+
+    rows = list(results["endpoints"].items()) + [("overall", results["overall"]), ("scenario iterations", results["iterations"])]
+    for label, summary in rows:
+        latency = summary["latency_ms"]
+        print(
+            f"{label:<36} {summary['count']:>7} {summary['throughput_rps'] or 0:>8.1f} {summary['error_rate'] * 100:>6.2f} "
+            f"{latency['p50'] or 0:>8.1f} {latency['p95'] or 0:>8.1f} {latency['p99'] or 0:>8.1f}"
+        )
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Load test the Workout App API")
+    parser.add_argument("--base-url", default="http://localhost:8080")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="session")
+    parser.add_argument("--concurrency", type=int, default=10, help="Number of virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run the timed part of the test for")
+    parser.add_argument("--iterations", type=int, default=None, help="Stop each virtual user after this many iterations")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout, in seconds")
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR)
+    parser.add_argument("--label", default=None, help="Added to the results file name, eg the change being tested")
+    args = parser.parse_args()
+
+    results = asyncio.run(
+        run_load_test(
+            base_url=args.base_url,
+            scenario_name=args.scenario,
+            concurrency=args.concurrency,
+            duration=args.duration,
+            max_iterations=args.iterations,
+            timeout=args.timeout,
+        )
+    )
+
+    started_at = datetime.now(timezone.utc)
+    commit = git_commit()
+
+    results = {
+        "scenario": args.scenario,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "base_url": args.base_url,
+        "commit": commit,
+        "label": args.label,
+        "timestamp": started_at.isoformat(),
+        **results,
+    }
+
+    print_summary(results)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    file_name = "_".join(
+        part for part in [
+            started_at.strftime("%Y%m%dT%H%M%S"),
+            commit,
+            args.scenario,
+            f"c{args.concurrency}",
+            args.label,
+        ]
+        if part
+    ) + ".json"
+    results_path = os.path.join(args.results_dir, file_name)
+
+    with open(results_path, "w") as results_file:
+        json.dump(results, results_file, indent=4)
+
+    print(f"Results written to {results_path}")
+
+if __name__ == "__main__":
+    main()
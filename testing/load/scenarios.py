@@ -0,0 +1,170 @@
+"""
+Scenarios for the load tests. Each mirrors how the mobile app uses the API, and is run repeatedly by every virtual
+user. setup() runs once per virtual user before the timed part of the test, and is not included in the results.
+"""
+
+import random
+import hashlib
+import uuid
+
+class ScenarioError(Exception):
+    pass
+
+class VirtualUser:
+    """
+    State kept by one simulated app user across iterations of a scenario.
+    """
+
+    def __init__(self, run_id, index):
+        self.username = f"load_{run_id}_{index}"[:30]
+        self.password = uuid.uuid4().hex
+        self.salt = uuid.uuid4().hex
+        self.access_token = None
+
+    def password_hash(self, salt):
+        # Mirrors the app, which only ever sends a hash of the password and the user's salt
+        return hashlib.sha256((self.password + salt).encode()).hexdigest()
+
+    @property
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+async def _expect(recorder, label, response_coroutine, expected_status):
+    """
+    Times a request, records it under the given label, and checks its status code.
+    :return: httpx.Response. The response.
+    :throws: ScenarioError if the status code wasn't the expected one, which ends the current iteration.
+    """
+
+    response = await recorder.timed(label, response_coroutine)
+    if response.status_code != expected_status:
+        raise ScenarioError(f"{label} returned {response.status_code}, expected {expected_status}: {response.text[:200]}")
+    return response
+
+async def setup_user(client, user, recorder):
+    """
+    Signs the user up, logs them in and gives them a workout, so the session scenario has something to work with.
+    """
+
+    await _expect(
+        recorder, "POST /users/signup",
+        client.post("/users/signup", json={"username": user.username, "hash": user.password_hash(user.salt), "salt": user.salt}),
+        201,
+    )
+    await log_in(client, user, recorder)
+    await _expect(
+        recorder, "POST /workouts/create",
+        client.post(
+            "/workouts/create",
+            # The app sends a key with each write, so its retries aren't recorded twice
+            headers={**user.auth_headers, "Idempotency-Key": str(uuid.uuid4())},
+            json={
+                "name": "Load Test Workout",
+                "ai_generated": False,
+                "workout_components": [
+                    {"exercise_name": "squats", "position": 0, "reps": "6-8", "weight": 60.0, "units": "kg"},
+                    {"exercise_name": "bicep_curls", "position": 1, "reps": "8-10", "weight": 12.0, "units": "kg"},
+                    {"exercise_name": "chest_fly", "position": 2, "reps": "10", "weight": 20.0, "units": "kg"},
+                    {"exercise_name": "leg_press", "position": 3, "reps": "8-12", "weight": 100.0, "units": "kg"},
+                ],
+            },
+        ),
+        201,
+    )
+
+async def log_in(client, user, recorder):
+    """
+    salt -> login -> access token, as the app does on launch.
+    """
+
+    salt_response = await _expect(
+        recorder, "GET /users/salt",
+        client.get("/users/salt", params={"username": user.username}),
+        200,
+    )
+    salt = salt_response.json()["payload"]["salt"]
+
+    login_response = await _expect(
+        recorder, "POST /users/login",
+        client.post("/users/login", json={"username": user.username, "hash": user.password_hash(salt)}),
+        201,
+    )
+    refresh_token = login_response.json()["payload"]["refresh_token"]
+
+    access_token_response = await _expect(
+        recorder, "GET /access_tokens",
+        client.get("/access_tokens", params={"refresh_token": refresh_token}),
+        200,
+    )
+    user.access_token = access_token_response.json()["payload"]["access_token"]
+
+async def session_scenario(client, user, recorder):
+    """
+    A full gym session: log in, load saved workouts, change a component during the workout, then finish it.
+    """
+
+    await log_in(client, user, recorder)
+
+    saved_response = await _expect(
+        recorder, "GET /workouts/saved",
+        client.get("/workouts/saved", headers=user.auth_headers),
+        200,
+    )
+    workouts = saved_response.json()["payload"]["workouts"]
+    if not workouts:
+        raise ScenarioError("User has no saved workouts")
+
+    workout_components = random.choice(workouts)["workout_components"]
+
+    # The app sends the whole workout on every save, with one or two weights changed
+    for workout_component in random.sample(workout_components, k=min(2, len(workout_components))):
+        workout_component["weight"] += 2.5
+
+    await _expect(
+        recorder, "POST /workouts/update/components",
+        client.post("/workouts/update/components", headers=user.auth_headers, json=workout_components),
+        200,
+    )
+    await _expect(
+        recorder, "POST /workouts/finish",
+        client.post(
+            "/workouts/finish",
+            headers={**user.auth_headers, "Idempotency-Key": str(uuid.uuid4())},
+            json=workout_components,
+        ),
+        201,
+    )
+
+async def read_scenario(client, user, recorder):
+    """
+    App launches without a workout: log in and load saved workouts.
+    """
+
+    await log_in(client, user, recorder)
+    await _expect(
+        recorder, "GET /workouts/saved",
+        client.get("/workouts/saved", headers=user.auth_headers),
+        200,
+    )
+
+async def recommendation_scenario(client, user, recorder):
+    """
+    Asks for a workout recommendation. Run the API with LLM_BACKEND=fake unless the cost of real calls is intended.
+    """
+
+    await log_in(client, user, recorder)
+    await _expect(
+        recorder, "POST /workouts/recommendation",
+        client.post(
+            "/workouts/recommendation",
+            headers=user.auth_headers,
+            json={"recommendation_request": "A workout for my legs please"},
+        ),
+        201,
+    )
+
+SCENARIOS = {
+    "session": session_scenario,
+    "read": read_scenario,
+    "recommendation": recommendation_scenario,
+}
@@ -0,0 +1,21 @@
+#!/bin/bash
+# Starts the API locally for load testing, using config/load.yaml (fake LLM, no GCP access needed).
+# Requires the local Postgres to be running: docker compose up core_db
+#
+# Usage: testing/load/start_app.sh [number of workers]
+
+set -e
+
+cd "$(dirname "$0")/../.."
+
+# config/*.yaml files are flat KEY: value pairs
+while IFS= read -r line; do
+    [[ -z "$line" || "$line" == \#* ]] && continue
+    key="${line%%:*}"
+    value="$(echo "${line#*:}" | sed -e 's/^ *//' -e 's/^"\(.*\)"$/\1/')"
+    export "$key=$value"
+done < config/load.yaml
+
+WORKERS="${1:-2}"
+
+exec gunicorn --bind ":$PORT" --workers "$WORKERS" --worker-class uvicorn.workers.UvicornWorker -c config/gunicorn.conf.py app:app
@@ -0,0 +1,215 @@
+"""
+Checks the rules that suggest each component's next session (calculate_progression in app/utils/progression.py), and
+that parse_reps (shared/general.py) parses reps the same way as the SQL that parsed existing versions in
+app/migrations/v0008_personal_records.py. Exits with a non-zero status if any case doesn't give what's expected.
+
+The progression cases are made up histories, all worked out in one call, as the components of a workout are. The reps
+cases are parsed by parse_reps, and by the migration's own statement, run against a temporary table in the database
+configured for the API (or --db-url) and rolled back:
+
+    python -m testing.progression.check
+"""
+
+import argparse
+import sys
+from collections import namedtuple
+
+from sqlalchemy import create_engine, text
+
+from app.migrations import v0008_personal_records
+from app.utils.progression import calculate_progression, KG_PER_LB, PROGRESS, REPEAT, DELOAD, START
+from shared.general import parse_reps
+
+# A row of _PROGRESSION_INPUTS in app/utils/progression.py
+ProgressionRow = namedtuple(
+    "ProgressionRow",
+    [
+        "workout_component_id", "position", "exercise_name", "reps", "reps_min", "reps_max", "weight", "units",
+        "weight_kg", "days_ago", "completed_reps", "completed_weight_kg",
+    ],
+)
+
+# Name, the component's latest version (reps, weight, units), its completions newest first (days ago, reps, weight in
+# kg), and the expected suggestion (action, weight, reps)
+PROGRESSION_CASES = [
+    (
+        "progress: current weight done twice, rising trend",
+        ("8-12", 60.0, "kg"),
+        [(2, 8, 60.0), (5, 8, 60.0), (9, 8, 57.5), (12, 8, 55.0)],
+        (PROGRESS, 62.5, "8-12"),
+    ),
+    (
+        "progress: lbs go up by 5, without enough sessions for a trend",
+        ("10", 20.0, "lbs"),
+        [(3, 10, 20 * KG_PER_LB), (6, 10, 20 * KG_PER_LB)],
+        (PROGRESS, 25.0, "10"),
+    ),
+    (
+        "progress: bodyweight adds a rep",
+        ("8", 0.0, "kg"),
+        [(2, 8, 0.0), (5, 8, 0.0)],
+        (PROGRESS, 0.0, "9"),
+    ),
+    (
+        "progress: identical maxes give a flat trend, not a falling one",
+        ("8", 57.5, "kg"),
+        [(1.3, 8, 57.5), (4.7, 8, 57.5), (8.1, 8, 57.5), (11.9, 8, 57.5), (15.2, 8, 57.5)],
+        (PROGRESS, 60.0, "8"),
+    ),
+    (
+        "deload: falling trend, latest max more than 10% below the best",
+        ("5", 100.0, "kg"),
+        [(2, 5, 80.0), (5, 5, 100.0), (9, 5, 110.0), (12, 5, 112.5)],
+        (DELOAD, 90.0, "5"),
+    ),
+    (
+        "repeat: falling trend, but within 10% of the best",
+        ("5", 105.0, "kg"),
+        [(2, 5, 105.0), (5, 5, 107.5), (9, 5, 110.0), (12, 5, 112.5)],
+        (REPEAT, 105.0, "5"),
+    ),
+    (
+        "repeat: current weight only done once",
+        ("8-12", 62.5, "kg"),
+        [(2, 8, 62.5), (5, 8, 60.0), (9, 8, 60.0)],
+        (REPEAT, 62.5, "8-12"),
+    ),
+    (
+        "repeat: bodyweight with no number of reps",
+        ("AMRAP", 0.0, "kg"),
+        [(1, None, 0.0), (3, None, 0.0)],
+        (REPEAT, 0.0, "AMRAP"),
+    ),
+    (
+        "refill: weight reset to 0 repeats the trend's weight",
+        ("10", 0.0, "kg"),
+        [(2, 10, 0.0), (5, 10, 50.0), (9, 10, 50.0), (12, 10, 47.5)],
+        (REPEAT, 50.0, "10"),
+    ),
+    (
+        "start: no recent sessions",
+        ("AMRAP", 10.0, "kg"),
+        [],
+        (START, 10.0, "AMRAP"),
+    ),
+]
+
+# Reps as saved, and the expected (reps_min, reps_max)
+REPS_CASES = [
+    ("8", (8, 8)),
+    ("6-8", (6, 8)),
+    ("8 to 12", (8, 12)),
+    ("12-8", (12, 12)),
+    ("3x10", (3, 10)),
+    ("  5  ", (5, 5)),
+    ("5-", (5, 5)),
+    ("-5", (5, 5)),
+    ("1-2-3", (1, 2)),
+    ("AMRAP", (None, None)),
+    ("", (None, None)),
+    ("max 8", (8, 8)),
+    ("1234567890", (123456789, 123456789)),
+]
+
+def progression_rows():
+    rows = []
+    for position, (name, (reps, weight, units), completions, _) in enumerate(PROGRESSION_CASES):
+        reps_min, reps_max = parse_reps(reps)
+        component = dict(
+            workout_component_id=f"component-{position}",
+            position=position,
+            exercise_name=name,
+            reps=reps,
+            reps_min=reps_min,
+            reps_max=reps_max,
+            weight=weight,
+            units=units,
+            weight_kg=weight * KG_PER_LB if units == "lbs" else weight,
+        )
+        # One row of nulls if there are no completions, as the query's left join gives
+        for days_ago, completed_reps, completed_weight_kg in completions or [(None, None, None)]:
+            rows.append(ProgressionRow(
+                **component,
+                days_ago=days_ago,
+                completed_reps=completed_reps,
+                completed_weight_kg=completed_weight_kg,
+            ))
+    return rows
+
+def check_progression():
+    """
+    :return: int. How many cases didn't give the expected suggestion.
+    """
+
+    failures = 0
+    suggestions = calculate_progression(progression_rows())
+
+    for (name, _, _, expected), suggestion in zip(PROGRESSION_CASES, suggestions):
+        result = (suggestion["action"], suggestion["suggested_weight"], suggestion["suggested_reps"])
+        passed = result == expected
+        if not passed:
+            failures += 1
+        print(f"{'ok' if passed else 'FAIL':<5} {name}: {result}" + ("" if passed else f", expected {expected}"))
+
+    return failures
+
+def check_reps(engine):
+    """
+    :return: int. How many cases parse_reps or the migration's SQL didn't parse as expected.
+    """
+
+    failures = 0
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            # Shadows the real table, so the migration's statement runs unchanged
+            connection.execute(text(
+                "CREATE TEMPORARY TABLE workout_component_history (reps VARCHAR(30), reps_min INTEGER, reps_max INTEGER)"
+            ))
+            connection.execute(
+                text("INSERT INTO workout_component_history (reps) VALUES (:reps)"),
+                [{"reps": reps} for reps, _ in REPS_CASES],
+            )
+            # The statement that parses the reps of existing versions
+            connection.execute(text(v0008_personal_records.STATEMENTS[1]))
+            parsed_by_sql = {
+                row.reps: (row.reps_min, row.reps_max)
+                for row in connection.execute(text("SELECT reps, reps_min, reps_max FROM workout_component_history"))
+            }
+        finally:
+            transaction.rollback()
+
+    for reps, expected in REPS_CASES:
+        parsed = parse_reps(reps)
+        passed = parsed == expected and parsed_by_sql[reps] == expected
+        if not passed:
+            failures += 1
+        print(
+            f"{'ok' if passed else 'FAIL':<5} reps {reps!r}: {parsed}"
+            + ("" if passed else f", SQL gave {parsed_by_sql[reps]}, expected {expected}")
+        )
+
+    return failures
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Check the progression rules, and that reps are parsed the same as in SQL")
+    parser.add_argument("--db-url", default=None, help="Defaults to the database configured for the API")
+    args = parser.parse_args()
+
+    if args.db_url is not None:
+        engine = create_engine(args.db_url)
+    else:
+        from app.database import engine
+
+    failures = check_progression() + check_reps(engine)
+
+    if failures:
+        print(f"{failures} case(s) failed")
+        sys.exit(1)
+
+    print("All cases passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Checks that the database work behind each endpoint in ROUTE_QUERY_BUDGETS (app/utils/query_budget.py) stays within
+its budget, so the budgets can't drift from what the routes actually do. Exits with a non-zero status if any don't, or
+if a budgeted route has no check here.
+
+Each route's database functions are called for a real user, in the same order as the route calls them, under
+query_budget(..., mode=RAISE), which also fails on N+1 patterns. Everything runs in one transaction that's rolled
+back, with the commits the functions make themselves only flushing, so the database is left as it was. Route budgets
+allow one more statement with sharding, for the lookup of the user's shard, which isn't made here.
+
+Run against the same seeded database as the query plan checks (see testing/seed), with the API's environment variables
+set:
+
+    python -m testing.query_plans.budgets
+"""
+
+import argparse
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from app.database import SessionLocal
+from app.models import FinishedWorkouts
+from app.schemas import LoginRequestSchema, RetrievedWorkoutComponentSchema, FinishedSessionSchema
+from app.utils.custom_exceptions import QueryBudgetExceededException
+from app.utils.database import (
+    login_user, get_workouts_for_user, insert_changed_component_versions, insert_finished_workout_components,
+    insert_finished_sessions,
+)
+from app.utils.logging import log_action, UNSUCCESSFUL_LOG_IN
+from app.utils.query_budget import ROUTE_QUERY_BUDGETS, RAISE, query_budget
+from app.utils.response_cache import get_user_data_version
+from app.utils.user_cache import get_user_credentials, invalidate_user_credentials
+from app.utils.sync import get_changes_for_user, encode_sync_cursor
+from app.utils.stats import get_user_stats, record_finished_workouts
+from app.utils.progression import suggest_next_session
+from app.utils.activity import resolve_date_range, get_user_activity
+
+from .check import find_busiest_user, find_latest_workout
+
+# Budgeted routes that don't touch the database
+ROUTES_WITHOUT_QUERIES = {"/access_tokens"}
+
+def _component_schemas(workout_components):
+    return [
+        RetrievedWorkoutComponentSchema(**{
+            key: workout_component[key]
+            for key in ("workout_component_id", "exercise_name", "position", "reps", "weight", "units")
+        })
+        for workout_component in workout_components
+    ]
+
+def _changed(workout_components):
+    # A new weight for the first component, so a version is inserted and the data version bumped
+    return [
+        workout_component.model_copy(update={"weight": workout_component.weight + 2.5}) if position == 0 else workout_component
+        for position, workout_component in enumerate(workout_components)
+    ]
+
+def route_work(username, user_id, workout_id, workout_components):
+    """
+    :return: Dict[str, Callable]. Route template -> function that makes the route's database calls, given a session.
+    """
+
+    def salt(db_session):
+        # Not cached, as for the first request of a login
+        invalidate_user_credentials(username)
+        get_user_credentials(db_session, username)
+
+    def login(db_session):
+        invalidate_user_credentials(username)
+        login_user(LoginRequestSchema(username=username, hash=""), db_session=db_session)
+        log_action(action_name=UNSUCCESSFUL_LOG_IN, username=username, db_session=db_session)
+
+    def saved(db_session):
+        # Not cached, so the workouts are read
+        get_user_data_version(db_session=db_session, user_id=user_id)
+        get_workouts_for_user(db_session=db_session, user_id=user_id)
+
+    def update_components(db_session):
+        insert_changed_component_versions(
+            db_session=db_session,
+            user_id=user_id,
+            workout_components=_changed(workout_components),
+        )
+        db_session.commit()
+
+    def finish(db_session):
+        finished_workout = FinishedWorkouts(user_id=user_id)
+        db_session.add(finished_workout)
+        db_session.flush()
+        insert_finished_workout_components(
+            db_session=db_session,
+            user_id=user_id,
+            finished_workout_id=finished_workout.finished_workout_id,
+            workout_component_ids=[workout_component.workout_component_id for workout_component in workout_components],
+        )
+        record_finished_workouts(
+            db_session=db_session,
+            user_id=user_id,
+            finished_workout_ids=[finished_workout.finished_workout_id],
+        )
+        db_session.commit()
+
+    def sessions(db_session):
+        completed_datetime = datetime.now(timezone.utc)
+        results = insert_finished_sessions(
+            db_session=db_session,
+            user_id=user_id,
+            sessions=[
+                FinishedSessionSchema(
+                    client_session_id=uuid.uuid4().hex,
+                    completed_datetime=completed_datetime - timedelta(hours=hours_ago),
+                    workout_components=session_components,
+                )
+                for hours_ago, session_components in [(2, workout_components), (1, _changed(workout_components))]
+            ],
+        )
+        db_session.flush()
+        record_finished_workouts(
+            db_session=db_session,
+            user_id=user_id,
+            finished_workout_ids=[result["finished_workout_id"] for result in results],
+        )
+        db_session.commit()
+
+    return {
+        "/users/salt": salt,
+        "/users/login": login,
+        "/workouts/saved": saved,
+        "/workouts/update/components": update_components,
+        "/workouts/finish": finish,
+        # From a version no user has, so the changes are always read rather than skipped as unchanged
+        "/sync": lambda db_session: get_changes_for_user(
+            db_session=db_session,
+            user_id=user_id,
+            cursor=encode_sync_cursor(-1, datetime.utcnow() - timedelta(days=7)),
+        ),
+        "/workouts/sessions": sessions,
+        "/users/stats": lambda db_session: get_user_stats(db_session=db_session, user_id=user_id),
+        # Weeks, which are cached, so the data version is read too
+        "/users/activity": lambda db_session: (
+            get_user_data_version(db_session=db_session, user_id=user_id),
+            get_user_activity(db_session, user_id, *resolve_date_range(), resolution="week"),
+        ),
+        "/workouts/{workout_id}/next": lambda db_session: suggest_next_session(
+            db_session=db_session,
+            user_id=user_id,
+            workout_id=workout_id,
+        ),
+    }
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Check that each route's database work stays within its query budget")
+    parser.add_argument("--username", default=None, help="User to run the routes for. Defaults to the user with the most workouts")
+    args = parser.parse_args()
+
+    db_session = SessionLocal()
+    # Everything is rolled back at the end, so the commits the functions make only flush, as a commit would first
+    db_session.commit = db_session.flush
+    failures = 0
+
+    try:
+
+        if args.username is not None:
+            user = db_session.execute(
+                text("SELECT username, user_id FROM users WHERE username = :username"),
+                {"username": args.username},
+            ).first()
+        else:
+            user = find_busiest_user(db_session)
+
+        if user is None:
+            print("No user to run the routes for, seed the database first (see testing/seed)")
+            sys.exit(2)
+
+        workout_id = find_latest_workout(db_session, user.user_id)
+        # The workout's components with their latest values, as the app would send them
+        workout_components = _component_schemas(
+            suggest_next_session(db_session=db_session, user_id=user.user_id, workout_id=workout_id)
+        )
+
+        work = route_work(user.username, user.user_id, workout_id, workout_components)
+
+        for route, max_queries in ROUTE_QUERY_BUDGETS.items():
+
+            if route in ROUTES_WITHOUT_QUERIES:
+                continue
+
+            if route not in work:
+                failures += 1
+                print(f"{'FAIL':<5} {route}: budgeted, but not checked here")
+                continue
+
+            try:
+                with query_budget(max_queries, name=route, mode=RAISE) as counter:
+                    work[route](db_session)
+                print(f"{'ok':<5} {route}: {counter.count} of {max_queries}")
+            except QueryBudgetExceededException as e:
+                failures += 1
+                print(f"{'FAIL':<5} {route}: {e}")
+
+    finally:
+        db_session.rollback()
+        db_session.close()
+
+    if failures:
+        print(f"{failures} route(s) over budget, or not checked")
+        sys.exit(1)
+
+    print("All routes are within their query budgets")
+
+if __name__ == "__main__":
+    main()
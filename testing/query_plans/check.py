@@ -0,0 +1,200 @@
+"""
+Checks that the API's hot per-user queries use indexes, rather than sequential scans of tables that grow with the
+number of users. Exits with a non-zero status if any don't, so it can be used as a check after schema or query changes.
+
+The queries checked are the ones the API actually sends: the database functions behind the hot endpoints are called
+for a real user, their statements are captured, and each is EXPLAINed with the same parameters.
+
+Run against a seeded database (see testing/seed), with the API's environment variables set:
+
+    python -m testing.query_plans.check
+
+On small databases the planner rightly prefers sequential scans, so use --disable-seqscan there. That only checks that
+an index path exists for each query, not that the planner would choose it.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, text
+
+from app.database import engine, SessionLocal
+from app.routes import get_salt
+from app.schemas import LoginRequestSchema
+from app.utils.database import login_user, get_workouts_for_user, get_latest_finished_workouts_for_user
+from app.utils.sync import get_changes_for_user, encode_sync_cursor
+from app.utils.stats import get_user_stats
+from app.utils.progression import suggest_next_session, suggest_recent_exercises
+from app.utils.activity import resolve_date_range, get_user_activity
+
+# Tables that grow with the number of users, which per-user queries must never scan in full
+PER_USER_TABLES = {
+    "users",
+    "user_password_hashes",
+    "user_workouts",
+    "workout_components",
+    "workout_component_history",
+    "finished_workouts",
+    "finished_workout_components",
+    "action_log",
+    "user_stats",
+    "user_workout_periods",
+    "user_exercise_stats",
+    "user_daily_activity",
+}
+
+def hot_queries(username, user_id, workout_id):
+    """
+    :return: Dict[str, Callable]. Name -> function that runs the query, given a session.
+    """
+
+    return {
+        "GET /users/salt": lambda db_session: get_salt(username=username, db_session=db_session),
+        "POST /users/login": lambda db_session: login_user(LoginRequestSchema(username=username, hash=""), db_session=db_session),
+        "GET /workouts/saved": lambda db_session: get_workouts_for_user(db_session=db_session, user_id=user_id),
+        "get_past_5_workouts_tool": lambda db_session: get_latest_finished_workouts_for_user(db_session=db_session, user_id=user_id),
+        "get_past_5_workouts_tool suggestions": lambda db_session: suggest_recent_exercises(db_session=db_session, user_id=user_id),
+        # From a version no user has, so the changes are always read rather than skipped as unchanged
+        "GET /sync": lambda db_session: get_changes_for_user(
+            db_session=db_session,
+            user_id=user_id,
+            cursor=encode_sync_cursor(-1, datetime.utcnow() - timedelta(days=7)),
+        ),
+        "GET /users/stats": lambda db_session: get_user_stats(db_session=db_session, user_id=user_id),
+        "GET /users/activity": lambda db_session: get_user_activity(
+            db_session,
+            user_id,
+            *resolve_date_range(),
+            resolution="week",
+        ),
+        "GET /workouts/{workout_id}/next": lambda db_session: suggest_next_session(
+            db_session=db_session,
+            user_id=user_id,
+            workout_id=workout_id,
+        ),
+    }
+
+def capture_statements(db_session, run_query):
+    """
+    :return: List[Tuple(str, Any)]. The SELECT (and WITH) statements the query ran, with their parameters.
+    """
+
+    statements = []
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        run_query(db_session)
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+
+    return statements
+
+def plan_nodes(plan):
+    yield plan
+    for child_plan in plan.get("Plans", []):
+        yield from plan_nodes(child_plan)
+
+def full_scans(db_session, statement, parameters):
+    """
+    :return: Tuple(List[str], List[str]). Per-user tables the statement scans in full, and every scan it uses.
+    """
+
+    explain_result = db_session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+    if isinstance(explain_result, str):
+        explain_result = json.loads(explain_result)
+
+    scans = []
+    sequential_scans = []
+    for node in plan_nodes(explain_result[0]["Plan"]):
+        relation_name = node.get("Relation Name")
+        if relation_name is None:
+            continue
+        index_name = node.get("Index Name")
+        scans.append(f"{node['Node Type']} on {relation_name}" + (f" using {index_name}" if index_name else ""))
+        if node["Node Type"] == "Seq Scan" and relation_name in PER_USER_TABLES:
+            sequential_scans.append(relation_name)
+
+    return sequential_scans, scans
+
+def find_busiest_user(db_session):
+    # The user with the most workouts, whose queries touch the most rows
+    return db_session.execute(
+        text(
+            "SELECT users.username, users.user_id FROM users "
+            "JOIN user_workouts ON user_workouts.user_id = users.user_id "
+            "GROUP BY users.user_id ORDER BY count(*) DESC LIMIT 1"
+        )
+    ).first()
+
+def find_latest_workout(db_session, user_id):
+    return db_session.execute(
+        text(
+            "SELECT workout_id FROM user_workouts WHERE user_id = :user_id "
+            "ORDER BY datetime_created DESC LIMIT 1"
+        ),
+        {"user_id": user_id},
+    ).scalar()
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Check that hot per-user queries use indexes")
+    parser.add_argument("--username", default=None, help="User to run the queries for. Defaults to the user with the most workouts")
+    parser.add_argument("--disable-seqscan", action="store_true", help="Only check that index paths exist, for small databases")
+    parser.add_argument("--verbose", action="store_true", help="Print every scan in each plan")
+    args = parser.parse_args()
+
+    db_session = SessionLocal()
+    failures = 0
+
+    try:
+
+        if args.username is not None:
+            user = db_session.execute(
+                text("SELECT username, user_id FROM users WHERE username = :username"),
+                {"username": args.username},
+            ).first()
+        else:
+            user = find_busiest_user(db_session)
+
+        if user is None:
+            print("No user to run the queries for, seed the database first (see testing/seed)")
+            sys.exit(2)
+
+        if args.disable_seqscan:
+            db_session.execute(text("SET enable_seqscan = off"))
+
+        workout_id = find_latest_workout(db_session, user.user_id)
+
+        for query_name, run_query in hot_queries(user.username, user.user_id, workout_id).items():
+
+            for statement, parameters in capture_statements(db_session, run_query):
+
+                sequential_scans, scans = full_scans(db_session, statement, parameters)
+                if sequential_scans:
+                    failures += 1
+
+                print(f"{'FAIL' if sequential_scans else 'ok':<5} {query_name}: {' '.join(statement.split())[:100]}")
+                if sequential_scans:
+                    print(f"      sequential scans of: {', '.join(sequential_scans)}")
+                if args.verbose or sequential_scans:
+                    for scan in scans:
+                        print(f"      {scan}")
+
+    finally:
+        db_session.rollback()
+        db_session.close()
+
+    if failures:
+        print(f"{failures} statement(s) scan per-user tables in full")
+        sys.exit(1)
+
+    print("All hot queries use indexes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Generates synthetic users, workouts, component histories, finished workouts and action logs, shaped like real usage.
+
+Each user's data comes from its own random generator, seeded from the dataset seed and the user's index, so a given
+seed always produces the same rows however the users are split into batches.
+
+Keys are time-ordered UUIDs (version 7), built from each row's generated time, as the API's keys are generated when
+their rows are created. So seeded tables have the same index locality as real ones.
+
+Activity is heavy tailed, as in real apps: most users have a handful of workouts and sessions, and a few have
+hundreds of sessions (and so long component histories).
+"""
+
+import math
+import random
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from shared.general import build_uuid7
+
+# Password shared by every seeded user, so load tests can log in as them
+SEEDED_PASSWORD = "seeded-password"
+
+REP_RANGES = ["5", "6-8", "8", "8-10", "8-12", "10", "10-12", "12", "12-15", "15"]
+
+UNITS = [("kg", 0.85), ("lbs", 0.15)]
+
+# Rough starting weights in kg. Exercises not listed start from DEFAULT_START_WEIGHT.
+START_WEIGHTS = {
+    "squats": 60.0,
+    "romanian_deadlifts": 60.0,
+    "leg_press": 100.0,
+    "lat_pull_downs": 45.0,
+    "seated_rows": 45.0,
+    "tricep_pulldowns": 20.0,
+    "flat_dumbell_press": 22.0,
+    "incline_dumbell_press": 18.0,
+    "bicep_curls": 12.0,
+    "lateral_raises": 8.0,
+    "forward_dumbell_raises": 8.0,
+    "pistol_squats": 0.0,
+    "dips": 0.0,
+    "push_ups": 0.0,
+}
+DEFAULT_START_WEIGHT = 15.0
+
+KG_TO_LBS = 2.20462
+
+WORKOUT_NAMES = [
+    "Push", "Pull", "Legs", "Upper", "Lower", "Full Body", "Arms", "Chest and Back", "Shoulders",
+    "Morning Session", "Gym A", "Gym B", "Home Workout", "Strength", "Hypertrophy",
+]
+
+class SeededUser:
+    """
+    All of the rows generated for one user, ready to be loaded.
+    """
+
+    def __init__(self):
+        self.user = None
+        self.password_hash = None
+        self.user_workouts = []
+        self.workout_components = []
+        self.workout_component_history = []
+        self.finished_workouts = []
+        self.finished_workout_components = []
+        self.action_log = []
+
+def _uuid(rng, created):
+    """
+    :param created: datetime. When the row was created, in UTC.
+    :return: UUID. A version 7 UUID for that time, with the rest of its bits from rng.
+    """
+
+    timestamp_ms = int(created.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return build_uuid7(timestamp_ms, rng.getrandbits(12), rng.getrandbits(62))
+
+def _pick_units(rng):
+    return rng.choices([units for units, _ in UNITS], weights=[weight for _, weight in UNITS])[0]
+
+def _heavy_tailed_count(rng, median, sigma, maximum):
+    """
+    :return: int. A log-normally distributed count, at least 1 and at most maximum.
+    """
+
+    return max(1, min(maximum, int(rng.lognormvariate(math.log(median), sigma))))
+
+def generate_user(
+    seed,
+    user_index,
+    exercise_ids,
+    action_ids,
+    end_datetime,
+    days,
+    median_sessions=20,
+    max_sessions=600,
+):
+    """
+    :param seed: int. The dataset's seed.
+    :param user_index: int. The user's index within the dataset, which also makes its username unique.
+    :param exercise_ids: Dict[str, UUID]. Exercise name -> exercise_id, from the exercises table.
+    :param action_ids: Dict[str, UUID]. Action name -> action_id, from the actions table.
+    :param end_datetime: datetime. All generated activity happens before this.
+    :param days: int. How many days of activity to generate, at most, before end_datetime.
+    :param median_sessions: int. Median number of finished workouts per user.
+    :param max_sessions: int. Cap on finished workouts per user.
+    :return: SeededUser. The user's rows.
+    """
+
+    rng = random.Random(f"{seed}:{user_index}")
+    rows = SeededUser()
+
+    # Users join at different points in the period, and are active from then on
+    signed_up = end_datetime - timedelta(days=rng.uniform(1, days))
+    active_seconds = (end_datetime - signed_up).total_seconds()
+
+    user_id = _uuid(rng, signed_up)
+    salt = uuid.UUID(int=rng.getrandbits(128)).hex
+    rows.user = (user_id, f"seed{seed}_{user_index}"[:30])
+    rows.password_hash = (user_id, hashlib.sha256((SEEDED_PASSWORD + salt).encode()).hexdigest(), salt)
+
+    units = _pick_units(rng)
+    exercise_names = sorted(exercise_ids)
+
+    # Workouts -> their components, as [component_id, exercise_name, reps, weight]
+    workouts = []
+    for _ in range(_heavy_tailed_count(rng, median=3, sigma=0.6, maximum=20)):
+
+        created = signed_up + timedelta(seconds=rng.uniform(0, min(active_seconds, 14 * 86400)))
+        workout_id = _uuid(rng, created)
+        rows.user_workouts.append((
+            workout_id,
+            user_id,
+            rng.choice(WORKOUT_NAMES),
+            rng.random() < 0.1,
+            created,
+        ))
+
+        components = []
+        for position, exercise_name in enumerate(rng.sample(exercise_names, rng.randint(3, min(8, len(exercise_names))))):
+
+            component_id = _uuid(rng, created)
+            weight = START_WEIGHTS.get(exercise_name, DEFAULT_START_WEIGHT) * rng.uniform(0.6, 1.3)
+            if units == "lbs":
+                weight *= KG_TO_LBS
+            weight = round(weight / 2.5) * 2.5
+            reps = rng.choice(REP_RANGES)
+
+            rows.workout_components.append((component_id, workout_id, exercise_ids[exercise_name], position))
+            rows.workout_component_history.append((_uuid(rng, created), component_id, created, reps, weight, units))
+            components.append([component_id, exercise_name, reps, weight])
+
+        workouts.append((created, components))
+
+    # Earlier workouts are the user's favourites, and are done more often
+    workout_weights = [1 / (rank + 1) for rank in range(len(workouts))]
+
+    session_count = _heavy_tailed_count(rng, median=median_sessions, sigma=1.0, maximum=max_sessions)
+    session_times = sorted(
+        # Leaving room for the session itself and any edits after it, before end_datetime
+        signed_up + timedelta(seconds=rng.uniform(0, active_seconds - 3 * 3600))
+        for _ in range(session_count)
+    )
+
+    for session_time in session_times:
+
+        created, components = rng.choices(workouts, weights=workout_weights)[0]
+        if session_time < created:
+            continue
+
+        # Logging in before the session, sometimes after getting the password wrong
+        login_time = session_time - timedelta(minutes=rng.uniform(1, 10))
+        if rng.random() < 0.05:
+            failed_login_time = login_time - timedelta(seconds=20)
+            rows.action_log.append((_uuid(rng, failed_login_time), user_id, action_ids["UNSUCCESSFUL_LOG_IN"], failed_login_time))
+        rows.action_log.append((_uuid(rng, login_time), user_id, action_ids["SUCCESSFUL_LOG_IN"], login_time))
+
+        completed = session_time + timedelta(minutes=rng.uniform(30, 90))
+        finished_workout_id = _uuid(rng, completed)
+        rows.finished_workouts.append((finished_workout_id, user_id, completed))
+        for component_id, *_ in components:
+            rows.finished_workout_components.append((_uuid(rng, completed), finished_workout_id, component_id))
+
+        # Progressing some exercises after the session, each of which is a new history version
+        for component in components:
+            if rng.random() < 0.3:
+                component_id, exercise_name, reps, weight = component
+                if weight > 0 and rng.random() < 0.7:
+                    weight += 2.5 if units == "kg" else 5.0
+                else:
+                    reps = rng.choice(REP_RANGES)
+                component[2], component[3] = reps, weight
+                edited = completed + timedelta(seconds=rng.uniform(10, 600))
+                rows.workout_component_history.append((_uuid(rng, edited), component_id, edited, reps, weight, units))
+
+        if rng.random() < 0.02:
+            logged_out = completed + timedelta(minutes=5)
+            rows.action_log.append((_uuid(rng, logged_out), user_id, action_ids["LOGGED_OUT"], logged_out))
+
+    return rows
+
+def default_end_datetime():
+    # Midnight today, so repeated runs on the same day produce identical timestamps
+    return datetime.combine(datetime.utcnow().date(), datetime.min.time())
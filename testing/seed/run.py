@@ -0,0 +1,234 @@
+"""
+Seeds a database with synthetic users and their workout data, for benchmarks and query plan checks at production
+scale. Rows are loaded directly with Postgres COPY (or batched multi-row INSERTs), rather than through the API.
+
+Example, against the local Postgres, with the tables already created (POST /create_tables):
+
+    python -m testing.seed.run --users 10000 --seed 1
+
+The database is the one the API would use, configured by the same environment variables (eg config/load.yaml), unless
+--db-url is given. Seeded users' stats are then rebuilt, which needs the API's configuration, so with --db-url they're
+left for python -m app.utils.stats rebuild, run with the API configured for that database. The same seed and arguments
+always produce the same rows. Usernames include the seed, so datasets
+with different seeds can be loaded side by side, and --first-user can be used to add more users to an existing one.
+
+Seeded users can log in with the password in testing/seed/generate.py (SEEDED_PASSWORD).
+"""
+
+import argparse
+import csv
+import io
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from psycopg2.extras import execute_values
+
+from shared.general import parse_reps
+
+from .generate import generate_user, default_end_datetime
+
+# Table -> columns, in the order generate_user's rows give them. Tables are loaded in this order, to satisfy foreign keys.
+TABLE_COLUMNS = {
+    "users": ["user_id", "username"],
+    "user_password_hashes": ["user_id", "hash", "salt"],
+    "user_workouts": ["workout_id", "user_id", "workout_name", "ai_generated", "datetime_created"],
+    "workout_components": ["workout_component_id", "workout_id", "exercise_id", "position"],
+    "workout_component_history": [
+        "workout_component_history_id", "workout_component_id", "datetime_added", "reps", "weight", "units", "reps_min", "reps_max",
+    ],
+    "finished_workouts": ["finished_workout_id", "user_id", "completed_datetime"],
+    "finished_workout_components": ["finished_workout_component_id", "finished_workout_id", "workout_component_id"],
+    "action_log": ["log_id", "user_id", "action_id", "action_datetime"],
+}
+
+def _rows_by_table(seeded_users):
+
+    rows = {table_name: [] for table_name in TABLE_COLUMNS}
+
+    for seeded_user in seeded_users:
+        rows["users"].append(seeded_user.user)
+        rows["user_password_hashes"].append(seeded_user.password_hash)
+        rows["user_workouts"].extend(seeded_user.user_workouts)
+        rows["workout_components"].extend(seeded_user.workout_components)
+        # Reps are parsed when versions are saved, as the API does
+        rows["workout_component_history"].extend(row + parse_reps(row[3]) for row in seeded_user.workout_component_history)
+        rows["finished_workouts"].extend(seeded_user.finished_workouts)
+        rows["finished_workout_components"].extend(seeded_user.finished_workout_components)
+        rows["action_log"].extend(seeded_user.action_log)
+
+    return rows
+
+def copy_rows(cursor, table_name, rows):
+    """
+    Loads rows with COPY ... FROM STDIN, the fastest way to bulk load into Postgres.
+    """
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    columns = ", ".join(TABLE_COLUMNS[table_name])
+    cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def insert_rows(cursor, table_name, rows, page_size=1000):
+    """
+    Loads rows with multi-row INSERTs, for databases where COPY isn't allowed.
+    """
+
+    columns = ", ".join(TABLE_COLUMNS[table_name])
+    execute_values(cursor, f"INSERT INTO {table_name} ({columns}) VALUES %s", rows, page_size=page_size)
+
+LOAD_METHODS = {
+    "copy": copy_rows,
+    "insert": insert_rows,
+}
+
+def _lookup_ids(cursor, query):
+    cursor.execute(query)
+    return {name: row_id for name, row_id in cursor.fetchall()}
+
+def seed(
+    engine,
+    users,
+    seed_value,
+    first_user=0,
+    batch_size=500,
+    method="copy",
+    days=365,
+    end_datetime=None,
+    median_sessions=20,
+    max_sessions=600,
+    rebuild_stats=True,
+):
+    """
+    :param engine: Engine. The database to load into. Its tables must already exist, including the exercises and actions.
+    :param users: int. Number of users to generate.
+    :param seed_value: int. Seed for the generated data.
+    :param first_user: int. Index of the first user to generate, to extend a dataset made with the same seed.
+    :param batch_size: int. Users loaded per transaction.
+    :param method: str. 'copy' or 'insert'.
+    :param rebuild_stats: bool. Whether to rebuild the seeded users' stats, which imports the app, and so needs the
+        API's configuration.
+    :return: Dict[str, int]. Rows loaded per table.
+    """
+
+    if rebuild_stats:
+        # Imported here, as importing the app connects using the API's configuration
+        from app.utils.stats import rebuild_user_stats
+
+    load_rows = LOAD_METHODS[method]
+    end_datetime = end_datetime or default_end_datetime()
+    row_counts = {table_name: 0 for table_name in TABLE_COLUMNS}
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+
+        exercise_ids = _lookup_ids(cursor, "SELECT exercise_name, exercise_id FROM exercises")
+        action_ids = _lookup_ids(cursor, "SELECT action_name, action_id FROM actions")
+        if not exercise_ids or not action_ids:
+            raise RuntimeError("The exercises and actions tables are empty, create the tables first (POST /create_tables)")
+
+        start = time.perf_counter()
+
+        for batch_start in range(first_user, first_user + users, batch_size):
+
+            batch_end = min(batch_start + batch_size, first_user + users)
+            seeded_users = [
+                generate_user(
+                    seed=seed_value,
+                    user_index=user_index,
+                    exercise_ids=exercise_ids,
+                    action_ids=action_ids,
+                    end_datetime=end_datetime,
+                    days=days,
+                    median_sessions=median_sessions,
+                    max_sessions=max_sessions,
+                )
+                for user_index in range(batch_start, batch_end)
+            ]
+
+            # One transaction per batch, so an interrupted run leaves whole users behind
+            for table_name, rows in _rows_by_table(seeded_users).items():
+                if rows:
+                    load_rows(cursor, table_name, rows)
+                    row_counts[table_name] += len(rows)
+            connection.commit()
+
+            # Stats are kept up to date by the API as workouts are finished, so rows loaded directly need them rebuilt
+            if rebuild_stats:
+                with Session(engine) as db_session:
+                    rebuild_user_stats(db_session, [seeded_user.user[0] for seeded_user in seeded_users])
+                    db_session.commit()
+
+            loaded = batch_end - first_user
+            elapsed = time.perf_counter() - start
+            print(
+                f"{loaded}/{users} users, {row_counts['workout_component_history']} history rows, "
+                f"{elapsed:.1f}s ({loaded / elapsed:.0f} users/s)"
+            )
+
+        # Fresh statistics, so query plans reflect the new table sizes straight away
+        connection.autocommit = True
+        for table_name in TABLE_COLUMNS:
+            cursor.execute(f"ANALYZE {table_name}")
+
+    finally:
+        connection.close()
+
+    return row_counts
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Seed the database with synthetic workout data")
+    parser.add_argument("--users", type=int, default=1000, help="Number of users to generate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated data")
+    parser.add_argument("--first-user", type=int, default=0, help="Index of the first user, to extend an existing dataset")
+    parser.add_argument("--batch-size", type=int, default=500, help="Users loaded per transaction")
+    parser.add_argument("--method", choices=sorted(LOAD_METHODS), default="copy")
+    parser.add_argument("--days", type=int, default=365, help="Days of activity to generate")
+    parser.add_argument(
+        "--end-date",
+        type=datetime.fromisoformat,
+        default=None,
+        help="Activity ends at this date (YYYY-MM-DD). Defaults to today, so set it when data must match across days",
+    )
+    parser.add_argument("--median-sessions", type=int, default=20, help="Median finished workouts per user")
+    parser.add_argument("--max-sessions", type=int, default=600, help="Cap on finished workouts per user")
+    parser.add_argument(
+        "--db-url",
+        default=None,
+        help="Defaults to the database configured for the API. Stats aren't rebuilt, as that needs the API's configuration",
+    )
+    args = parser.parse_args()
+
+    if args.db_url is not None:
+        engine = create_engine(args.db_url)
+    else:
+        # Imported here, as importing it connects using the API's configuration
+        from app.database import engine
+
+    row_counts = seed(
+        engine,
+        users=args.users,
+        seed_value=args.seed,
+        first_user=args.first_user,
+        batch_size=args.batch_size,
+        method=args.method,
+        days=args.days,
+        end_datetime=args.end_date,
+        median_sessions=args.median_sessions,
+        max_sessions=args.max_sessions,
+        rebuild_stats=args.db_url is None,
+    )
+
+    for table_name, row_count in row_counts.items():
+        print(f"{table_name:<30} {row_count:>12}")
+
+    if args.db_url is not None:
+        print("Stats weren't rebuilt, run python -m app.utils.stats rebuild with the API configured for this database")
+
+if __name__ == "__main__":
+    main()